@@ -1,8 +1,7 @@
 from logging import NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL
-
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from os.path import abspath
+from threading import Lock
+from typing import Dict
 
 default_logging_setup = dict(
     level=INFO,
@@ -19,13 +18,129 @@ logging_setup = dict(
     backupCount=16,
 )
 
-# Setting up HTTPS Requests retry strategy
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[429, 500, 502, 503, 504, 506],
-    method_whitelist=["HEAD", "GET", "POST"],
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-https = Session()
-https.mount("https://", adapter)
+# Records go through a queue to a listener thread that owns logzero's handlers,
+# so worker threads never wait on the stream/rotating file handlers' locks and I/O
+queue_logging = True
+_queue_listeners: Dict[str, object] = {}
+_queue_lock = Lock()
+
+_https = None
+_https_lock = Lock()
+
+
+def get_https():
+    """
+    Returns the shared HTTPS Session, built (with its retry strategy) on first use
+    so importing the package does not pull in requests.
+    """
+    global _https
+    if _https is None:
+        with _https_lock:
+            if _https is None:
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                from requests.packages.urllib3.util.retry import Retry
+
+                # Setting up HTTPS Requests retry strategy
+                retry_strategy = Retry(
+                    total=3,
+                    backoff_factor=1,
+                    status_forcelist=[429, 500, 502, 503, 504, 506],
+                    method_whitelist=["HEAD", "GET", "POST"],
+                )
+                adapter = HTTPAdapter(max_retries=retry_strategy)
+                session = Session()
+                session.mount("https://", adapter)
+                _https = session
+    return _https
+
+
+def attach_queue(logger):
+    """
+    Moves the logger's handlers behind a QueueHandler served by a QueueListener thread
+    """
+    from atexit import register
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import SimpleQueue
+
+    queue = SimpleQueue()
+    listener = QueueListener(queue, *logger.handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(queue))
+    with _queue_lock:
+        if not _queue_listeners:
+            register(stop_queue_listeners)
+        _queue_listeners[logger.name] = listener
+    listener.start()
+
+
+def detach_queue(logger):
+    """
+    Flushes and stops the logger's listener, putting its handlers back on the logger
+    (logzero's setup_logger() reconfigures a logger by its handlers)
+    """
+    from logging.handlers import QueueHandler
+
+    with _queue_lock:
+        listener = _queue_listeners.pop(logger.name, None)
+    if listener is None:
+        return
+    listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+def stop_queue_listeners():
+    with _queue_lock:
+        listeners = list(_queue_listeners.values())
+        _queue_listeners.clear()
+    for listener in listeners:
+        listener.stop()
+
+
+class LazyLogger:
+    """
+    Stand-in for logzero.setup_logger(**kwargs): the logger (and its rotating file
+    handler) is only created when it is used for the first time.
+    """
+    def __init__(self, **kwargs):
+        if kwargs.get("logfile"):
+            # Resolved now, as setup_logger() would have done at import time
+            kwargs["logfile"] = abspath(kwargs["logfile"])
+        self.__kwargs = kwargs
+        self.__logger = None
+        self.__lock = Lock()
+
+    @property
+    def logger(self):
+        if self.__logger is None:
+            with self.__lock:
+                if self.__logger is None:
+                    from logging import getLogger
+
+                    from logzero import setup_logger
+
+                    detach_queue(getLogger(self.__kwargs.get("name")))
+                    logger = setup_logger(**self.__kwargs)
+                    if queue_logging:
+                        attach_queue(logger)
+                    self.__logger = logger
+        return self.__logger
+
+    def __getattr__(self, item):
+        return getattr(self.logger, item)
+
+
+def lazy_logger(**kwargs) -> LazyLogger:
+    return LazyLogger(**kwargs)
+
+
+def __getattr__(name):
+    # Backwards compatibility for `from app import https`
+    if name == "https":
+        return get_https()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
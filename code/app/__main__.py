@@ -0,0 +1,602 @@
+"""
+Command line entry point: python -m app <command> [options]
+
+    discover  Search GitHub for top Python repositories (top_python_repositories.gql)
+    enrich    Fill repository details (python_repos_details.gql) into the bulk CSV
+    prefilter Keep only repositories whose tree has a container manifest (before clone)
+    clone     Clone the repositories listed in a CSV
+    scan      Extract logger calls from cloned repositories
+    pipeline  Clone and scan within a disk budget, evicting scanned clones
+    history   Count logger calls over each repository's history (sampled commits)
+    merge     Combine and deduplicate shard outputs of scan
+    features  Join per-repository features of scan --features into the bulk CSV
+    index     Load logger calls and repository metadata into the SQLite query store
+    query     Search the query store (full text, verbosity, level, license, ...)
+    records   Convert between the compact binary records format and CSV
+    aggregate Report loggers/LLOC by license and age, verbosity and library metrics
+    clean     Clean logger contents into a per-statement document-term matrix
+    topics    Sweep LDA topic counts over the document-term matrix
+    nouns     Build the nouns-only document-term matrix
+    sentiment Score polarity and subjectivity of every logger statement
+    metrics   Compute LLOC per repository with radon
+"""
+from argparse import ArgumentParser
+from os import chdir
+from time import time
+
+import app
+from app import lazy_logger, logging_setup, parallel
+from app.shards import parse_shard
+
+log = lazy_logger(name="app", **logging_setup)
+
+
+def cmd_discover(args):
+    from app import data_ingestion
+
+    if args.endpoint:
+        data_ingestion.endpoint = args.endpoint
+    data_ingestion._csv_file = args.output
+    if not args.append:
+        data_ingestion.new_csv()
+    for stars_range in args.stars or [None]:
+        data_ingestion.get_repos_csv(stars_range)
+
+
+def cmd_enrich(args):
+    from app import data_processing
+
+    if args.endpoint:
+        data_processing.endpoint = args.endpoint
+    data_processing._csv_file = args.output
+    data_processing._query_delay = tuple(args.delay)
+    if args.delta:
+        data_processing.delta_main(csv_file=args.input, max_workers=args.workers, changed_csv=args.changed)
+    else:
+        data_processing.main(csv_file=args.input, max_workers=args.workers)
+
+
+def cmd_prefilter(args):
+    from app import data_ingestion
+
+    if args.endpoint:
+        data_ingestion.endpoint = args.endpoint
+    data_ingestion.filter_msa_repos(args.input, args.output, batch_size=args.batch_size, max_workers=args.workers)
+
+
+def cmd_clone(args):
+    from app import data_ingestion
+
+    data_ingestion._repos_path = args.repos_path
+    if args.bare:
+        data_ingestion._clone_options["bare"] = True
+    if args.filter:
+        data_ingestion._clone_options["filter"] = args.filter
+    data_ingestion._update_existing = args.update
+    return_codes = data_ingestion.clone_all(csv_file=args.input, max_workers=args.workers, shard=args.shard)
+    if args.update:
+        log.info(
+            f"Cloned or updated {return_codes.count(200)}/{len(return_codes)} repositories, "
+            f"{return_codes.count(304)} up to date"
+        )
+        if args.refresh_log:
+            data_ingestion.write_refresh_log(args.refresh_log)
+    else:
+        log.info(f"Cloned {return_codes.count(200)}/{len(return_codes)} repositories")
+
+
+def cmd_scan(args):
+    from os.path import abspath
+
+    from app import disk_budget, logger_parser, shards
+
+    repos = logger_parser.read_repos_list(args.repos_list)
+    logger_parser._file_time_budget = args.file_budget
+    logger_parser._max_statement_length = args.max_statement_length
+    logger_parser._linear_match = not args.legacy_regex
+    logger_parser._blob_cache_bytes = disk_budget.parse_size(args.dedup_memory)
+    paths = dict(
+        repos_path=args.repos_path,
+        output_path=abspath(args.output_dir),
+        logs_path=abspath(args.logs_dir),
+        debug_sample=args.debug_sample,
+    )
+    scan_kwargs = dict(resume=args.resume, max_workers=args.threads, dedup=not args.no_dedup, engine=args.engine,
+                       features_csv=args.features, store_db=args.store, metrics_state=args.metrics,
+                       records_file=args.records)
+    if args.local_shards:
+        shards.scan_local_shards(repos, args.local_shards, args.output, paths, **scan_kwargs)
+        return
+    csv_name = args.output
+    if args.previous:
+        if not args.refresh_log:
+            raise SystemExit("scan --previous needs --refresh-log")
+        logger_parser.setup_paths(**paths)
+        logger_parser.delta_scan(
+            repos,
+            previous_csv=abspath(args.previous),
+            refresh_csv=abspath(args.refresh_log),
+            csv_name=csv_name,
+            max_workers=args.threads,
+            engine=args.engine,
+            store_db=args.store,
+            metrics_state=args.metrics,
+            records_file=args.records,
+        )
+        return
+    if args.shard:
+        repos = shards.select_shard(repos, *args.shard)
+        csv_name = shards.shard_file_name(csv_name, *args.shard)
+        if args.features:
+            scan_kwargs["features_csv"] = shards.shard_file_name(args.features, *args.shard)
+        if args.store:
+            scan_kwargs["store_db"] = shards.shard_file_name(args.store, *args.shard)
+        if args.metrics:
+            scan_kwargs["metrics_state"] = shards.shard_file_name(args.metrics, *args.shard)
+        if args.records:
+            scan_kwargs["records_file"] = shards.shard_file_name(args.records, *args.shard)
+        log.info(f"Shard {args.shard[0]}/{args.shard[1]}: {len(repos)} repositories")
+    logger_parser.setup_paths(**paths)
+    logger_parser.scan(
+        repos,
+        csv_name=csv_name,
+        duplicates_csv=abspath(args.duplicates) if args.duplicates else None,
+        skipped_csv=abspath(args.skipped) if args.skipped else None,
+        **scan_kwargs,
+    )
+
+
+def cmd_pipeline(args):
+    from os import makedirs
+    from os.path import abspath, exists, join
+
+    from app import data_ingestion, disk_budget, logger_parser
+
+    repos_path = abspath(args.repos_path)
+    makedirs(repos_path, exist_ok=True)
+    data_ingestion._repos_path = repos_path
+    if args.bare:
+        data_ingestion._clone_options["bare"] = True
+    if args.filter:
+        data_ingestion._clone_options["filter"] = args.filter
+    logger_parser.setup_paths(repos_path=repos_path, output_path=abspath(args.output_dir), logs_path=abspath(args.logs_dir))
+    ledger = abspath(args.ledger)
+    rows = list(data_ingestion.read_csv(args.input))
+    done = set()
+    if args.resume:
+        done = disk_budget.read_ledger(ledger)
+        if exists(join(abspath(args.output_dir), args.output)):
+            done.update(logger_parser.read_repos_done(args.output))
+        rows = [row for row in rows if row[0] not in done]
+        log.info(f"Resuming: {len(done)} repositories done, {len(rows)} to go")
+    budget = disk_budget.DiskBudget(
+        repos_path,
+        disk_budget.parse_size(args.disk_budget),
+        archive_dir=abspath(args.archive_dir) if args.archive_dir else None,
+        ledger_csv=ledger,
+        resume=args.resume,
+    )
+    # Clones already on disk count too; the scanned ones (not evicted before an
+    # interruption) are the first to go
+    budget.add_existing(done)
+    logger_parser.scan(
+        disk_budget.budgeted_clones(rows, budget, max_workers=args.workers),
+        csv_name=args.output,
+        resume=args.resume,
+        max_workers=args.threads,
+        engine=args.engine,
+        features_csv=args.features,
+        store_db=args.store,
+        metrics_state=args.metrics,
+        records_file=args.records,
+    )
+    if budget.stats["not_cloned"]:
+        raise SystemExit(f"Disk budget full of clones that cannot be evicted: "
+                         f"{budget.stats['not_cloned']} repositories were not cloned")
+
+
+def cmd_history(args):
+    from os.path import abspath
+
+    from app import history, logger_parser
+
+    logger_parser._file_time_budget = args.file_budget
+    history._max_summaries = args.max_summaries
+    logger_parser.setup_paths(repos_path=args.repos_path, output_path=abspath(args.output_dir), logs_path=abspath(args.logs_dir))
+    history.history(logger_parser.read_repos_list(args.repos_list), csv_name=args.output, interval=args.interval)
+
+
+def cmd_merge(args):
+    from app import shards
+
+    shards.merge_shards(args.inputs, args.output, **(dict(key_columns=tuple(args.key)) if args.key else {}))
+
+
+def cmd_index(args):
+    from app.logger_store import LoggerStore
+
+    store = LoggerStore(args.db)
+    try:
+        if args.calls:
+            if not args.append:
+                store.reset()
+            for csv_file in args.calls:
+                store.load_calls(csv_file)
+        if args.repos:
+            store.load_repos(args.repos)
+    finally:
+        store.close()
+
+
+def cmd_records(args):
+    from glob import glob
+
+    from app import records
+    from app.logger_parser import columns
+    from app.nlp import read_chunks
+
+    files = sorted({f for pattern in args.inputs for f in glob(pattern)})
+    if args.csv:
+        from csv import DictWriter
+
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            csv = DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            csv.writeheader()
+            for records_file in files:
+                for chunk in records.read_record_chunks(records_file):
+                    csv.writerows(chunk)
+        log.info(f"{len(files)} records files converted into {args.csv}")
+    if args.to_records:
+        records.write_records(
+            (chunk for csv_file in files for chunk in read_chunks(csv_file, args.chunk_size)),
+            args.to_records,
+            compression=None if args.compression == "none" else args.compression,
+        )
+
+
+def cmd_aggregate(args):
+    from app import aggregates
+
+    if not (args.state or args.report):
+        raise SystemExit("aggregate needs --state and/or --report")
+    metrics = aggregates.load_states(args.merge or [])
+    for csv_file in args.calls or []:
+        metrics.load_calls(csv_file)
+    if args.scanned:
+        metrics.load_scanned(args.scanned)
+    if args.repos:
+        metrics.load_repos(args.repos)
+    if args.state:
+        metrics.save(args.state)
+    if args.report:
+        aggregates.write_report(metrics, args.report)
+
+
+def cmd_query(args):
+    from csv import DictWriter
+    from sys import stdout
+
+    from app.logger_store import LoggerStore
+
+    store = LoggerStore(args.db)
+    try:
+        start = time()
+        rows = store.query(
+            text=" ".join(args.text) or None,
+            verbosity=args.verbosity,
+            level=args.level,
+            repo=args.repo,
+            logger_object=args.logger_object,
+            license=args.license,
+            limit=args.limit,
+        )
+        elapsed = time() - start
+    except ValueError as e:
+        raise SystemExit(f"query: {e}")
+    finally:
+        store.close()
+    csv = DictWriter(stdout, fieldnames=["repo", "path", "line", "logger_object", "method", "verbosity", "level", "full_content"])
+    csv.writeheader()
+    csv.writerows(rows)
+    log.info(f"{len(rows)} logger calls in {elapsed * 1000:.1f}ms")
+
+
+def cmd_features(args):
+    from app import repo_features
+
+    repo_features.join_features(args.bulk, args.features, args.output)
+
+
+def cmd_metrics(args):
+    from os.path import abspath
+
+    from app import radon_metrics
+    from app.logger_parser import read_repos_list
+
+    repos = read_repos_list(args.repos_list)
+    radon_path = abspath(args.radon_dir)
+    output = abspath(args.output)
+    chdir(args.repos_path)
+    rows = radon_metrics.lloc_all(repos, radon_path=radon_path, max_workers=args.workers)
+    radon_metrics.write_lloc(rows, output, output_format=args.format)
+    log.info(f"LLOC computed for {len(rows)}/{len(repos)} repositories")
+
+
+def cmd_clean(args):
+    from app.nlp import cleaning
+
+    cleaning.build_dtm(args.input, args.output_dir, chunk_size=args.chunk_size, max_workers=args.workers)
+
+
+def cmd_topics(args):
+    from app.nlp import topics
+
+    topics.sweep(
+        args.dtm_dir,
+        args.topics,
+        args.passes,
+        max_workers=args.workers,
+        multicore=args.multicore,
+        report_file=args.report,
+        kind=args.kind,
+    )
+
+
+def cmd_nouns(args):
+    from app.nlp import nouns
+
+    nouns.extract_nouns(
+        args.dtm_dir,
+        args.cache,
+        adjectives=args.adjectives,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+    )
+
+
+def cmd_sentiment(args):
+    from app.nlp import sentiment
+
+    sentiment.score_rows(
+        args.input,
+        args.output,
+        args.cache,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+    )
+
+
+def build_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="python -m app", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--no-log-queue", action="store_true",
+                        help="write logs from the calling threads instead of a listener thread")
+    parser.add_argument("--max-concurrency", type=int, metavar="N",
+                        help="ceiling of the adaptive pools (default: the larger of --workers/--threads and 4 per CPU)")
+    parser.add_argument("--fixed-concurrency", action="store_true",
+                        help="keep pools at their --workers/--threads size instead of adapting it")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    discover = commands.add_parser("discover", help="search GitHub for top Python repositories")
+    discover.add_argument("--stars", action="append", help='stars filter, e.g. "360..401" (repeatable)')
+    discover.add_argument("--output", default="logs/python_top_repositories-01.csv")
+    discover.add_argument("--append", action="store_true", help="append to an existing output CSV")
+    discover.add_argument("--endpoint", help="GraphQL endpoint (e.g. a mock_github server)")
+    discover.set_defaults(func=cmd_discover)
+
+    enrich = commands.add_parser("enrich", help="query repository details into the bulk CSV")
+    enrich.add_argument("--input", default="output/bulk_.csv")
+    enrich.add_argument("--output", default="output/bulk_updated.csv")
+    enrich.add_argument("--workers", type=int, default=10, help="initial concurrent queries (adapted at runtime)")
+    enrich.add_argument("--delay", type=float, nargs=2, default=(2, 10), metavar=("MIN", "MAX"),
+                        help="random pause in seconds before each query")
+    enrich.add_argument("--endpoint", help="GraphQL endpoint (e.g. a mock_github server)")
+    enrich.add_argument("--delta", action="store_true",
+                        help="input is an enriched CSV: only re-query repositories whose updatedAt/pushedAt changed")
+    enrich.add_argument("--changed", help="with --delta, CSV of the repositories with new pushes (for clone --update)")
+    enrich.set_defaults(func=cmd_enrich)
+
+    prefilter = commands.add_parser("prefilter", help="keep repositories with a container manifest, before cloning")
+    prefilter.add_argument("--input", required=True, help="CSV with repo, url and stars columns")
+    prefilter.add_argument("--output", required=True, help="CSV of the repositories to clone")
+    prefilter.add_argument("--batch-size", type=int, default=50, help="repositories per GraphQL request")
+    prefilter.add_argument("--workers", type=int, default=4, help="initial concurrent queries (adapted at runtime)")
+    prefilter.add_argument("--endpoint", help="GraphQL endpoint (e.g. a mock_github server)")
+    prefilter.set_defaults(func=cmd_prefilter)
+
+    clone = commands.add_parser("clone", help="clone the repositories listed in a CSV")
+    clone.add_argument("--input", required=True, help="CSV with repo, url and stars columns")
+    clone.add_argument("--repos-path", default="/mnt/godzilla/github_repos")
+    clone.add_argument("--workers", type=int, default=10, help="initial concurrent clones (adapted at runtime)")
+    clone.add_argument("--shard", type=parse_shard, metavar="INDEX/COUNT", help="only clone this shard, e.g. 0/4")
+    clone.add_argument("--bare", action="store_true", help="clone without a work tree (for scan --engine git)")
+    clone.add_argument("--update", action="store_true",
+                       help="git fetch + fast-forward existing clones instead of skipping them (409)")
+    clone.add_argument("--refresh-log", help="with --update, CSV of HEAD before/after per repository (for scan --previous)")
+    clone.add_argument("--filter", help='partial clone filter, e.g. "blob:none" (blobs are fetched on demand)')
+    clone.set_defaults(func=cmd_clone)
+
+    scan = commands.add_parser("scan", help="extract logger calls from cloned repositories")
+    scan.add_argument("--repos-list", required=True, help="file with one owner/repo per line")
+    scan.add_argument("--repos-path", default="/mnt/c/github_repos")
+    scan.add_argument("--output-dir", default="output")
+    scan.add_argument("--output", default="logger_calls.csv", help="output file name")
+    scan.add_argument("--logs-dir", default="logs")
+    scan.add_argument("--threads", type=int, default=60, help="initial threads per repository (adapted at runtime)")
+    scan.add_argument("--resume", action="store_true", help="skip repositories already in the output")
+    scan.add_argument("--engine", choices=("worktree", "git"), default="worktree",
+                      help="read files from the checkout, or blobs at HEAD from the git object store")
+    scan.add_argument("--no-dedup", action="store_true", help="parse every file, even identical copies")
+    scan.add_argument("--dedup-memory", default="256M", metavar="SIZE",
+                      help="parse results kept for duplicate files, e.g. 256M (least recently used go first)")
+    scan.add_argument("--features", metavar="NAME",
+                      help="also write logging-library imports and container manifests per repository")
+    scan.add_argument("--store", metavar="NAME", help="also load the rows into this SQLite query store")
+    scan.add_argument("--records", metavar="NAME", help="also write the rows in the compact binary records format")
+    scan.add_argument("--metrics", metavar="NAME", help="also aggregate the rows into this state JSON (for aggregate)")
+    scan.add_argument("--duplicates", help="CSV listing files duplicated across repositories")
+    scan.add_argument("--file-budget", type=float, default=30.0, metavar="SECONDS",
+                      help="CPU time per file before it is skipped (0: no limit)")
+    scan.add_argument("--skipped", help="CSV listing the files skipped (over the time budget, undecodable or missing)")
+    scan.add_argument("--max-statement-length", type=int, default=20000, metavar="CHARS",
+                      help="drop a multi-line logger statement buffered past this length")
+    scan.add_argument("--debug-sample", type=int, default=0, metavar="N",
+                      help="log every N-th matched line at DEBUG (0: off)")
+    scan.add_argument("--legacy-regex", action="store_true", help="match statements with the backtracking regex")
+    scan.add_argument("--previous", metavar="CSV",
+                      help="output of the last scan: only re-parse what `clone --update` changed (needs --refresh-log)")
+    scan.add_argument("--refresh-log", metavar="CSV", help="CSV written by `clone --update --refresh-log`")
+    scan.add_argument("--shard", type=parse_shard, metavar="INDEX/COUNT", help="only scan this shard, e.g. 0/4")
+    scan.add_argument("--local-shards", type=int, metavar="COUNT", help="scan COUNT shards in local processes")
+    scan.set_defaults(func=cmd_scan)
+
+    pipeline = commands.add_parser("pipeline", help="clone and scan within a disk budget, evicting scanned clones")
+    pipeline.add_argument("--input", required=True, help="CSV with repo, url and stars columns")
+    pipeline.add_argument("--repos-path", default="/mnt/godzilla/github_repos")
+    pipeline.add_argument("--disk-budget", required=True, metavar="SIZE",
+                          help="high-water mark of the clones on disk, e.g. 200G")
+    pipeline.add_argument("--archive-dir", help="keep a `git bundle` of every evicted clone here")
+    pipeline.add_argument("--ledger", default="output/evicted.csv", help="CSV of the evicted clones (for --resume)")
+    pipeline.add_argument("--workers", type=int, default=10, help="initial concurrent clones (adapted at runtime)")
+    pipeline.add_argument("--bare", action="store_true", help="clone without a work tree (use with --engine git)")
+    pipeline.add_argument("--filter", help='partial clone filter, e.g. "blob:none"')
+    pipeline.add_argument("--output-dir", default="output")
+    pipeline.add_argument("--output", default="logger_calls.csv", help="output file name")
+    pipeline.add_argument("--logs-dir", default="logs")
+    pipeline.add_argument("--threads", type=int, default=60, help="initial threads per repository (adapted at runtime)")
+    pipeline.add_argument("--engine", choices=("worktree", "git"), default="worktree")
+    pipeline.add_argument("--resume", action="store_true", help="skip repositories scanned or evicted before")
+    pipeline.add_argument("--features", metavar="NAME", help="also write per-repository features to this CSV")
+    pipeline.add_argument("--store", metavar="NAME", help="also load the rows into this SQLite query store")
+    pipeline.add_argument("--metrics", metavar="NAME", help="also aggregate the rows into this state JSON")
+    pipeline.add_argument("--records", metavar="NAME", help="also write the rows in the records format")
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    history = commands.add_parser("history", help="count logger calls at sampled commits of each repository")
+    history.add_argument("--repos-list", required=True, help="file with one owner/repo per line")
+    history.add_argument("--repos-path", default="/mnt/c/github_repos", help="full (not shallow) clones")
+    history.add_argument("--output-dir", default="output")
+    history.add_argument("--output", default="history.csv", help="output file name")
+    history.add_argument("--logs-dir", default="logs")
+    history.add_argument("--interval", choices=("month", "quarter", "year"), default="month",
+                         help="sample the last commit of every month, quarter or year")
+    history.add_argument("--file-budget", type=float, default=30.0, metavar="SECONDS",
+                         help="CPU time allowed per file before it is skipped")
+    history.add_argument("--max-summaries", type=int, default=1000000, metavar="BLOBS",
+                         help="blob call counts kept for reuse across samples and repositories (least recently used go first)")
+    history.set_defaults(func=cmd_history)
+
+    merge = commands.add_parser("merge", help="combine and deduplicate shard outputs")
+    merge.add_argument("inputs", nargs="+", help="shard CSV files (glob patterns allowed)")
+    merge.add_argument("--output", required=True)
+    merge.add_argument("--key", action="append", help="key column (repeatable), default repo, path and line")
+    merge.set_defaults(func=cmd_merge)
+
+    index = commands.add_parser("index", help="load logger calls and repository metadata into the query store")
+    index.add_argument("--db", required=True, help="SQLite file")
+    index.add_argument("--calls", nargs="*", help="logger calls CSV or records files (from scan or merge)")
+    index.add_argument("--append", action="store_true", help="keep the logger calls already in the store")
+    index.add_argument("--repos", help="bulk CSV with repository metadata (license, stars, ...)")
+    index.set_defaults(func=cmd_index)
+
+    query = commands.add_parser("query", help="search the query store, printing CSV rows")
+    query.add_argument("text", nargs="*", help='FTS5 query over full_content, e.g. timeout or "connection refused"')
+    query.add_argument("--db", required=True, help="SQLite file")
+    query.add_argument("--verbosity", choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "OTHER"))
+    query.add_argument("--level", type=int)
+    query.add_argument("--repo")
+    query.add_argument("--logger-object")
+    query.add_argument("--license", help='e.g. "MIT License"')
+    query.add_argument("--limit", type=int, default=100, help="0: no limit")
+    query.set_defaults(func=cmd_query)
+
+    records = commands.add_parser("records", help="convert records files to CSV, or CSVs to a records file")
+    records.add_argument("inputs", nargs="+", help="records files (or CSVs, with --to-records); globs allowed")
+    records.add_argument("--csv", help="write the rows of the records files to this CSV")
+    records.add_argument("--to-records", metavar="FILE", help="write the rows of the CSVs to this records file")
+    records.add_argument("--compression", choices=("zstd", "zlib", "none"), default="zstd")
+    records.add_argument("--chunk-size", type=int, default=50000, help="rows per batch, with --to-records")
+    records.set_defaults(func=cmd_records)
+
+    aggregate = commands.add_parser("aggregate", help="report the study's metrics from scan rows and repository metadata")
+    aggregate.add_argument("--calls", nargs="*", help="logger calls CSV or records files (from scan or merge)")
+    aggregate.add_argument("--merge", nargs="*", metavar="STATE", help="state JSON files of scan --metrics (globs allowed)")
+    aggregate.add_argument("--scanned", metavar="REPOS_LIST",
+                           help="repos list the scan ran over, so repositories without logger calls count too")
+    aggregate.add_argument("--repos", help="bulk CSV with repository metadata (license, lloc, dates, libraries)")
+    aggregate.add_argument("--state", help="write the combined state JSON here")
+    aggregate.add_argument("--report", help="write the compact JSON report here")
+    aggregate.set_defaults(func=cmd_aggregate)
+
+    features = commands.add_parser("features", help="join per-repository features into the bulk CSV")
+    features.add_argument("--bulk", default="output/bulk_updated.csv")
+    features.add_argument("--features", required=True, help="features CSV written by scan --features")
+    features.add_argument("--output", required=True)
+    features.set_defaults(func=cmd_features)
+
+    clean = commands.add_parser("clean", help="build the per-statement document-term matrix")
+    clean.add_argument("--input", default="output/logger_calls.csv", help="logger rows written by scan")
+    clean.add_argument("--output-dir", default="output/nlp")
+    clean.add_argument("--chunk-size", type=int, default=10000, help="rows per worker task")
+    clean.add_argument("--workers", type=int, default=4, help="worker processes")
+    clean.set_defaults(func=cmd_clean)
+
+    topics = commands.add_parser("topics", help="train and score LDA models for several topic counts")
+    topics.add_argument("--dtm-dir", default="output/nlp", help="output directory of clean")
+    topics.add_argument("--topics", type=int, nargs="+", default=[2, 3, 4, 5])
+    topics.add_argument("--passes", type=int, nargs="+", default=[20, 30, 40, 50],
+                        help="one value, or one per topic count")
+    topics.add_argument("--workers", type=int, default=4, help="worker processes (LDA workers with --multicore)")
+    topics.add_argument("--multicore", action="store_true", help="train one model at a time with LdaMulticore")
+    topics.add_argument("--report", default="output/nlp/topics.json")
+    topics.add_argument("--kind", choices=("", "nouns", "nouns_adj"), default="",
+                        help="which document-term matrix to use (all terms by default)")
+    topics.set_defaults(func=cmd_topics)
+
+    nouns = commands.add_parser("nouns", help="POS-tag distinct messages into a nouns-only matrix")
+    nouns.add_argument("--dtm-dir", default="output/nlp", help="output directory of clean")
+    nouns.add_argument("--cache", default="output/nlp/nouns_cache.sqlite", help="persistent tagging cache")
+    nouns.add_argument("--adjectives", action="store_true", help="keep adjectives as well as nouns")
+    nouns.add_argument("--batch-size", type=int, default=2000, help="messages per worker task")
+    nouns.add_argument("--workers", type=int, default=4, help="worker processes")
+    nouns.set_defaults(func=cmd_nouns)
+
+    sentiment = commands.add_parser("sentiment", help="add polarity/subjectivity columns to the logger rows")
+    sentiment.add_argument("--input", default="output/logger_calls.csv", help="logger rows written by scan")
+    sentiment.add_argument("--output", default="output/logger_calls_sentiment.csv")
+    sentiment.add_argument("--cache", default="output/nlp/sentiment_cache.sqlite", help="persistent scoring cache")
+    sentiment.add_argument("--chunk-size", type=int, default=50000, help="rows read at a time")
+    sentiment.add_argument("--batch-size", type=int, default=1000, help="messages per worker task")
+    sentiment.add_argument("--workers", type=int, default=4, help="worker processes")
+    sentiment.set_defaults(func=cmd_sentiment)
+
+    metrics = commands.add_parser("metrics", help="compute LLOC per repository with radon")
+    metrics.add_argument("--repos-list", required=True, help="file with one owner/repo per line")
+    metrics.add_argument("--repos-path", default="/mnt/c/github_repos")
+    metrics.add_argument("--radon-dir", default="output/radon_raw_json")
+    metrics.add_argument("--output", default="output/lloc.csv")
+    metrics.add_argument("--format", choices=("csv", "json"), default="csv")
+    metrics.add_argument("--workers", type=int, default=4)
+    metrics.set_defaults(func=cmd_metrics)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.no_log_queue:
+        app.queue_logging = False
+    parallel._ceiling = args.max_concurrency
+    parallel._adaptive = not args.fixed_concurrency
+    starttime = time()
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        log.warning("Execution interrupted by user (^C)")
+        print(f"\nExecution interrupted via ^C " f"at {time() - starttime:.2f}s")
+
+    log.info(f"Total execution time: {time() - starttime:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Streaming aggregation of the study's metrics: logger calls per LLOC by license and by
+repository age, the verbosity distribution and logging-library adoption. Rows are
+folded into per-repository counters as the scanner (or a CSV reader) produces them and
+joined with the repository metadata (a bulk CSV row or Repo.export_repo_info_as_json())
+only when the report is built, so accumulators of different shards can be merged.
+
+    $ python -m app aggregate --calls output/logger_calls.csv --scanned output/selected_repos --repos output/bulk_updated.csv --report output/metrics.json
+    $ python -m app aggregate --merge output/metrics.shard-*-of-4.json --repos output/bulk_updated.csv --report output/metrics.json
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from glob import glob
+from json import dump, load
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from app import lazy_logger, logging_setup
+from app.nlp import read_chunks
+from app.records import read_call_chunks
+from app.repo_features import logging_libraries
+
+log = lazy_logger(name="aggregates", **logging_setup)
+
+_metadata_columns = ("license", "created_at", "updated_at", "lloc", *logging_libraries)
+_age_bucket_days = 365
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flag(value) -> bool:
+    """
+    "TRUE"/"True" of the bulk CSV, or a count from repo_features
+    """
+    if isinstance(value, str):
+        return value.strip().lower() == "true" or (_number(value) or 0) > 0
+    return bool(value)
+
+
+def repo_age_days(created_at: str, updated_at: str) -> Optional[float]:
+    """
+    Days between creation and the last update (GitHub's ISO 8601 timestamps)
+    """
+    try:
+        created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+        updated = datetime.fromisoformat(updated_at.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return (updated - created).total_seconds() / 86400
+
+
+class Moments:
+    """
+    Count, sum, sum of squares, min and max of a series: merged by adding them up
+    """
+    __slots__ = ("n", "total", "squares", "low", "high")
+
+    def __init__(self, n: int = 0, total: float = 0.0, squares: float = 0.0, low=None, high=None):
+        self.n, self.total, self.squares, self.low, self.high = n, total, squares, low, high
+
+    def add(self, x: float):
+        self.n += 1
+        self.total += x
+        self.squares += x * x
+        self.low = x if self.low is None else min(self.low, x)
+        self.high = x if self.high is None else max(self.high, x)
+
+    def merge(self, other: "Moments"):
+        for x in (other.low, other.high):
+            if x is not None:
+                self.low = x if self.low is None else min(self.low, x)
+                self.high = x if self.high is None else max(self.high, x)
+        self.n += other.n
+        self.total += other.total
+        self.squares += other.squares
+
+    def summary(self, digits: int = 6) -> dict:
+        if not self.n:
+            return dict(n=0)
+        mean = self.total / self.n
+        variance = max(self.squares / self.n - mean * mean, 0.0)
+        return dict(n=self.n, mean=round(mean, digits), std=round(variance ** 0.5, digits),
+                    min=round(self.low, digits), max=round(self.high, digits))
+
+
+class StudyMetrics:
+    """
+    Per-repository logger-call and verbosity counters plus repository metadata.
+    add_rows() is called from the scan's threads; state()/merge() round-trip through
+    JSON so shards can be combined without the rows.
+    """
+    def __init__(self):
+        self.__calls = Counter()
+        self.__verbosity = defaultdict(Counter)
+        self.__metadata = {}
+        # Repositories scanned, with or without logger calls
+        self.__scanned = set()
+        self.__lock = Lock()
+
+    def add_rows(self, rows: Iterable[dict]):
+        calls, verbosity = Counter(), defaultdict(Counter)
+        for row in rows:
+            calls[row["repo"]] += 1
+            verbosity[row["repo"]][row["verbosity"] or "OTHER"] += 1
+        with self.__lock:
+            self.__calls.update(calls)
+            for repo, counts in verbosity.items():
+                self.__verbosity[repo].update(counts)
+
+    def add_scanned(self, repo: str):
+        """
+        repo was scanned: it counts (with 0 calls per LLOC) even if it had no rows
+        """
+        with self.__lock:
+            self.__scanned.add(repo)
+
+    def add_repo(self, repo: str, info: dict):
+        """
+        info: a bulk CSV row or Repo.export_repo_info_as_json(); only the columns the
+        metrics need are kept
+        """
+        metadata = {c: info[c] for c in _metadata_columns if info.get(c) not in (None, "")}
+        with self.__lock:
+            self.__metadata.setdefault(repo, {}).update(metadata)
+
+    def load_calls(self, csv_file: str, chunk_size: int = 50000) -> int:
+        rows = 0
+        for chunk in read_call_chunks(csv_file, chunk_size):
+            self.add_rows(chunk)
+            rows += len(chunk)
+        log.info(f"{rows} logger calls from {csv_file} aggregated")
+        return rows
+
+    def load_scanned(self, repos_file: str) -> int:
+        """
+        Repositories of a scan's --repos-list: rows alone do not tell the ones without
+        logger calls
+        """
+        with open(repos_file, encoding="utf-8") as f:
+            repos = [repo for repo in f.read().splitlines() if repo]
+        with self.__lock:
+            self.__scanned.update(repos)
+        return len(repos)
+
+    def load_repos(self, csv_file: str, scanned_only: bool = True) -> int:
+        """
+        Metadata of the repositories of a bulk CSV (of the scanned ones only, by default:
+        the ones add_scanned()/load_scanned() registered, or that have logger calls)
+        """
+        repos = 0
+        for chunk in read_chunks(csv_file):
+            for row in chunk:
+                if not scanned_only or row["repo"] in self.__scanned or row["repo"] in self.__calls:
+                    self.add_repo(row["repo"], row)
+                    repos += 1
+        log.info(f"Metadata of {repos} repositories loaded from {csv_file}")
+        return repos
+
+    def state(self) -> dict:
+        with self.__lock:
+            return dict(
+                calls=dict(self.__calls),
+                verbosity={repo: dict(counts) for repo, counts in self.__verbosity.items()},
+                metadata=dict(self.__metadata),
+                scanned=sorted(self.__scanned),
+            )
+
+    def merge(self, state: dict):
+        with self.__lock:
+            self.__calls.update(state["calls"])
+            for repo, counts in state["verbosity"].items():
+                self.__verbosity[repo].update(counts)
+            for repo, metadata in state["metadata"].items():
+                self.__metadata.setdefault(repo, {}).update(metadata)
+            self.__scanned.update(state.get("scanned", ()))
+
+    def save(self, state_file: str):
+        with open(state_file, "w", encoding="utf-8") as f:
+            dump(self.state(), f, separators=(",", ":"))
+
+    def report(self, digits: int = 6) -> dict:
+        """
+        The paper's aggregates; logger/lloc is averaged over repositories (as in
+        avg_loggers-lloc.png) and also given pooled (all calls / all LLOC)
+        """
+        state = self.state()
+        calls, metadata = state["calls"], state["metadata"]
+        repos = sorted(set(calls) | set(metadata) | set(state["scanned"]))
+
+        verbosity = Counter()
+        verbosity_by_license = defaultdict(Counter)
+        ratio_by_license = defaultdict(Moments)
+        pooled_by_license = defaultdict(lambda: [0, 0])
+        ratio_by_age = defaultdict(Moments)
+        libraries = Counter()
+        points = []
+        for repo in repos:
+            info = metadata.get(repo, {})
+            license_ = info.get("license") or "(none)"
+            verbosity.update(state["verbosity"].get(repo, {}))
+            verbosity_by_license[license_].update(state["verbosity"].get(repo, {}))
+            libraries.update(library for library in logging_libraries if _flag(info.get(library)))
+            lloc = _number(info.get("lloc"))
+            if not lloc:
+                continue
+            ratio = calls.get(repo, 0) / lloc
+            ratio_by_license[license_].add(ratio)
+            pooled_by_license[license_][0] += calls.get(repo, 0)
+            pooled_by_license[license_][1] += lloc
+            age = repo_age_days(info.get("created_at"), info.get("updated_at"))
+            if age is not None:
+                ratio_by_age[int(age // _age_bucket_days)].add(ratio)
+                points.append([round(age, 2), round(ratio, digits)])
+
+        ratios = Moments()
+        for moments in ratio_by_license.values():
+            ratios.merge(moments)
+        total_calls = sum(verbosity.values())
+        return dict(
+            repos=len(repos),
+            repos_with_lloc=ratios.n,
+            calls=total_calls,
+            loggers_per_lloc=ratios.summary(digits),
+            by_license={
+                license_: dict(
+                    moments.summary(digits),
+                    pooled=round(pooled_by_license[license_][0] / pooled_by_license[license_][1], digits),
+                )
+                for license_, moments in sorted(ratio_by_license.items(), key=lambda item: -item[1].n)
+            },
+            by_age_years={str(years): moments.summary(digits) for years, moments in sorted(ratio_by_age.items())},
+            verbosity=dict(verbosity.most_common()),
+            verbosity_share={v: round(n / total_calls, digits) for v, n in verbosity.most_common()} if total_calls else {},
+            verbosity_by_license={license_: dict(counts.most_common()) for license_, counts in verbosity_by_license.items()},
+            libraries=dict(libraries.most_common()),
+            library_share={library: round(n / len(repos), digits) for library, n in libraries.most_common()} if repos else {},
+            # repo-age_logger-lloc.csv: [repo age in days, logger/lloc] per repository
+            age_points=points,
+        )
+
+
+def load_states(patterns: List[str]) -> StudyMetrics:
+    metrics = StudyMetrics()
+    files = sorted({f for pattern in patterns for f in glob(pattern)})
+    for state_file in files:
+        with open(state_file, encoding="utf-8") as f:
+            metrics.merge(load(f))
+        log.info(f"Merged: {state_file}")
+    return metrics
+
+
+def write_report(metrics: StudyMetrics, report_file: str) -> Dict[str, object]:
+    report = metrics.report()
+    with open(report_file, "w", encoding="utf-8") as f:
+        dump(report, f, separators=(",", ":"))
+    log.info(f"Metrics of {report['repos']} repositories ({report['calls']} logger calls) written to {report_file}")
+    return report
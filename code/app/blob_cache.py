@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from csv import DictWriter
+from hashlib import sha1
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+
+def blob_id(data: bytes) -> str:
+    """
+    Same id `git hash-object` gives the file, so it can be matched against git trees
+    """
+    return sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def results_size(results: tuple) -> int:
+    """
+    Rough bytes held by cached parse results: their strings plus per-object overhead
+    """
+    rows = results[0]
+    return 200 + sum(100 + sum(len(v) if isinstance(v, str) else 8 for v in row.values()) for row in rows)
+
+
+class BlobCache:
+    """
+    Content-addressed results of logger_finder(): a blob seen once is not parsed again,
+    whichever repository or path it shows up at. Also keeps where duplicated blobs were
+    found, to tell vendored/copied files apart.
+    The parsed rows are kept for at most max_bytes (least recently used ones go first;
+    a duplicate of an evicted blob is parsed again), only where each blob was first seen
+    is kept for the whole scan.
+    """
+    def __init__(self, max_bytes: int = 256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.__results: Dict[str, tuple] = OrderedDict()
+        self.__sizes: Dict[str, int] = {}
+        self.__first_seen: Dict[str, Tuple[str, str]] = {}
+        self.__duplicates: Dict[str, List[Tuple[str, str]]] = {}
+        self.__lock = Lock()
+        self.files = 0
+        self.bytes = 0
+        self.duplicate_files = 0
+        self.duplicate_bytes = 0
+        self.cached_bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str, repo: str, path: str, size: int) -> Optional[tuple]:
+        with self.__lock:
+            self.files += 1
+            self.bytes += size
+            first_seen = self.__first_seen.setdefault(key, (repo, path))
+            if first_seen != (repo, path):
+                self.duplicate_files += 1
+                self.duplicate_bytes += size
+                self.__duplicates.setdefault(key, [first_seen]).append((repo, path))
+            results = self.__results.get(key)
+            if results is not None:
+                self.__results.move_to_end(key)
+            return results
+
+    def put(self, key: str, results: tuple):
+        size = results_size(results)
+        with self.__lock:
+            if key in self.__results:
+                return
+            self.__results[key] = results
+            self.__sizes[key] = size
+            self.cached_bytes += size
+            while self.cached_bytes > self.max_bytes and len(self.__results) > 1:
+                evicted, _ = self.__results.popitem(last=False)
+                self.cached_bytes -= self.__sizes.pop(evicted)
+                self.evictions += 1
+
+    @property
+    def unique_blobs(self) -> int:
+        return len(self.__first_seen)
+
+    @property
+    def duplicate_ratio(self) -> float:
+        return self.duplicate_files / self.files if self.files else 0.0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return dict(
+                files=self.files,
+                unique_blobs=len(self.__first_seen),
+                duplicate_files=self.duplicate_files,
+                duplicate_ratio=round(self.duplicate_ratio, 4),
+                duplicate_bytes=self.duplicate_bytes,
+                bytes=self.bytes,
+                cached_blobs=len(self.__results),
+                cached_bytes=self.cached_bytes,
+                evictions=self.evictions,
+            )
+
+    def cross_repo_duplicates(self) -> Dict[str, List[Tuple[str, str]]]:
+        """
+        Blobs found in more than one repository: likely vendored or copied code
+        """
+        with self.__lock:
+            return {
+                key: locations for key, locations in self.__duplicates.items()
+                if len({repo for repo, _ in locations}) > 1
+            }
+
+    def write_duplicates(self, csv_file: str):
+        with open(csv_file, "w", encoding="utf-8", newline="") as f:
+            csv = DictWriter(f, fieldnames=["blob", "repo", "path"])
+            csv.writeheader()
+            for key, locations in self.cross_repo_duplicates().items():
+                csv.writerows(dict(blob=key, repo=repo, path=path) for repo, path in locations)
@@ -1,25 +1,30 @@
 from csv import DictReader, DictWriter
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
 from json import dumps
 from os import getenv, rmdir, makedirs, system
 from os.path import exists
 from time import sleep, time
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from git import Git
-from git.exc import GitCommandError
-from logzero import setup_logger
+from app import lazy_logger, logging_setup
+from app.git_objects import git_dir
+from app.models import GQL, Repository, repository, repository_aliases
+from app.parallel import adaptive_map, controller, throttled
+from app.repo_features import manifest_clues, manifest_columns
 
-from app import logging_setup, https
-from app.models import GQL, Repository, repository
-
-log = setup_logger(name="data_ingestion", **logging_setup)
+log = lazy_logger(name="data_ingestion", **logging_setup)
 
 _csv_file = "logs/python_top_repositories-01.csv"
 _repos_file = "logs/repos_{letter}.csv"
 _csv_fieldnames = ["repo", "url", "stars"]
 _repos_path = "/mnt/godzilla/github_repos"
+# Extra `git clone` options, e.g. dict(bare=True, filter="blob:none") for a partial
+# clone without work tree, enough for `scan --engine git`
+_clone_options = {}
+# Existing clones are fetched and fast-forwarded instead of reported as 409
+_update_existing = False
+# repo -> (HEAD before, HEAD after) of the clones made or updated, for delta scans
+refreshed_heads: Dict[str, Tuple[str, str]] = {}
 
 
 def check_github_token(token_str: str):
@@ -37,7 +42,7 @@ def check_github_token(token_str: str):
 
 
 def read_github_token_env(env: str = "GITHUB_TOKEN"):
-    return check_github_token(getenv(env))
+    return check_github_token(getenv(env, ""))
 
 
 def read_github_token_input(token_str: str = ""):
@@ -75,6 +80,21 @@ def read_csv_selected(csv_file: str = _csv_file):
             yield row["repo"], row["url"], row["stars"], row["status"]
 
 
+# Defining request parameters
+endpoint = "https://api.github.com/graphql"
+_headers = {}
+
+
+def get_headers() -> dict:
+    # GITHUB_TOKEN is only read (and validated) when the first query is made
+    if not _headers:
+        _headers.update({
+            "Accept": "application/vnd.github.v4.idl",
+            "Authorization": f"bearer {read_github_token_env()}",
+        })
+    return _headers
+
+
 def query_top_python_repositories(stars_filter: Optional[str] = None):  # FIXME: set stars_filter = None
     """
     stars_filter examples:
@@ -83,7 +103,7 @@ def query_top_python_repositories(stars_filter: Optional[str] = None):  # FIXME:
     42..420
     """
     log.info("Querying top popular Python GitHub repositories...")
-    gql = GQL(endpoint=endpoint, headers=headers)
+    gql = GQL(endpoint=endpoint, headers=get_headers())
     gql.load_query("top_python_repositories.gql")
     if stars_filter:
         gql.set_template_variables(
@@ -120,7 +140,7 @@ def query_top_python_repositories(stars_filter: Optional[str] = None):  # FIXME:
 
 def query_top_python_repositories_details(repo: str):
     log.info(f"Querying: {repo}")
-    gql = GQL(endpoint=endpoint, headers=headers)
+    gql = GQL(endpoint=endpoint, headers=get_headers())
     gql.load_query("python_repos_details.gql")
     gql.set_template_variables(REPO__OWNER_NAME=f"repo: {repo}")
     gql.reload_query()
@@ -148,11 +168,16 @@ def make_repo_dir(repo_name: str) -> str:
 
 # def clone_repo(name: str, url: str):
 def clone_repo(csv_yield: tuple):
+    from git import Git
+    from git.exc import GitCommandError
+
     name = csv_yield[0]
     url = csv_yield[1]
     stars = csv_yield[2]
+    if _update_existing and exists(repo_dir := git_dir(f"{_repos_path}/{name}")):
+        return update_repo(name, stars, repo_dir)
     try:
-        Git(make_repo_dir(name)).clone(f"{url.replace('https', 'git')}.git")
+        Git(make_repo_dir(name)).clone(f"{url.replace('https', 'git')}.git", **_clone_options)
     except GitCommandError as e:
         if "Repository not found." in str(e):
             log.error(f"{name} | {stars} | Repository not found!")
@@ -168,23 +193,211 @@ def clone_repo(csv_yield: tuple):
             return 500
     else:
         log.info(f"{name} | {stars} | Repository cloned!")
+        if _update_existing:
+            refreshed_heads[name] = ("", Git(git_dir(f"{_repos_path}/{name}")).rev_parse("HEAD"))
         return 200
 
 
-def look_for_msa_clue():
-    # https://api.github.com/repos/owner/repo_name/git/trees/master?recursive=1
-    # iterate JSON from call above
-    # if MSA clue found, return True
-    # else check if is truncated (if it is, clone it), else False
-    pass
+def update_repo(name: str, stars: str, repo_dir: str) -> int:
+    """
+    git fetch + fast-forward of an existing clone (bare clones get their branches
+    fast-forwarded); 304 when nothing new was pushed, 409 when it cannot fast-forward
+    """
+    from git import Git
+    from git.exc import GitCommandError
+
+    git = Git(repo_dir)
+    try:
+        old_head = git.rev_parse("HEAD")
+        if git.rev_parse("--is-bare-repository") == "true":
+            git.fetch("--quiet", "origin", "refs/heads/*:refs/heads/*")
+        else:
+            git.fetch("--quiet", "origin")
+            git.merge("--ff-only", "--quiet", "@{upstream}")
+        new_head = git.rev_parse("HEAD")
+    except GitCommandError as e:
+        if "rejected" in str(e) or "Not possible to fast-forward" in str(e) or "non-fast-forward" in str(e):
+            log.warning(f"{name} | {stars} | History was rewritten, cannot fast-forward")
+            return 409
+        log.exception(f"{name} | {stars} | Unidentified error! | {e}")
+        return 500
+    refreshed_heads[name] = (old_head, new_head)
+    if old_head == new_head:
+        log.info(f"{name} | {stars} | Repository up to date")
+        return 304
+    log.info(f"{name} | {stars} | Repository updated {old_head[:8]}..{new_head[:8]}")
+    return 200
+
+
+def write_refresh_log(csv_file: str):
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f, fieldnames=["repo", "old_head", "new_head"])
+        csv.writeheader()
+        csv.writerows(dict(repo=repo, old_head=old, new_head=new) for repo, (old, new) in refreshed_heads.items())
+
+
+def look_for_msa_clue(tree: Optional[dict]) -> dict:
+    """
+    Walks the (up to 3 levels deep) tree of msa_clues.gql: column -> "TRUE" for each
+    container manifest found, without cloning the repository
+    """
+    found = dict.fromkeys(manifest_columns, "")
+    pending = [tree] if tree else []
+    while pending:
+        for entry in pending.pop().get("entries") or []:
+            for clue in manifest_clues(entry["name"], entry["type"]):
+                found[clue] = "TRUE"
+            if entry.get("object"):
+                pending.append(entry["object"])
+    return found
+
+
+def tree_truncated(tree: Optional[dict]) -> bool:
+    """
+    Whether the tree of msa_clues.gql has directories deeper than the query reached
+    (their entries were not asked for)
+    """
+    pending = [tree] if tree else []
+    while pending:
+        for entry in pending.pop().get("entries") or []:
+            if entry["type"] == "tree":
+                if "entries" not in (entry.get("object") or {}):
+                    return True
+                pending.append(entry["object"])
+    return False
 
 
-# Defining request parameters
-endpoint = "https://api.github.com/graphql"
-headers = {
-    "Accept": "application/vnd.github.v4.idl",
-    "Authorization": f"bearer {read_github_token_env()}",
-}
+def query_deep_clues(repo: str) -> Optional[dict]:
+    """
+    Clue columns from the whole HEAD tree of repo, through the REST API's recursive
+    trees (the `git ls-tree -r` of the repository); None when it could not be listed
+    in full
+    """
+    from requests.exceptions import RequestException
+
+    from app import get_https
+
+    url = f"{endpoint.rsplit('/graphql', 1)[0]}/repos/{repo}/git/trees/HEAD"
+    try:
+        response = get_https().get(
+            url, params=dict(recursive=1), headers=dict(Authorization=get_headers()["Authorization"])
+        )
+    except RequestException as e:
+        log.error(f"{repo} | Recursive tree query failed: {e}")
+        return None
+    if response.status_code in (403, 429) or response.status_code >= 500:
+        throttled("github")
+    if response.status_code != 200:
+        log.error(f"{repo} | Recursive tree query failed (status_code={response.status_code})")
+        return None
+    listing = response.json()
+    if listing.get("truncated"):
+        log.warning(f"{repo} | Recursive tree truncated by the API")
+        return None
+    found = dict.fromkeys(manifest_columns, "")
+    for entry in listing.get("tree") or []:
+        for clue in manifest_clues(entry["path"].rsplit("/", 1)[-1], entry["type"]):
+            found[clue] = "TRUE"
+    return found
+
+
+def graphql_errors(payload: dict) -> Dict[str, str]:
+    """
+    Error type (NOT_FOUND, RATE_LIMITED, ...) of each alias a GraphQL response has
+    errors for; errors of the whole request are under ""
+    """
+    errors = {}
+    for error in payload.get("errors") or []:
+        alias = (error.get("path") or [""])[0]
+        errors.setdefault(alias, error.get("type") or error.get("message", "ERROR"))
+    return errors
+
+
+def query_msa_clues(repos: List[str]) -> dict:
+    """
+    Looks up the HEAD trees of a batch of repositories in a single GraphQL request
+    (one aliased repository field each). Returns repo -> clue columns, {} for
+    repositories that do not exist (anymore) and None when the lookup itself failed.
+    Trees deeper than the query with no clue in their first levels are listed in full
+    (query_deep_clues()); their clue columns get a "deep" key.
+    """
+    from requests.exceptions import RequestException
+
+    gql = GQL(endpoint=endpoint, headers=get_headers())
+    gql.load_query("msa_clues.gql")
+    gql.set_template_variables(
+        REPOSITORIES=repository_aliases(repos, 'nameWithOwner root: object(expression: "HEAD:") { ...treeEntries }')
+    )
+    gql.reload_query()
+    try:
+        response = gql.run_query(raw_response=True)
+    except RequestException as e:
+        log.error(f"{repos[0]}.. | Tree query failed: {e}")
+        return dict.fromkeys(repos)
+    if response.status_code != 200:
+        log.error(f"{repos[0]}.. | Tree query failed (status_code={response.status_code})")
+        return dict.fromkeys(repos)
+    payload = response.json()
+    errors = graphql_errors(payload)
+    if "RATE_LIMITED" in errors.values():
+        throttled("github")
+    data = payload.get("data")
+    if not data:
+        # e.g. RATE_LIMITED: a 200 with "data": null is a failed lookup, not missing repositories
+        log.error(f"{repos[0]}.. | Tree query failed: {sorted(set(errors.values())) or 'no data'}")
+        return dict.fromkeys(repos)
+    results = {}
+    for i, repo in enumerate(repos):
+        node = data.get(f"r{i}")
+        if not node:
+            # Only a NOT_FOUND error tells a repository is gone; others leave it unknown
+            results[repo] = {} if errors.get(f"r{i}") == "NOT_FOUND" else None
+            continue
+        results[repo] = look_for_msa_clue(node["root"])
+        if "TRUE" not in results[repo].values() and tree_truncated(node["root"]):
+            deep = query_deep_clues(repo)
+            results[repo] = None if deep is None else dict(deep, deep="TRUE")
+    return results
+
+
+def filter_msa_repos(csv_file: str, output_file: str, batch_size: int = 50, max_workers: int = 4) -> dict:
+    """
+    Pre-clone stage: keeps (in output_file) only the repositories of csv_file whose tree
+    has a container manifest, plus those that could not be looked up, so the clone
+    stage skips the rest. Clue columns are added to the kept rows. Repositories whose
+    tree was deeper than msa_clues.gql reaches are counted apart (deep_with_clue,
+    deep_without_clue), as they needed a recursive listing.
+    """
+    rows = {row[0]: row for row in read_csv(csv_file)}
+    repos = list(rows)
+    batches = [repos[i:i + batch_size] for i in range(0, len(repos), batch_size)]
+    stats = dict(repos=len(repos), with_clue=0, without_clue=0, deep_with_clue=0, deep_without_clue=0,
+                 not_found=0, unknown=0)
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f, fieldnames=_csv_fieldnames + manifest_columns)
+        csv.writeheader()
+        # A failed request leaves every repository of its batch unknown (None)
+        failed = lambda results: all(clues is None for clues in results.values())
+        for results in adaptive_map(query_msa_clues, batches, controller("github", max_workers), is_error=failed):
+            for repo, clues in results.items():
+                if clues is None:
+                    # Not known to be irrelevant: cloned anyway, like a truncated tree
+                    stats["unknown"] += 1
+                    clues = {}
+                elif not clues:
+                    stats["not_found"] += 1
+                    log.warning(f"{repo} | Repository not found!")
+                    continue
+                else:
+                    deep = "deep_" if clues.pop("deep", "") else ""
+                    if "TRUE" not in clues.values():
+                        stats[f"{deep}without_clue"] += 1
+                        log.debug(f"{repo} | No container manifest, skipped")
+                        continue
+                    stats[f"{deep}with_clue"] += 1
+                csv.writerow(dict(zip(_csv_fieldnames, rows[repo]), **clues))
+    log.info(f"Container manifest pre-filter: {stats}")
+    return stats
 
 
 def get_repos_csv(stars_range: Optional[str]):  # "10..200"
@@ -193,12 +406,23 @@ def get_repos_csv(stars_range: Optional[str]):  # "10..200"
     query_top_python_repositories(stars_filter=stars_range)
 
 
-def clone_all(letter: str):
-    with ThreadPoolExecutor(max_workers=10) as ex:
-        return_codes = ex.map(clone_repo, read_csv(_repos_file.format(letter=letter)))
-    for i, status in enumerate(list(return_codes)):
+def clone_failed(status: int) -> bool:
+    # Access refused or an unidentified (network, disk, ...) error: not 404/409
+    return status in (403, 500)
+
+
+def clone_all(letter: str = "", csv_file: str = "", max_workers: int = 10, shard: Optional[tuple] = None) -> list:
+    csv_file = csv_file or _repos_file.format(letter=letter)
+    rows = read_csv(csv_file)
+    if shard:
+        # Only this host's share of the list: shard=(index, count), see app.shards
+        from app.shards import shard_of
+
+        rows = (row for row in rows if shard_of(row[0], shard[1]) == shard[0])
+    return_codes = list(adaptive_map(clone_repo, rows, controller("clone", max_workers), is_error=clone_failed))
+    for i, status in enumerate(return_codes):
         print(i, status)
-    system("st Done!")
+    return return_codes
 
 
 def main():
@@ -208,8 +432,7 @@ def main():
     new_csv()
     query_top_python_repositories(stars_filter="150..1730")
 
-    with ThreadPoolExecutor(max_workers=50) as ex:
-        return_codes = ex.map(clone_repo, read_csv())
+    return_codes = adaptive_map(clone_repo, read_csv(), controller("clone", 50), is_error=clone_failed)
     for i, status in enumerate(list(return_codes)):
         print(i, status)
     system("st Done!")
@@ -252,6 +475,7 @@ if __name__ == "__main__":
         # get_repos_csv("360..401")
         # get_repos_csv("300..360")
         clone_all("M")
+        system("st Done!")
     except KeyboardInterrupt:
         log.warning("Execution interrupted by user (^C)")
         print(f"\nExecution interrupted via ^C " f"at {time() - starttime:.2f}s")
@@ -1,24 +1,24 @@
 from csv import DictReader, DictWriter
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
 from json import dumps, dump, load
 from os import getenv, rmdir, makedirs, system
 from os.path import exists
 from random import uniform
 from time import sleep, time
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from logzero import setup_logger
+from app import lazy_logger, logging_setup
+from app.models import GQL, Repository, repo_dataclass, repository_aliases
+from app.parallel import adaptive_map, controller
 
-from app import logging_setup, https
-from app.models import GQL, Repository, repo_dataclass
-
-log = setup_logger(name="repo_details", **logging_setup)
+log = lazy_logger(name="repo_details", **logging_setup)
 
 read_csv_file = "output/bulk_.csv"
 _csv_file = "output/bulk_updated.csv"
-_csv_fieldnames = ["id", "repo", "url", "ssh_url", "created_at", "updated_at", "is_fork", "in_org", "stars", "watchers", "forks", "releases", "commit_comments", "collaborators", "collab_direct", "collab_outside", "contributors", "prs", "prs_open", "issues", "issues_open", "license", "status", "selected", "lloc", "dockerfile", "docker-compose", ".kube", "configmap", "logging", "daiquiri", "eliot", "logbook", "loguru", "logzero", "pysimplelog", "structlog", "twiggy"]
+_json_file = "temp.json"
+_csv_fieldnames = ["id", "repo", "url", "ssh_url", "created_at", "updated_at", "pushed_at", "is_fork", "in_org", "stars", "watchers", "forks", "releases", "commit_comments", "collaborators", "collab_direct", "collab_outside", "contributors", "prs", "prs_open", "issues", "issues_open", "license", "status", "selected", "lloc", "dockerfile", "docker-compose", ".kube", "configmap", "logging", "daiquiri", "eliot", "logbook", "loguru", "logzero", "pysimplelog", "structlog", "twiggy"]
 _repos_path = "/mnt/godzilla/github_repos"
+_query_delay = (2, 10)  # seconds, random pause before each details query (API abuse mechanism)
 
 
 def check_github_token(token_str: str):
@@ -36,7 +36,7 @@ def check_github_token(token_str: str):
 
 
 def read_github_token_env(env: str = "GITHUB_TOKEN"):
-    return check_github_token(getenv(env))
+    return check_github_token(getenv(env, ""))
 
 
 def read_github_token_input(token_str: str = ""):
@@ -87,8 +87,8 @@ def query_top_python_repositories_details(row: dict):
 
     repo = row["repo"]
     log.info(f"Querying: {repo}")
-    sleep(uniform(2, 10))
-    gql = GQL(endpoint=endpoint, headers=headers)
+    sleep(uniform(*_query_delay))
+    gql = GQL(endpoint=endpoint, headers=get_headers())
     gql.load_query("python_repos_details.gql")
     gql.set_template_variables(REPO__OWNER_NAME=f"repo:{repo}")
     gql.reload_query()
@@ -110,6 +110,7 @@ def query_top_python_repositories_details(row: dict):
         row["ssh_url"] = rdc["ssh_url"]
         row["created_at"] = rdc["created_at"]
         row["updated_at"] = rdc["updated_at"]
+        row["pushed_at"] = rdc["pushed_at"]
         row["stars"] = rdc["stars"]
         row["watchers"] = rdc["watchers"]
         row["forks"] = rdc["forks"]
@@ -135,24 +136,100 @@ def query_top_python_repositories_details(row: dict):
 
 # Defining request parameters
 endpoint = "https://api.github.com/graphql"
-headers = {
-    "Accept": "application/vnd.github.v4.idl",
-    "Authorization": f"bearer {read_github_token_env()}",
-}
+_headers = {}
+
+
+def get_headers() -> dict:
+    # GITHUB_TOKEN is only read (and validated) when the first query is made
+    if not _headers:
+        _headers.update({
+            "Accept": "application/vnd.github.v4.idl",
+            "Authorization": f"bearer {read_github_token_env()}",
+        })
+    return _headers
+
+
+def query_freshness(repos: List[str]) -> Dict[str, Optional[Tuple[str, str]]]:
+    """
+    (updatedAt, pushedAt) of a batch of repositories in one GraphQL request;
+    None for the ones that were not found or could not be looked up
+    """
+    from requests.exceptions import RequestException
 
+    gql = GQL(endpoint=endpoint, headers=get_headers())
+    gql.load_query("repos_freshness.gql")
+    gql.set_template_variables(REPOSITORIES=repository_aliases(repos, "nameWithOwner updatedAt pushedAt"))
+    gql.reload_query()
+    try:
+        response = gql.run_query(raw_response=True)
+    except RequestException as e:
+        log.error(f"{repos[0]}.. | Freshness query failed: {e}")
+        return dict.fromkeys(repos)
+    if response.status_code != 200:
+        log.error(f"{repos[0]}.. | Freshness query failed (status_code={response.status_code})")
+        return dict.fromkeys(repos)
+    data = response.json().get("data") or {}
+    return {
+        repo: (node["updatedAt"], node["pushedAt"]) if (node := data.get(f"r{i}")) else None
+        for i, repo in enumerate(repos)
+    }
+
+
+def delta_main(
+        csv_file: str = _csv_file,
+        max_workers: int = 10,
+        batch_size: int = 50,
+        changed_csv: Optional[str] = None,
+) -> dict:
+    """
+    Delta refresh of an enriched CSV (written back to _csv_file): only the selected
+    repositories whose updatedAt or pushedAt moved since they were stored are queried
+    again. changed_csv lists (repo, url, stars) of the pushed ones, whose clones need
+    `clone --update` and a delta scan.
+    """
+    rows = list(read_csv(csv_file))
+    selected = [row for row in rows if "TRUE" in row["selected"]]
+    repos = [row["repo"] for row in selected]
+    fresh = {}
+    batches = [repos[i:i + batch_size] for i in range(0, len(repos), batch_size)]
+    # A failed request leaves its whole batch unknown (None)
+    failed = lambda results: all(value is None for value in results.values())
+    for results in adaptive_map(query_freshness, batches, controller("github", max_workers), is_error=failed):
+        fresh.update(results)
+
+    stale, pushed = [], []
+    for row in selected:
+        if fresh.get(row["repo"]) is None:
+            continue  # Not found or not looked up: the stored values are kept
+        updated_at, pushed_at = fresh[row["repo"]]
+        if pushed_at != row.get("pushed_at"):
+            pushed.append(row)
+        if pushed_at != row.get("pushed_at") or updated_at != row["updated_at"]:
+            stale.append(row)
+    log.info(f"{len(stale)}/{len(selected)} repositories changed, {len(pushed)} with new pushes")
+
+    # Rows are updated in place; 403/5xx are signalled by GQL.run_query()
+    list(adaptive_map(query_top_python_repositories_details, stale, controller("github", max_workers)))
+    write_to_csv(rows)
+    if changed_csv:
+        with open(changed_csv, "w", encoding="utf-8", newline="") as f:
+            csv = DictWriter(f, fieldnames=["repo", "url", "stars"], extrasaction="ignore")
+            csv.writeheader()
+            csv.writerows(pushed)
+    return dict(selected=len(selected), unknown=sum(1 for r in repos if fresh.get(r) is None), stale=len(stale), pushed=len(pushed))
 
-def main():
+
+def main(csv_file: str = read_csv_file, max_workers: int = 10):
     new_csv()
 
-    with ThreadPoolExecutor(max_workers=10) as ex:
-        row_map = ex.map(query_top_python_repositories_details, read_csv())
-    
+    row_map = adaptive_map(query_top_python_repositories_details, read_csv(csv_file), controller("github", max_workers))
+
     # query_top_python_repositories_details("")
     rows = list(row_map)
 
     log.info(f"number of rows: {len(rows)}")
 
-    with open("temp.json", "w", encoding="utf-8") as f:
+    with open(_json_file, "w", encoding="utf-8") as f:
         dump(dict(repos=rows), fp=f)
 
     write_to_csv(rows)
@@ -0,0 +1,294 @@
+"""
+Working-set-bounded cloning: instead of the whole corpus being cloned before the scan,
+repositories are cloned while earlier ones are scanned, and scanned ones are evicted
+(optionally kept as `git bundle` archives) once the clones on disk reach a high-water
+mark. New clones wait for room, so disk use stays near the budget.
+
+    $ python -m app pipeline --input selected.csv --repos-path /mnt/godzilla/github_repos --disk-budget 200G --archive-dir /mnt/archive
+"""
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from csv import DictReader, DictWriter
+from os import chmod, listdir, lstat, makedirs, rmdir, walk
+from os.path import exists, getsize, isdir, join
+from shutil import rmtree
+from stat import S_IWRITE
+from subprocess import PIPE, run
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+from app import lazy_logger, logging_setup
+from app.git_objects import git_dir
+
+log = lazy_logger(name="disk_budget", **logging_setup)
+
+_default_estimate = 100 * 2 ** 20  # bytes per clone, until some were measured
+_size_units = dict(K=2 ** 10, M=2 ** 20, G=2 ** 30, T=2 ** 40)
+_ledger_columns = ["repo", "bytes", "state"]
+
+
+def parse_size(size_str: str) -> int:
+    """
+    "500M", "200G", "1.5T" or a number of bytes
+    """
+    size_str = size_str.strip().upper().rstrip("B")
+    if size_str and size_str[-1] in _size_units:
+        return int(float(size_str[:-1]) * _size_units[size_str[-1]])
+    return int(size_str)
+
+
+def disk_usage(path: str) -> int:
+    """
+    Bytes allocated to the files under path (st_blocks; st_size where not available)
+    """
+    total = 0
+    for root, _, filenames in walk(path):
+        # Directories take blocks too: many small ones in .git/objects
+        for entry in [root] + [join(root, file_) for file_ in filenames]:
+            try:
+                st = lstat(entry)
+            except OSError:
+                continue
+            total += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+    return total
+
+
+def _make_writable(function, path, _):
+    # Pack files are read-only: rmtree cannot remove them on every platform otherwise
+    chmod(path, S_IWRITE)
+    function(path)
+
+
+class DiskBudget:
+    """
+    Bytes used by each clone under repos_path (relative "owner/repo" names), in clone
+    order; scanned clones are evicted oldest first when room is needed
+    """
+    def __init__(
+            self,
+            repos_path: str,
+            high_water: int,
+            archive_dir: Optional[str] = None,
+            ledger_csv: Optional[str] = None,
+            resume: bool = False,
+    ):
+        self.repos_path = repos_path
+        self.high_water = high_water
+        self.archive_dir = archive_dir
+        self.ledger_csv = ledger_csv
+        self.__in_use: Dict[str, int] = OrderedDict()
+        self.__scanned: Set[str] = set()
+        # Scanned without completing: evicted like the others, but left out of the ledger
+        self.__failed: Set[str] = set()
+        self.__measured = []
+        self.__lock = Lock()
+        self.stats = dict(existing=0, cloned=0, failed=0, evicted=0, archived=0, evicted_bytes=0, peak_bytes=0,
+                          not_cloned=0)
+        if ledger_csv and not (resume and exists(ledger_csv)):
+            with open(ledger_csv, "w", encoding="utf-8", newline="") as f:
+                DictWriter(f, fieldnames=_ledger_columns).writeheader()
+
+    @property
+    def used(self) -> int:
+        with self.__lock:
+            return sum(self.__in_use.values())
+
+    @property
+    def estimate(self) -> int:
+        """
+        Expected size of the next clone: the mean of the ones measured so far
+        """
+        with self.__lock:
+            return sum(self.__measured) // len(self.__measured) if self.__measured else _default_estimate
+
+    def add(self, repo: str) -> int:
+        size = disk_usage(git_dir(join(self.repos_path, repo)))
+        with self.__lock:
+            if repo not in self.__in_use:
+                self.__measured.append(size)
+                self.stats["cloned"] += 1
+            self.__in_use[repo] = size
+            # Being scanned (again, for a clone left by an interrupted run): not evictable yet
+            self.__scanned.discard(repo)
+            self.__failed.discard(repo)
+            self.stats["peak_bytes"] = max(self.stats["peak_bytes"], sum(self.__in_use.values()))
+        log.debug("%s | %d bytes on disk", repo, size)
+        return size
+
+    def add_existing(self, done: Set[str]) -> int:
+        """
+        Counts the clones already under repos_path (left by an interrupted run, or not
+        part of this one) as used; the ones in done have their results persisted, so
+        they are evictable, oldest first. Returns the bytes they use.
+        """
+        existing = 0
+        for owner in sorted(o for o in listdir(self.repos_path) if isdir(join(self.repos_path, o))):
+            for name in sorted(listdir(join(self.repos_path, owner))):
+                if not isdir(join(self.repos_path, owner, name)):
+                    continue
+                repo = f"{owner}/{name[:-4] if name.endswith('.git') else name}"
+                size = disk_usage(join(self.repos_path, owner, name))
+                with self.__lock:
+                    self.__in_use[repo] = self.__in_use.get(repo, 0) + size
+                    if repo in done:
+                        self.__scanned.add(repo)
+                    self.stats["existing"] += 1
+                existing += size
+        with self.__lock:
+            self.stats["peak_bytes"] = max(self.stats["peak_bytes"], sum(self.__in_use.values()))
+            evictable = len(self.__scanned)
+        log.info(f"{self.stats['existing']} clones already on disk ({existing} bytes), {evictable} of them scanned")
+        return existing
+
+    def unscanned(self, repo: str) -> bool:
+        """
+        Whether repo is on disk (counted by add_existing()) and not scanned yet
+        """
+        with self.__lock:
+            return repo in self.__in_use and repo not in self.__scanned
+
+    def scanned(self, repo: str, completed: bool = True):
+        """
+        The scan of repo is over: its clone can go whenever room is needed. Only a
+        completed one (results persisted) is written to the ledger when evicted, so
+        --resume retries the others.
+        """
+        with self.__lock:
+            if repo in self.__in_use:
+                self.__scanned.add(repo)
+                if not completed:
+                    self.__failed.add(repo)
+                    self.stats["failed"] += 1
+
+    def has_room(self, cloning: int = 0) -> bool:
+        """
+        Whether one more clone fits next to the clones on disk and the cloning ones;
+        with nothing on disk there always is room, so one oversized repository cannot
+        stall the queue
+        """
+        used = self.used
+        if not used and not cloning:
+            return True
+        return used + (cloning + 1) * self.estimate <= self.high_water
+
+    def make_room(self, cloning: int = 0) -> int:
+        """
+        Evicts scanned clones, oldest first, until has_room(cloning); returns bytes freed
+        """
+        freed = 0
+        while not self.has_room(cloning):
+            with self.__lock:
+                repo = next((r for r in self.__in_use if r in self.__scanned), None)
+            if repo is None:
+                break
+            freed += self.evict(repo)
+        return freed
+
+    def archive(self, repo: str) -> bool:
+        """
+        `git bundle` of every ref of repo in archive_dir/owner/repo.bundle: compressed
+        history, restored with `git clone archive_dir/owner/repo.bundle`
+        """
+        bundle = join(self.archive_dir, f"{repo}.bundle")
+        makedirs(join(self.archive_dir, repo.split("/")[0]), exist_ok=True)
+        result = run(
+            ["git", "-C", git_dir(join(self.repos_path, repo)), "bundle", "create", bundle, "--all"],
+            stdout=PIPE, stderr=PIPE,
+        )
+        if result.returncode:
+            log.error(f"{repo} | Archive failed: {result.stderr.decode(errors='replace').strip()}")
+            return False
+        log.info(f"{repo} | Archived: {bundle} ({getsize(bundle)} bytes)")
+        return True
+
+    def evict(self, repo: str) -> int:
+        archived = bool(self.archive_dir) and self.archive(repo)
+        clone = git_dir(join(self.repos_path, repo))
+        rmtree(clone, onerror=_make_writable)
+        try:
+            rmdir(join(self.repos_path, repo.split("/")[0]))  # Only when it was the owner's last clone
+        except OSError:
+            pass
+        with self.__lock:
+            size = self.__in_use.pop(repo, 0)
+            self.__scanned.discard(repo)
+            failed = repo in self.__failed
+            self.__failed.discard(repo)
+            self.stats["evicted"] += 1
+            self.stats["archived"] += archived
+            self.stats["evicted_bytes"] += size
+        if failed:
+            log.warning(f"{repo} | Evicted ({size} bytes, {self.used} bytes in use), not in the ledger: its scan did not complete")
+            return size
+        if self.ledger_csv:
+            with open(self.ledger_csv, "a", encoding="utf-8", newline="") as f:
+                DictWriter(f, fieldnames=_ledger_columns).writerow(
+                    dict(repo=repo, bytes=size, state="archived" if archived else "evicted")
+                )
+        log.info(f"{repo} | Evicted ({size} bytes, {self.used} bytes in use)")
+        return size
+
+
+def read_ledger(ledger_csv: str) -> Set[str]:
+    """
+    Repositories already scanned and evicted by an earlier run
+    """
+    if not exists(ledger_csv):
+        return set()
+    with open(ledger_csv, encoding="utf-8", newline="") as f:
+        return {row["repo"] for row in DictReader(f)}
+
+
+def budgeted_clones(rows: Iterable[tuple], budget: DiskBudget, max_workers: int = 10) -> Iterator[str]:
+    """
+    Clones (repo, url, stars) rows in the background and yields each repository once
+    it is on disk, for logger_parser.scan(repos=...). When the consumer asks for the
+    next one, the previous one has been scanned. A clone only starts when the budget
+    has room for it, after evicting scanned clones if need be. Clones of rows already
+    on disk and not scanned (left by an interrupted run) are yielded first, without
+    cloning them again, so they can be evicted once scanned. When the budget is full
+    of clones that cannot be evicted, the rows left are counted in
+    budget.stats["not_cloned"].
+    """
+    from app import logger_parser
+    from app.data_ingestion import clone_failed, clone_repo
+    from app.parallel import controller
+
+    concurrency = controller("clone", max_workers)
+    rows = list(rows)
+    existing = [row[0] for row in rows if budget.unscanned(row[0])]
+    if existing:
+        log.info(f"Scanning the {len(existing)} clones already on disk first")
+    for repo in existing:
+        budget.add(repo)
+        yield repo
+        budget.scanned(repo, completed=repo not in logger_parser.failed_repos)
+    existing = set(existing)
+    rows = iter([row for row in rows if row[0] not in existing])
+    running = {}
+    pending = next(rows, None)
+    with ThreadPoolExecutor(max_workers=concurrency.ceiling) as ex:
+        while True:
+            # Backpressure: clones only start while they fit in the budget
+            while pending is not None and len(running) < concurrency.limit:
+                budget.make_room(len(running))
+                if not budget.has_room(len(running)):
+                    break
+                running[ex.submit(clone_repo, pending)] = pending[0]
+                pending = next(rows, None)
+            if not running:
+                if pending is not None:
+                    budget.stats["not_cloned"] = 1 + sum(1 for _ in rows)
+                    log.error(f"Disk budget full of clones that cannot be evicted ({budget.used} bytes): "
+                              f"{pending[0]} and the rest were not cloned")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                repo = running.pop(future)
+                status = future.result()
+                concurrency.record(not clone_failed(status))
+                if status in (200, 304, 409) and exists(git_dir(join(budget.repos_path, repo))):
+                    budget.add(repo)
+                    yield repo
+                    budget.scanned(repo, completed=repo not in logger_parser.failed_repos)
+    log.info(f"Disk budget: {budget.stats} | high-water mark {budget.high_water} bytes")
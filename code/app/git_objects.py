@@ -0,0 +1,136 @@
+from os.path import isdir
+from subprocess import PIPE, Popen, run
+from threading import Lock
+from typing import Iterator, List, Set, Tuple
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="git_objects", **logging_setup)
+
+_blob_mode_regular = ("100644", "100755")
+
+
+def git_dir(repo: str) -> str:
+    """
+    owner/repo.git (bare or partial clone) when it exists, else the owner/repo work tree
+    """
+    return f"{repo}.git" if isdir(f"{repo}.git") else repo
+
+
+def ls_tree(repo_dir: str, rev: str = "HEAD") -> List[Tuple[str, str, str, str, str]]:
+    """
+    (mode, type, sha, size, path) of every file at rev, without a checkout
+    """
+    result = run(["git", "-C", repo_dir, "ls-tree", "-r", "-l", "-z", "--full-tree", rev], stdout=PIPE, stderr=PIPE)
+    if result.returncode:
+        raise RuntimeError(f"git ls-tree failed for {repo_dir}: {result.stderr.decode(errors='replace').strip()}")
+    entries = []
+    for entry in result.stdout.split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        entries.append((*info.decode().split(), path.decode("utf-8", errors="surrogateescape")))
+    return entries
+
+
+def is_py_blob(mode: str, kind: str, path: str) -> bool:
+    # Symlinks and submodules are left out, as their blobs are not Python source
+    return kind == "blob" and mode in _blob_mode_regular and path.endswith(".py")
+
+
+def ls_py_blobs(repo_dir: str, rev: str = "HEAD") -> List[Tuple[str, int, str]]:
+    """
+    (blob sha, size, path) of every regular .py file at rev
+    """
+    return [
+        (sha, int(size), path) for mode, kind, sha, size, path in ls_tree(repo_dir, rev) if is_py_blob(mode, kind, path)
+    ]
+
+
+def diff_paths(repo_dir: str, old_rev: str, new_rev: str) -> Set[str]:
+    """
+    Paths added, modified or deleted between two revisions (renames count as both)
+    """
+    result = run(
+        ["git", "-C", repo_dir, "diff", "--name-only", "--no-renames", "-z", old_rev, new_rev],
+        stdout=PIPE, stderr=PIPE,
+    )
+    if result.returncode:
+        raise RuntimeError(f"git diff failed for {repo_dir}: {result.stderr.decode(errors='replace').strip()}")
+    return {path.decode("utf-8", errors="surrogateescape") for path in result.stdout.split(b"\0") if path}
+
+
+def diff_blobs(repo_dir: str, old_rev: str, new_rev: str) -> List[Tuple[str, str, str, str]]:
+    """
+    (new mode, new blob sha, status, path) of every path changed between two revisions;
+    a deleted path has status "D" and an all-zero sha
+    """
+    result = run(
+        ["git", "-C", repo_dir, "diff", "--raw", "--no-renames", "--no-abbrev", "-z", old_rev, new_rev],
+        stdout=PIPE, stderr=PIPE,
+    )
+    if result.returncode:
+        raise RuntimeError(f"git diff failed for {repo_dir}: {result.stderr.decode(errors='replace').strip()}")
+    # ":old_mode new_mode old_sha new_sha status\0path\0" per path
+    fields = result.stdout.split(b"\0")
+    changes = []
+    for info, path in zip(fields[0::2], fields[1::2]):
+        _, new_mode, _, new_sha, status = info.decode().lstrip(":").split()
+        changes.append((new_mode, new_sha, status, path.decode("utf-8", errors="surrogateescape")))
+    return changes
+
+
+def first_parent_commits(repo_dir: str, rev: str = "HEAD") -> List[Tuple[str, str]]:
+    """
+    (commit sha, committer date in ISO 8601) of rev and its first parents, newest first
+    """
+    result = run(
+        ["git", "-C", repo_dir, "log", "--first-parent", "--format=%H %cI", rev],
+        stdout=PIPE, stderr=PIPE,
+    )
+    if result.returncode:
+        raise RuntimeError(f"git log failed for {repo_dir}: {result.stderr.decode(errors='replace').strip()}")
+    return [tuple(line.split(" ", 1)) for line in result.stdout.decode().splitlines() if line]
+
+
+class CatFileBatch:
+    """
+    A persistent `git cat-file --batch` process: blobs are streamed out of the object
+    store one after another without starting git per file
+    """
+    def __init__(self, repo_dir: str):
+        self.repo_dir = repo_dir
+        self.__lock = Lock()
+        self.__process = Popen(["git", "-C", repo_dir, "cat-file", "--batch"], stdin=PIPE, stdout=PIPE)
+
+    def read(self, sha: str) -> bytes:
+        with self.__lock:
+            self.__process.stdin.write(f"{sha}\n".encode())
+            self.__process.stdin.flush()
+            header = self.__process.stdout.readline().decode().split()
+            if len(header) != 3:
+                raise KeyError(f"{self.repo_dir} | object not found: {sha} ({' '.join(header)})")
+            data = self.__process.stdout.read(int(header[2]))
+            self.__process.stdout.read(1)  # trailing LF
+            return data
+
+    def close(self):
+        self.__process.stdin.close()
+        self.__process.wait()
+        self.__process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_py_blobs(repo_dir: str, rev: str = "HEAD") -> Iterator[Tuple[str, str, bytes]]:
+    """
+    (blob sha, path, contents) of every .py file at rev
+    """
+    blobs = ls_py_blobs(repo_dir, rev)
+    with CatFileBatch(repo_dir) as cat_file:
+        for sha, _, path in blobs:
+            yield sha, path, cat_file.read(sha)
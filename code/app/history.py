@@ -0,0 +1,166 @@
+"""
+History mode: logging adoption over time. The first-parent history of every cloned
+repository is sampled (last commit of each month, quarter or year) and its logger
+calls are counted at each sample. Only the .py blobs `git diff` reports between two
+consecutive samples are looked at, and a blob is parsed once: its per-verbosity counts
+are kept by sha (across repositories too, for forks and vendored copies; the least
+recently used go first past _max_summaries), so a repository costs about one HEAD
+scan plus the blobs its history added.
+
+    $ python -m app history --repos-list selected_repos --repos-path /mnt/c/github_repos --interval month --output history.csv
+"""
+from collections import OrderedDict
+from csv import DictWriter
+from os import chdir
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from app import lazy_logger, logger_parser, logging_setup
+from app.git_objects import CatFileBatch, diff_blobs, first_parent_commits, git_dir, is_py_blob, ls_tree
+from app.verbosity import verbosity_levels
+
+log = lazy_logger(name="history", **logging_setup)
+
+intervals = ("month", "quarter", "year")
+_levels = tuple(verbosity_levels)
+history_columns = ["repo", "period", "commit", "committed_at", "py_files", "logger_calls", *_levels, "parsed_blobs", "skipped_blobs"]
+
+_max_summaries = 1000000  # blobs, set from the command line: --max-summaries
+
+# blob sha -> (logger calls per verbosity, in _levels order; why it was skipped, if it
+# was), least recently used first; most blobs have no calls, and share the same tuple
+blob_summaries: Dict[str, Tuple[Tuple[int, ...], Optional[str]]] = OrderedDict()
+_no_calls = (0,) * len(_levels)
+
+
+def period_of(committed_at: str, interval: str = "month") -> str:
+    """
+    "2021-03-26T16:28:45+01:00" -> "2021-03", "2021-Q1" or "2021"
+    """
+    year, month = committed_at[:4], committed_at[5:7]
+    if interval == "month":
+        return f"{year}-{month}"
+    if interval == "quarter":
+        return f"{year}-Q{(int(month) - 1) // 3 + 1}"
+    return year
+
+
+def sample_commits(repo_dir: str, interval: str = "month", rev: str = "HEAD") -> List[Tuple[str, str, str]]:
+    """
+    (period, commit, committed_at) of the last first-parent commit of each period, oldest first
+    """
+    samples = {}
+    for commit, committed_at in first_parent_commits(repo_dir, rev):
+        # Newest first: the first commit seen in a period is its last one
+        samples.setdefault(period_of(committed_at, interval), (commit, committed_at))
+    return [(period, *samples[period]) for period in sorted(samples)]
+
+
+def keep_summary(sha: str, summary: Tuple[int, ...], skipped: Optional[str] = None):
+    blob_summaries[sha] = (summary, skipped)
+    while len(blob_summaries) > _max_summaries:
+        blob_summaries.popitem(last=False)
+
+
+def blob_summary(cat_file: CatFileBatch, repo: str, sha: str, path: str) -> Tuple[Tuple[int, ...], str]:
+    """
+    Logger calls per verbosity of a blob, and how they were had: "cached", "parsed" or
+    "skipped" (no calls counted, and listed in logger_parser.skipped_files: the blob is
+    not valid text, is over the CPU time budget, or is missing from the clone)
+    """
+    file_path = f"{repo}/{path}"
+    if (cached := blob_summaries.get(sha)) is not None:
+        blob_summaries.move_to_end(sha)
+        summary, skipped = cached
+        if skipped is None:
+            return summary, "cached"
+        logger_parser.skip_file(repo, file_path, skipped)
+        return summary, "skipped"
+    try:
+        rows = logger_parser.find_loggers(logger_parser.read_lines(cat_file.read(sha)), repo, file_path)
+    except (UnicodeDecodeError, logger_parser.FileTimeBudgetExceeded) as e:
+        skipped = f"UnicodeDecodeError: {e}" if isinstance(e, UnicodeDecodeError) else str(e)
+        logger_parser.skip_file(repo, file_path, skipped)
+        # Fails the same way at every sample and copy: not tried again
+        keep_summary(sha, _no_calls, skipped)
+        return _no_calls, "skipped"
+    except KeyError as e:
+        logger_parser.skip_file(repo, file_path, f"KeyError: {e}")
+        return _no_calls, "skipped"
+    counts = dict.fromkeys(_levels, 0)
+    for row in rows:
+        counts[row["verbosity"] if row["verbosity"] in counts else "OTHER"] += 1
+    summary = tuple(counts.values()) if any(counts.values()) else _no_calls
+    keep_summary(sha, summary)
+    return summary, "parsed"
+
+
+def repo_history(repo: str, interval: str = "month") -> List[dict]:
+    """
+    One row per sampled commit: .py files, logger calls and calls per verbosity
+    """
+    repo_dir = git_dir(repo)
+    tree: Dict[str, Tuple[int, ...]] = {}
+    totals = [0] * len(_levels)
+    rows = []
+    previous = None
+    with CatFileBatch(repo_dir) as cat_file:
+        for period, commit, committed_at in sample_commits(repo_dir, interval):
+            if previous is None:
+                changes = [(mode, sha, "A", path) for mode, kind, sha, _, path in ls_tree(repo_dir, commit) if kind == "blob"]
+            else:
+                changes = diff_blobs(repo_dir, previous, commit)
+            parsed = skipped = 0
+            for mode, sha, status, path in changes:
+                if (old := tree.pop(path, None)) is not None:
+                    totals = [t - n for t, n in zip(totals, old)]
+                if status == "D" or not is_py_blob(mode, "blob", path):
+                    continue
+                summary, how = blob_summary(cat_file, repo, sha, path)
+                parsed += how == "parsed"
+                skipped += how == "skipped"
+                tree[path] = summary
+                totals = [t + n for t, n in zip(totals, summary)]
+            rows.append(dict(
+                repo=repo, period=period, commit=commit, committed_at=committed_at, py_files=len(tree),
+                logger_calls=sum(totals), **dict(zip(_levels, totals)), parsed_blobs=parsed, skipped_blobs=skipped,
+            ))
+            previous = commit
+    return rows
+
+
+def history(repos: List[str], csv_name: str = "history.csv", interval: str = "month") -> dict:
+    """
+    repo_history() of every repository (relative to logger_parser._repos_path), appended
+    to csv_name in the output directory as each one finishes
+    """
+    start_moment = time()
+    chdir(logger_parser._repos_path)
+    csv_file = logger_parser.output_file(csv_name)
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        DictWriter(f, fieldnames=history_columns).writeheader()
+    stats = dict(repos=0, failed=0, samples=0, files=0, parsed_blobs=0, skipped_blobs=0)
+    for repo in repos:
+        try:
+            rows = repo_history(repo, interval)
+        except RuntimeError as e:
+            log.error(f"{repo} | {e}")
+            stats["failed"] += 1
+            continue
+        except Exception as e:
+            # One broken repository does not end the run: its rows are just missing
+            log.exception(f"{repo} | Exception: {e}")
+            stats["failed"] += 1
+            continue
+        with open(csv_file, "a", encoding="utf-8", newline="") as f:
+            DictWriter(f, fieldnames=history_columns).writerows(rows)
+        parsed = sum(row["parsed_blobs"] for row in rows)
+        head_files = rows[-1]["py_files"] if rows else 0
+        log.info(f"{repo} | {len(rows)} samples | {parsed} blobs parsed for {head_files} .py files at HEAD")
+        stats["repos"] += 1
+        stats["samples"] += len(rows)
+        stats["files"] += sum(row["py_files"] for row in rows)
+        stats["parsed_blobs"] += parsed
+        stats["skipped_blobs"] += sum(row["skipped_blobs"] for row in rows)
+    log.info(f"History: {stats} | {len(blob_summaries)} blobs summarized | Time spent: {time() - start_moment:.3f} seconds")
+    return stats
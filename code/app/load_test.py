@@ -0,0 +1,224 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictReader
+from os import environ, makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from app import lazy_logger, logging_setup
+from app.mock_github import MockGitHub, MockSettings, fake_token
+
+log = lazy_logger(name="load_test", **logging_setup)
+
+
+def report(stage: str, requests: int, repos: int, elapsed: float, concurrency: int = None) -> dict:
+    result = dict(
+        stage=stage,
+        requests=requests,
+        repos=repos,
+        seconds=round(elapsed, 3),
+        requests_per_second=round(requests / elapsed, 2) if elapsed else 0.0,
+        repos_per_second=round(repos / elapsed, 2) if elapsed else 0.0,
+        concurrency=concurrency,
+    )
+    log.info(
+        f"{stage} | {requests} requests | {repos} repos | {elapsed:.2f}s | "
+        f"{result['requests_per_second']} req/s | {result['repos_per_second']} repos/s"
+        + (f" | final pool size {concurrency}" if concurrency else "")
+    )
+    return result
+
+
+def load_test_discover(mock: MockGitHub, work_dir: str, stars_filter: str = None) -> dict:
+    from app import data_ingestion
+
+    data_ingestion.endpoint = mock.endpoint
+    data_ingestion._csv_file = join(work_dir, "discover.csv")
+    data_ingestion.new_csv()
+    served = mock.requests_served
+    start = time()
+    data_ingestion.query_top_python_repositories(stars_filter=stars_filter)
+    elapsed = time() - start
+    repos = sum(1 for _ in data_ingestion.read_csv(data_ingestion._csv_file))
+    return report("discover", mock.requests_served - served, repos, elapsed)
+
+
+def load_test_enrich(mock: MockGitHub, work_dir: str, workers: int = 10) -> dict:
+    from csv import DictWriter
+
+    from app import data_processing
+    from app.parallel import controller
+
+    data_processing.endpoint = mock.endpoint
+    data_processing._query_delay = (0, 0)
+    data_processing._csv_file = join(work_dir, "enrich.csv")
+    data_processing._json_file = join(work_dir, "enrich.json")
+    selected_csv = join(work_dir, "selected.csv")
+    with open(join(work_dir, "discover.csv"), encoding="utf-8", newline="") as f:
+        rows = [dict(row, selected="TRUE") for row in DictReader(f)]
+    with open(selected_csv, "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f, fieldnames=data_processing._csv_fieldnames, extrasaction="ignore")
+        csv.writeheader()
+        csv.writerows(rows)
+    served = mock.requests_served
+    start = time()
+    data_processing.main(csv_file=selected_csv, max_workers=workers)
+    elapsed = time() - start
+    done = sum(1 for row in data_processing.read_csv(data_processing._csv_file) if row["id"])
+    return report("enrich", mock.requests_served - served, done, elapsed, controller("github", workers).limit)
+
+
+def load_test_clone(mock: MockGitHub, work_dir: str, count: int, workers: int = 10) -> dict:
+    from csv import DictWriter
+
+    from app import data_ingestion
+    from app.parallel import controller
+
+    data_ingestion._repos_path = join(work_dir, "github_repos")
+    makedirs(data_ingestion._repos_path, exist_ok=True)
+    clone_csv = join(work_dir, "clone.csv")
+    repos = list(data_ingestion.read_csv(join(work_dir, "discover.csv")))[:count]
+    with open(clone_csv, "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f, fieldnames=data_ingestion._csv_fieldnames)
+        csv.writeheader()
+        csv.writerows(dict(zip(data_ingestion._csv_fieldnames, repo)) for repo in repos)
+    start = time()
+    return_codes = data_ingestion.clone_all(csv_file=clone_csv, max_workers=workers)
+    elapsed = time() - start
+    return report("clone", len(repos), return_codes.count(200), elapsed, controller("clone", workers).limit)
+
+
+def log_overhead(source_dir: str, repeat: int = 3, sample: int = 100, workers: int = 10) -> list:
+    """
+    Times find_loggers() over every .py file of source_dir (read once into memory, parsed
+    by `workers` threads) with per-line debug output off, sampled and complete, through
+    the queue and directly
+    """
+    from os import walk
+
+    import app
+    from app import DEBUG, INFO, logger_parser
+
+    sources = []
+    for root, _, filenames in walk(source_dir):
+        for file_ in filenames:
+            if file_.endswith(".py"):
+                with open(join(root, file_), "rb") as f:
+                    data = f.read()
+                try:
+                    data.decode()
+                except UnicodeDecodeError:
+                    continue
+                sources.append((join(root, file_), data))
+    lines = sum(data.count(b"\n") for _, data in sources)
+    log_dir = mkdtemp(prefix="log_overhead_")
+    saved = app.queue_logging, logger_parser.log, logger_parser._debug_sample
+    results = []
+
+    def parse(source: tuple) -> list:
+        path, data = source
+        return logger_parser.find_loggers(logger_parser.read_lines(data), "load/test", path)
+
+    try:
+        for name, level, debug_sample, queue in (
+                ("off", INFO, 0, True),
+                (f"sampled 1/{sample}", DEBUG, sample, True),
+                ("every line", DEBUG, 1, True),
+                ("every line, no queue", DEBUG, 1, False),
+        ):
+            app.queue_logging = queue
+            logger_parser._debug_sample = debug_sample
+            logger_parser.log = lazy_logger(
+                name=f"log_overhead:{name}", level=level, logfile=join(log_dir, "log_overhead.log"),
+                fileLoglevel=level, maxBytes=1024000, backupCount=4, disableStderrLogger=True,
+            )
+            start = time()
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for _ in range(repeat):
+                    list(ex.map(parse, sources))
+            elapsed = time() - start
+            # Waits for the listener to write everything queued
+            app.detach_queue(logger_parser.log.logger)
+            elapsed_flushed = time() - start
+            results.append(dict(
+                logging=name,
+                files=len(sources) * repeat,
+                lines=lines * repeat,
+                seconds=round(elapsed, 3),
+                seconds_flushed=round(elapsed_flushed, 3),
+                lines_per_second=round(lines * repeat / elapsed) if elapsed else 0,
+            ))
+            log.info(f"Logging {name} | {lines * repeat} lines | {elapsed:.2f}s "
+                f"({elapsed_flushed:.2f}s written) | {results[-1]['lines_per_second']} lines/s")
+    finally:
+        app.queue_logging, logger_parser.log, logger_parser._debug_sample = saved
+        rmtree(log_dir, ignore_errors=True)
+    return results
+
+
+def mount_retries(mock: MockGitHub):
+    """
+    The mock is plain http: the shared session's retry adapter is only mounted for
+    https://, so it is mounted for the mock's address too
+    """
+    from app import get_https
+
+    session = get_https()
+    session.mount(mock.endpoint.rsplit("/", 1)[0] + "/", session.get_adapter("https://"))
+
+
+def main(args) -> list:
+    if args.log_overhead:
+        return log_overhead(args.log_overhead, repeat=args.repeat, workers=args.workers)
+    # data_ingestion/data_processing read and validate GITHUB_TOKEN on their first query
+    environ.setdefault("GITHUB_TOKEN", fake_token())
+    settings = MockSettings(
+        repo_count=args.repos,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_limit=args.rate_limit,
+        error_403_rate=args.error_403_rate,
+        error_5xx_rate=args.error_5xx_rate,
+    )
+    work_dir = mkdtemp(prefix="load_test_")
+    results = []
+    try:
+        with MockGitHub(settings) as mock:
+            mount_retries(mock)
+            if args.clones:
+                mock.make_bare_repos(args.clones)
+                mock.start_git_daemon(args.git_port)
+            results.append(load_test_discover(mock, work_dir))
+            results.append(load_test_enrich(mock, work_dir, workers=args.workers))
+            if args.clones:
+                results.append(load_test_clone(mock, work_dir, args.clones, workers=args.workers))
+            log.info(f"Errors injected by the mock server: {mock.errors_injected}")
+    finally:
+        rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Offline load test of the ingestion paths against mock_github")
+    parser.add_argument("--repos", type=int, default=1000)
+    parser.add_argument("--clones", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--git-port", type=int, default=9418)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=5000)
+    parser.add_argument("--error-403-rate", type=float, default=0.0)
+    parser.add_argument("--error-5xx-rate", type=float, default=0.0)
+    parser.add_argument("--log-overhead", metavar="SOURCE_DIR",
+                        help="only time logger_finder's logging over the .py files of SOURCE_DIR")
+    parser.add_argument("--repeat", type=int, default=3)
+    starttime = time()
+    try:
+        main(parser.parse_args())
+    except KeyboardInterrupt:
+        log.warning("Execution interrupted by user (^C)")
+        print(f"\nExecution interrupted via ^C " f"at {time() - starttime:.2f}s")
+
+    log.info(f"Total execution time: {time() - starttime:.2f}s")
@@ -1,23 +1,47 @@
 #!/usr/bin/env python3
-from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from io import BytesIO, TextIOWrapper
+from json import load
 from csv import DictReader, DictWriter
 from logging import DEBUG, INFO, WARNING
 from os import chdir, listdir, walk
 from os.path import exists
-from re import match, search, sub
-from time import time
-
-from logzero import setup_logger
+from re import compile, search, sub
+from threading import Lock
+from time import thread_time, time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from app import lazy_logger
+from app.aggregates import StudyMetrics
+from app.blob_cache import BlobCache, blob_id
+from app.git_objects import CatFileBatch, diff_paths, git_dir, is_py_blob, ls_tree
+from app.logger_store import LoggerStore
+from app.parallel import adaptive_map, controller
+from app.records import RecordWriter
+from app.repo_features import RepoFeatures, append_features, imports_of, new_features_csv
+from app.verbosity import classify_rows, verbosity_counter
+
+_repos_path = "/mnt/c/github_repos"
+_output_path = "/mnt/c/Users/mtuli/devel/python/tcc/output"
+_logs_path = "/mnt/c/Users/mtuli/devel/python/tcc/logs"
+_max_workers = 60
+# Guards against pathological (minified, generated) files
+_linear_match = True  # False: the original backtracking regex_logger_verbosity_call_complete
+_max_statement_length = 20000  # characters buffered for one multi-line statement
+_file_time_budget = 30.0  # CPU seconds per file, 0 disables it
+_blob_cache_bytes = 256 * 2 ** 20  # parse results kept for duplicate blobs (least recently used go first)
+# Per-line DEBUG output of find_loggers(): 0 off, N every N-th line (when DEBUG is enabled)
+_debug_sample = 0
 
 logging_setup = dict(
     name="logger_finder",
     level=INFO,
-    logfile=f"/mnt/c/Users/mtuli/devel/python/tcc/logs/logger_finder(_).log",
+    logfile=f"{_logs_path}/logger_finder(_).log",
     fileLoglevel=INFO,
     maxBytes=1024000,
     backupCount=16,
 )
-log = setup_logger(**logging_setup)
+log = lazy_logger(**logging_setup)
 
 # Constants
 columns = ("repo", "path", "line", "logger_object", "method", "verbosity", "level", "full_content", "len")
@@ -70,56 +94,51 @@ regex_logger_verbosity_call_complete = (
     r"[\n\s]*$"
 )
 
-log_statement_counter = 0
-
-
-def normalize_verbosity(verbosity: str) -> str:
-    global log_statement_counter
-    if match(r"[Dd][Ee][Bb][Uu][Gg]", verbosity):
-        return "DEBUG"
-    if match(r"[Ii][Nn][Ff][Oo]", verbosity):
-        return "INFO"
-    if match(r"[Ww][Aa][Rr][Nn]([Ii][Nn][Gg])?", verbosity):
-        return "WARNING"
-    if match(r"([Ee][Xx][Cc][Ee][Pp][Tt]([Ii][Oo][Nn])?)|([Ee][Rr]{2}[Oo][Rr])", verbosity):
-        return "ERROR"
-    if match(r"([Ff][Aa][Tt][Aa][Ll])|([Cc][Rr][Ii][Tt]([Ii][Cc]([Aa][Ll])?)?)", verbosity):
-        return "CRITICAL"
-    if match(r"[Ll][Oo][Gg]", verbosity):
-        log_statement_counter += 1
-        return "log"
-    return "OTHER"
-
-
-def get_verbosity_level(verbosity: str) -> int:
-    return {
-        "DEBUG": 10,
-        "INFO": 20,
-        "WARNING": 30,
-        "ERROR": 40,
-        "CRITICAL": 50,
-        "OTHER": 99
-    }[verbosity]
-
-
-def guess_verbosity(content: str) -> str:
-    if verbosity_match := search(
-        r".*(?P<logger_verbosity>([Ff][Aa][Tt][Aa][Ll])|([Cc][Rr][Ii][Tt]([Ii][Cc]([Aa][Ll])?)?)|([Ee][Xx][Cc][Ee][Pp][Tt]([Ii][Oo][Nn])?)|([Ee][Rr]{2}[Oo][Rr])|([Ww][Aa][Rr][Nn]([Ii][Nn][Gg])?)|([Ii][Nn][Ff][Oo])|([Dd][Ee][Bb][Uu][Gg])).*",
-        content
-    ):
-        return normalize_verbosity(verbosity_match.group("logger_verbosity"))
-    return "OTHER"
-
-
-def split_match_groups(match_dict: dict, match_obj) -> dict:
-    match_dict["logger_object"] = match_obj.group("logger_object")
-    match_dict["full_content"] = sub(r"\(\s*(.+)\s*\)", r"\1", match_obj.group("logger_content"))
+regex_call = compile(regex_logger_verbosity_call)
+
+# Parse results per file content, shared by all repos of a scan (None disables it)
+blob_cache: Optional[BlobCache] = BlobCache(_blob_cache_bytes)
+# Logging-library imports and container manifests of the repo being scanned (None disables it)
+repo_features: Optional[RepoFeatures] = None
+# Indexed copy of the output rows, loaded repo by repo (None disables it)
+logger_store: Optional[LoggerStore] = None
+study_metrics: Optional[StudyMetrics] = None
+record_writer: Optional[RecordWriter] = None
+# (repo, path, reason) of the files given up on during a scan
+skipped_files = []
+_skipped_lock = Lock()
+# Repositories whose scan did not complete (their rows were not written)
+failed_repos: Set[str] = set()
+
+
+class FileTimeBudgetExceeded(Exception):
+    pass
+
+
+def match_complete(text: str) -> Optional[dict]:
+    """
+    Groups regex_logger_verbosity_call_complete would match in text. The linear version
+    finds the call with regex_call (its prefix can only end at the first "(") and checks
+    the rest ends with ")" by hand, instead of backtracking "\(.*\)[\n\s]*$" over
+    every split of the "(\w+\.)*" prefix when the statement is not complete yet.
+    """
+    if not _linear_match:
+        full_match = search(regex_logger_verbosity_call_complete, text)
+        return full_match.groupdict() if full_match else None
+    if not (call_match := regex_call.search(text)):
+        return None
+    content = text[call_match.end() - 1:].rstrip()
+    if not content.endswith(")") or "\n" in content:
+        return None
+    return dict(call_match.groupdict(), logger_content=content)
+
+
+def split_match_groups(match_dict: dict, groups: dict) -> dict:
+    match_dict["logger_object"] = groups["logger_object"]
+    match_dict["full_content"] = sub(r"\(\s*(.+)\s*\)", r"\1", groups["logger_content"])
     # match_dict["full_content"] = sub(r"[\'\"]\.format\([^\)]\)", "", match_dict["full_content"])
-    match_dict["method"] = match_obj.group("logger_verbosity").lower()
-    match_dict["verbosity"] = normalize_verbosity(match_dict["method"])
-    if match_dict["verbosity"] == "log":
-        match_dict["verbosity"] = guess_verbosity(match_dict["full_content"])
-    match_dict["level"] = get_verbosity_level(match_dict["verbosity"])
+    match_dict["method"] = groups["logger_verbosity"].lower()
+    # verbosity and level are filled per file by classify_rows()
     return match_dict
 
 
@@ -127,9 +146,7 @@ def check_logger_statement(match_dict: dict) -> bool:
     return False if match_dict["logger_object"] in not_logger or len(match_dict["full_content"]) < 2 else True
 
 
-def logger_finder(path: str) -> list:
-    repo = f"{path.split('/')[0]}/{path.split('/')[1]}"
-
+def find_loggers(lines: Iterable[str], repo: str, path: str) -> list:
     got_it = ""
     loggers = []
     match_dict = {}
@@ -138,115 +155,329 @@ def logger_finder(path: str) -> list:
         nonlocal got_it, loggers, match_dict
         got_it = ""
         match_dict = {}
-    
-    def open_stream(path: str):
-        f = open(path)
-        for line in f:
-            yield line
-        f.close()
-
-    stream = open_stream(path)
-    for i, line in enumerate(stream):
-        if got_it == "" and not ( call_match := search(regex_logger_verbosity_call, line) ):
+
+    sample = _debug_sample if _debug_sample and log.isEnabledFor(DEBUG) else 0
+
+    def trace(i: int, stage: str):
+        if sample and not i % sample:
+            log.debug("%s | %s:%d | %s: %s", repo, path, i, stage, got_it)
+
+    deadline = thread_time() + _file_time_budget if _file_time_budget else 0
+    for i, line in enumerate(lines):
+        # Checked every 100 lines, and on every long (minified) line
+        if deadline and (not i % 100 or len(line) > 10000) and thread_time() > deadline:
+            raise FileTimeBudgetExceeded(f"over {_file_time_budget}s of CPU at line {i}")
+
+        if got_it == "" and not ( call_match := regex_call.search(line) ):
             # log.debug(f"#{i}".rjust(7, " ") + " | Skipped")
             continue
 
         if got_it == "" and match_dict == {} and call_match:
             got_it = sub(r"\s+", " ", sub(r"\n$", "", line))
             match_dict = dict(repo=repo, path=path, line=i)
-            if ( full_match := search(regex_logger_verbosity_call_complete, line) ):
-                log.debug(f"{repo} | {path}:{i} | Full: {got_it}")
+            if ( full_match := match_complete(line) ):
+                trace(i, "Full")
                 if check_logger_statement(logger_statement := split_match_groups(match_dict, full_match)):
                     loggers.append(logger_statement)
                 reset_loop_mem()
                 continue
             
-            log.debug(f"{repo} | {path}:{i} | Partial: {got_it}")
+            trace(i, "Partial")
             continue
 
         if got_it and match_dict:
             got_it += sub(r"\s+", " ", sub(r"\n$", "", line))
             if search(r"\)[\s\n]*$", line):
-                if ( full_match := search(regex_logger_verbosity_call_complete, got_it) ):
-                    log.debug(f"{repo} | {path}:{i} | Final: {got_it}")
+                if ( full_match := match_complete(got_it) ):
+                    trace(i, "Final")
                     if check_logger_statement(logger_statement := split_match_groups(match_dict, full_match)):
                         loggers.append(logger_statement)
                     reset_loop_mem()
                     continue
 
-            log.debug(f"{repo} | {path}:{i} | Partial: {got_it}")
+            if len(got_it) > _max_statement_length:
+                # Never closed (or not a call after all): stop buffering the rest of the file
+                log.warning(f"{repo} | {path}:{match_dict['line']} | Statement over {_max_statement_length} chars dropped")
+                reset_loop_mem()
+                continue
+            trace(i, "Partial")
             continue
 
         log.error(f"{repo} | {path}:{i} | Something went wrong: i={i}; line='{line}'; match_dict={match_dict}; got_it='{got_it}'")
     
-    log.debug(f"{repo} | {path} | logger calls: {len(loggers)}")
+    log.debug("%s | %s | logger calls: %d", repo, path, len(loggers))
+    return classify_rows(loggers)
+
+
+def read_lines(data: bytes) -> Iterator[str]:
+    # Same decoding and newline translation as open(path)
+    return TextIOWrapper(BytesIO(data))
+
+
+def skip_file(repo: str, path: str, reason: str):
+    log.error(f"{repo} | {path} | Skipped: {reason}")
+    with _skipped_lock:
+        skipped_files.append((repo, path, reason))
+
+
+def reuse_rows(cached: tuple, repo: str, path: str) -> list:
+    rows, libraries, skipped = cached
+    if skipped:
+        # A copy of a blob given up on: listed as skipped too, not given another budget
+        skip_file(repo, path, skipped)
+    if repo_features is not None:
+        repo_features.add_imports(libraries)
+    verbosity_counter.update(row["verbosity"] for row in rows)
+    verbosity_counter.add("log", sum(1 for row in rows if row["method"] == "log"))
+    return [dict(row, repo=repo, path=path) for row in rows]
+
+
+def parse_blob(data: bytes, repo: str, path: str, key: Optional[str] = None) -> list:
+    """
+    Logger calls (and, when collected, logging-library imports) of one file read;
+    cached under key when given
+    """
+    skipped = None
+    try:
+        loggers = find_loggers(read_lines(data), repo, path)
+    except FileTimeBudgetExceeded as e:
+        # Cached as empty below, with the reason, so its copies are listed as skipped
+        # without being given another budget
+        skipped = str(e)
+        skip_file(repo, path, skipped)
+        loggers = []
+    libraries = frozenset()
+    if repo_features is not None:
+        libraries = imports_of(data)
+        repo_features.add_imports(libraries)
+    if key is not None and blob_cache is not None:
+        rows = tuple({k: v for k, v in row.items() if k not in ("repo", "path")} for row in loggers)
+        blob_cache.put(key, (rows, libraries, skipped))
     return loggers
 
 
+def logger_finder(path: str) -> list:
+    repo = f"{path.split('/')[0]}/{path.split('/')[1]}"
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if blob_cache is None:
+        return parse_blob(data, repo, path)
+
+    key = blob_id(data)
+    if (cached := blob_cache.get(key, repo, path, len(data))) is not None:
+        log.debug("%s | %s | Duplicate of blob %s", repo, path, key)
+        return reuse_rows(cached, repo, path)
+    return parse_blob(data, repo, path, key)
+
+
+def git_logger_finder(
+        repo: str,
+        rev: str = "HEAD",
+        only: Optional[Set[str]] = None,
+        skip_undecodable: bool = False,
+) -> Iterator[list]:
+    """
+    logger_finder() over the .py blobs of a bare/partial clone (or a work tree's object
+    store) at rev: paths come from `git ls-tree`, contents from one `git cat-file --batch`.
+    only: repository-relative paths to restrict it to.
+    skip_undecodable: a blob that is not valid text is listed in skipped_files and
+    yields no rows, instead of raising UnicodeDecodeError. A blob missing from the
+    clone (a partial clone whose lazy fetch failed) always is.
+    """
+    repo_dir = git_dir(repo)
+    with CatFileBatch(repo_dir) as cat_file:
+        for mode, kind, sha, size, blob_path in ls_tree(repo_dir, rev):
+            if only is not None and blob_path not in only:
+                continue
+            path = f"{repo}/{blob_path}"
+            if repo_features is not None:
+                repo_features.add_path(path)
+            if not is_py_blob(mode, kind, blob_path):
+                continue
+            if not size.isdigit():
+                # `ls-tree -l` could not size it ("BAD"): the blob is missing from the clone
+                skip_file(repo, path, f"KeyError: object not found: {sha}")
+                yield []
+                continue
+            # The tree already names the blob: known ones are not even read
+            if blob_cache is not None and (cached := blob_cache.get(sha, repo, path, int(size))) is not None:
+                yield reuse_rows(cached, repo, path)
+                continue
+            try:
+                rows = parse_blob(cat_file.read(sha), repo, path, sha if blob_cache is not None else None)
+            except UnicodeDecodeError as e:
+                if not skip_undecodable:
+                    raise
+                skip_file(repo, path, f"UnicodeDecodeError: {e}")
+                rows = []
+            except KeyError as e:
+                skip_file(repo, path, f"KeyError: {e}")
+                rows = []
+            yield rows
+
+
 def get_paths(top: str = ".") -> str:
-    for root, _, filenames in walk(top, topdown=True):
+    for root, dirnames, filenames in walk(top, topdown=True):
+        # Not part of the tree `git ls-tree` lists: both engines see the same files
+        dirnames[:] = [d for d in dirnames if d != ".git"]
         for file_ in filenames:
             path = f"{root}/{file_}"
+            if repo_features is not None:
+                repo_features.add_path(path)
             if path.endswith(".py"):
                 yield path
 
 
-def main(repo: str):
-    global log
-    logging_setup = dict(
+def setup_paths(repos_path: str = None, output_path: str = None, logs_path: str = None, debug_sample: int = 0):
+    """
+    debug_sample: also log every N-th line find_loggers() matches, at DEBUG (0: off)
+    """
+    global _repos_path, _output_path, _logs_path, _debug_sample, log
+    _repos_path = repos_path or _repos_path
+    _output_path = output_path or _output_path
+    if debug_sample:
+        _debug_sample = debug_sample
+        logging_setup["level"] = logging_setup["fileLoglevel"] = DEBUG
+    if logs_path or debug_sample:
+        _logs_path = logs_path or _logs_path
+        logging_setup["logfile"] = f"{_logs_path}/logger_finder(_).log"
+        log = lazy_logger(**logging_setup)
+
+
+def output_file(csv_name: str = output_csv) -> str:
+    return f"{_output_path}/{csv_name}"
+
+
+def new_output_csv(csv_name: str = output_csv):
+    with open(output_file(csv_name), "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f=f, fieldnames=columns)
+        csv.writeheader()
+
+
+def store_rows(repo: str, rows: list):
+    """
+    Rows of a scanned repo written to the CSV also go to the query store, the metric
+    accumulators (which count the repo even without rows) and the records file
+    """
+    if logger_store is not None:
+        logger_store.insert_rows(rows)
+    if study_metrics is not None:
+        study_metrics.add_rows(rows)
+        study_metrics.add_scanned(repo)
+    if record_writer is not None:
+        record_writer.write_rows(rows)
+
+
+def read_repos_done(csv_name: str = output_csv) -> list:
+    # Load CSV checkpoint
+    repos_done = []
+    with open(output_file(csv_name), "r", encoding="utf-8", newline="") as f:
+        csv = DictReader(f=f)
+        for row in csv:
+            repos_done.append(row["repo"])
+    return list(dict.fromkeys(repos_done))
+
+
+def main(
+        repo: str,
+        csv_name: str = output_csv,
+        max_workers: int = _max_workers,
+        engine: str = "worktree",
+        features_csv: Optional[str] = None,
+) -> bool:
+    """
+    Scans repo and appends its rows; returns whether the scan completed
+    """
+    global log, repo_features
+    repo_logging_setup = dict(
         name="logger_finder:{repo}",
-        level=INFO,
-        logfile=f"/mnt/c/Users/mtuli/devel/python/tcc/logs/logger_finder({repo.replace('/', '__')}).log",
-        fileLoglevel=INFO,
+        level=logging_setup["level"],
+        logfile=f"{_logs_path}/logger_finder({repo.replace('/', '__')}).log",
+        fileLoglevel=logging_setup["fileLoglevel"],
         maxBytes=1024000,
         backupCount=16,
     )
-    log = setup_logger(**logging_setup)
+    log = lazy_logger(**repo_logging_setup)
 
     log.info(f"Began: {repo}")
+    repo_features = RepoFeatures(repo) if features_csv else None
 
-    paths = get_paths(repo)
-    with ThreadPoolExecutor(max_workers=60) as ex:
-        mapped_loggers = ex.map(logger_finder, paths)
+    if engine == "git":
+        mapped_loggers = git_logger_finder(repo)
+    else:
+        # One controller for the whole scan: files/s settles it near what the GIL allows
+        mapped_loggers = adaptive_map(logger_finder, get_paths(repo), controller("scan", max_workers))
     
-    with open(f"/mnt/c/Users/mtuli/devel/python/tcc/output/{output_csv}", "a", encoding="utf-8", newline="") as f:
+    with open(output_file(csv_name), "a", encoding="utf-8", newline="") as f:
         csv = DictWriter(f=f, fieldnames=columns)
         try:
-            for path in list(mapped_loggers):
-                [csv.writerow(row) for row in path]
+            rows = [row for path in mapped_loggers for row in path]
+            csv.writerows(rows)
+            store_rows(repo, rows)
         except UnicodeDecodeError as e:
             log.error(f"{repo} | UnicodeDecodeError: {e}")
+            return False
+    if repo_features is not None:
+        append_features(output_file(features_csv), repo_features)
 
     log.info(f"Ended: {repo}")
-
-
-if __name__ == "__main__":
+    return True
+
+
+def scan(
+        repos: list,
+        csv_name: str = output_csv,
+        resume: bool = False,
+        max_workers: int = _max_workers,
+        dedup: bool = True,
+        duplicates_csv: Optional[str] = None,
+        engine: str = "worktree",
+        features_csv: Optional[str] = None,
+        skipped_csv: Optional[str] = None,
+        store_db: Optional[str] = None,
+        metrics_state: Optional[str] = None,
+        records_file: Optional[str] = None,
+):
+    """
+    features_csv: also write one row of logging-library imports and container
+    manifests per repo (app.repo_features), found in the same pass
+    skipped_csv: list of the files skipped: over the CPU time budget (_file_time_budget),
+    undecodable or missing from the clone
+    store_db: also bulk insert the rows into this SQLite store (app.logger_store)
+    metrics_state: also aggregate the rows per repository (app.aggregates) into this
+    JSON state, for `aggregate --merge`
+    records_file: also write the rows in the compact binary format (app.records)
+    """
+    global blob_cache, logger_store, study_metrics, record_writer
     start_moment = time()
-    repos_done = []
-    chdir("/mnt/c/github_repos")
-
-    # Reset CSV
-    with open(f"/mnt/c/Users/mtuli/devel/python/tcc/output/{output_csv}", "w", encoding="utf-8", newline="") as f:
-        csv = DictWriter(f=f, fieldnames=columns)
-        csv.writeheader()
+    blob_cache = BlobCache(_blob_cache_bytes) if dedup else None
+    chdir(_repos_path)
 
-    # # Load CSV checkpoint
-    # with open(f"/mnt/c/Users/mtuli/devel/python/tcc/output/{output_csv}", "r", encoding="utf-8", newline="") as f:
-    #     csv = DictReader(f=f, fieldnames=columns)
-    #     for row in csv:
-    #         repos_done.append(row["repo"])
-    # repos_done = list(dict.fromkeys(repos_done))
-
-    with open(f"/mnt/c/Users/mtuli/devel/python/tcc/output/selected_repos") as f:  # Alphabetical
-    # with open("/mnt/c/Users/mtuli/devel/python/tcc/output/selected_repos_r") as f:  # Reverse order
-        repos = f.read()
+    repos_done = []
+    if resume and exists(output_file(csv_name)):
+        repos_done = read_repos_done(csv_name)
+    else:
+        # Reset CSV
+        new_output_csv(csv_name)
+    if features_csv and not (resume and exists(output_file(features_csv))):
+        new_features_csv(output_file(features_csv))
+    logger_store = LoggerStore(output_file(store_db)) if store_db else None
+    if logger_store is not None and not resume:
+        logger_store.reset()
+    study_metrics = StudyMetrics() if metrics_state else None
+    if study_metrics is not None and resume and exists(output_file(metrics_state)):
+        with open(output_file(metrics_state), encoding="utf-8") as f:
+            study_metrics.merge(load(f))
+    record_writer = RecordWriter(output_file(records_file), append=resume) if records_file else None
 
     try:
-        for repo in repos.splitlines():
+        for repo in repos:
             if repo in repos_done:
                 log.warning(f"Skipping: {repo}")
                 continue
-            main(repo)
+            if not main(repo, csv_name=csv_name, max_workers=max_workers, engine=engine, features_csv=features_csv):
+                failed_repos.add(repo)
     except KeyboardInterrupt as e:
         log.warning(" ---- INTERRUPTED BY USER ---- ")
         quit()
@@ -254,5 +485,140 @@ if __name__ == "__main__":
         log.exception(f"Exception: {e}")
         quit()
     finally:
-        log.info(f"Number of 'log' statements: {log_statement_counter}")
+        log.info(f"Number of 'log' statements: {verbosity_counter['log']}")
+        if blob_cache is not None:
+            log.info(f"Content dedup: {blob_cache.stats()}")
+            if duplicates_csv:
+                blob_cache.write_duplicates(duplicates_csv)
+        if skipped_files:
+            log.warning(f"Files skipped (time budget, undecodable or missing): {len(skipped_files)}")
+        if skipped_csv:
+            write_skipped(skipped_csv)
+        if logger_store is not None:
+            log.info(f"Logger calls in {logger_store.db_file}: {logger_store.count()}")
+            logger_store.close()
+            logger_store = None
+        if study_metrics is not None:
+            study_metrics.save(output_file(metrics_state))
+            study_metrics = None
+        if record_writer is not None:
+            log.info(f"Records in {record_writer.file_name}: {record_writer.rows} rows, {record_writer.bytes} bytes")
+            record_writer.close()
+            record_writer = None
+        log.info(f"Time spent: {time() - start_moment:.3f} seconds")
+
+
+def read_refresh_log(csv_file: str) -> Dict[str, Tuple[str, str]]:
+    """
+    repo -> (HEAD before, HEAD after), as written by `clone --update --refresh-log`
+    """
+    with open(csv_file, encoding="utf-8", newline="") as f:
+        return {row["repo"]: (row["old_head"], row["new_head"]) for row in DictReader(f)}
+
+
+def read_rows_by_repo(csv_file: str) -> Dict[str, List[dict]]:
+    rows = defaultdict(list)
+    with open(csv_file, encoding="utf-8", newline="") as f:
+        for row in DictReader(f):
+            rows[row["repo"]].append(row)
+    return rows
+
+
+def delta_main(repo: str, previous_rows: List[dict], old_head: str, new_head: str, csv_name: str = output_csv) -> int:
+    """
+    Keeps the previous rows of the files untouched between old_head and new_head and
+    parses only the changed .py blobs at new_head; returns how many were changed
+    """
+    changed = diff_paths(git_dir(repo), old_head, new_head)
+    kept = [row for row in previous_rows if row["path"][len(repo) + 1:] not in changed]
+    with open(output_file(csv_name), "a", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f=f, fieldnames=columns)
+        # A changed file that does not decode is skipped alone: the kept rows stay
+        changed_rows = git_logger_finder(repo, rev=new_head, only=changed, skip_undecodable=True)
+        rows = kept + [row for path in changed_rows for row in path]
+        csv.writerows(rows)
+        store_rows(repo, rows)
+    log.info(f"{repo} | Delta {old_head[:8]}..{new_head[:8]}: {len(changed)} paths changed, {len(kept)} rows kept")
+    return len(changed)
+
+
+def delta_scan(
+        repos: list,
+        previous_csv: str,
+        refresh_csv: str,
+        csv_name: str = output_csv,
+        max_workers: int = _max_workers,
+        engine: str = "worktree",
+        store_db: Optional[str] = None,
+        metrics_state: Optional[str] = None,
+        records_file: Optional[str] = None,
+) -> dict:
+    """
+    Re-scan after `clone --update`: repositories that did not move keep their rows from
+    previous_csv, updated ones only get their changed blobs parsed (delta_main()) and
+    new clones (or ones missing from previous_csv) are scanned in full
+    """
+    global blob_cache, logger_store, study_metrics, record_writer
+    start_moment = time()
+    previous = read_rows_by_repo(previous_csv)
+    heads = read_refresh_log(refresh_csv)
+    blob_cache = BlobCache(_blob_cache_bytes)
+    chdir(_repos_path)
+    new_output_csv(csv_name)
+    logger_store = LoggerStore(output_file(store_db)) if store_db else None
+    if logger_store is not None:
+        logger_store.reset()
+    study_metrics = StudyMetrics() if metrics_state else None
+    record_writer = RecordWriter(output_file(records_file)) if records_file else None
+    stats = dict(kept=0, delta=0, full=0, failed=0, paths_changed=0)
+    try:
+        for repo in repos:
+            old_head, new_head = heads.get(repo, (None, None))
+            if old_head == new_head and (old_head or repo in previous):
+                rows = previous.get(repo, [])
+                with open(output_file(csv_name), "a", encoding="utf-8", newline="") as f:
+                    DictWriter(f=f, fieldnames=columns).writerows(rows)
+                store_rows(repo, rows)
+                stats["kept"] += 1
+            elif old_head and repo in previous:
+                stats["paths_changed"] += delta_main(repo, previous[repo], old_head, new_head, csv_name)
+                stats["delta"] += 1
+            # Without rows in previous_csv (no calls, or its last scan failed), only
+            # a full scan tells its unchanged files' calls
+            elif main(repo, csv_name=csv_name, max_workers=max_workers, engine=engine):
+                stats["full"] += 1
+            else:
+                failed_repos.add(repo)
+                stats["failed"] += 1
+    finally:
+        log.info(f"Delta scan: {stats} | Content dedup: {blob_cache.stats()}")
+        if logger_store is not None:
+            logger_store.close()
+            logger_store = None
+        if study_metrics is not None:
+            study_metrics.save(output_file(metrics_state))
+            study_metrics = None
+        if record_writer is not None:
+            log.info(f"Records in {record_writer.file_name}: {record_writer.rows} rows, {record_writer.bytes} bytes")
+            record_writer.close()
+            record_writer = None
         log.info(f"Time spent: {time() - start_moment:.3f} seconds")
+    return stats
+
+
+def write_skipped(csv_file: str):
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        csv = DictWriter(f, fieldnames=["repo", "path", "reason"])
+        csv.writeheader()
+        with _skipped_lock:
+            csv.writerows(dict(repo=repo, path=path, reason=reason) for repo, path, reason in skipped_files)
+
+
+def read_repos_list(repos_file: str) -> list:
+    with open(repos_file) as f:
+        return f.read().splitlines()
+
+
+if __name__ == "__main__":
+    scan(read_repos_list(f"{_output_path}/selected_repos"))  # Alphabetical
+    # scan(read_repos_list(f"{_output_path}/selected_repos_r"))  # Reverse order
@@ -0,0 +1,167 @@
+"""
+Indexed SQLite store of the logger rows written by logger_parser, so the output can
+be queried without re-reading the CSVs: B-tree indexes on repo, verbosity, level and
+logger_object, an FTS5 index over full_content, and repository metadata (license,
+stars, ...) from the bulk CSV to filter on.
+
+    $ python -m app index --db output/logger_calls.db --calls output/logger_calls.csv --repos output/bulk_updated.csv
+    $ python -m app query --db output/logger_calls.db --verbosity ERROR --license "MIT License" timeout
+"""
+from sqlite3 import OperationalError, connect
+from time import time
+from typing import Iterable, List, Optional
+
+from app import lazy_logger, logging_setup
+from app.nlp import read_chunks
+from app.records import read_call_chunks
+
+log = lazy_logger(name="logger_store", **logging_setup)
+
+_call_columns = ("repo", "path", "line", "logger_object", "method", "verbosity", "level", "full_content")
+_repo_columns = ("repo", "license", "stars", "is_fork", "in_org", "lloc")
+_indexed_columns = ("repo", "verbosity", "level", "logger_object")
+
+_schema = (
+    """CREATE TABLE IF NOT EXISTS calls (
+        id INTEGER PRIMARY KEY,
+        repo TEXT, path TEXT, line INTEGER, logger_object TEXT, method TEXT,
+        verbosity TEXT, level INTEGER, full_content TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS repos (
+        repo TEXT PRIMARY KEY, license TEXT, stars INTEGER, is_fork TEXT, in_org TEXT, lloc INTEGER
+    )""",
+    # External content: the text is only stored once, in calls
+    "CREATE VIRTUAL TABLE IF NOT EXISTS calls_fts USING fts5(full_content, content='calls', content_rowid='id')",
+    "CREATE INDEX IF NOT EXISTS repos_license ON repos (license)",
+    *(f"CREATE INDEX IF NOT EXISTS calls_{c} ON calls ({c})" for c in _indexed_columns),
+)
+
+
+def _integer(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LoggerStore:
+    """
+    Bulk-loaded from the scanner (insert_rows() per repository) or from finished CSVs
+    """
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.__db = connect(db_file)
+        self.__db.execute("PRAGMA journal_mode = WAL")
+        self.__db.execute("PRAGMA synchronous = NORMAL")
+        for statement in _schema:
+            self.__db.execute(statement)
+
+    def reset(self):
+        self.__db.execute("DELETE FROM calls")
+        self.__db.execute("INSERT INTO calls_fts (calls_fts) VALUES ('delete-all')")
+        self.__db.commit()
+
+    def insert_rows(self, rows: Iterable[dict]) -> int:
+        """
+        One transaction per call: the rows of a repository, or a chunk of a CSV
+        """
+        last_id = self.__db.execute("SELECT COALESCE(MAX(id), 0) FROM calls").fetchone()[0]
+        cursor = self.__db.executemany(
+            f"INSERT INTO calls ({', '.join(_call_columns)}) VALUES ({', '.join('?' * len(_call_columns))})",
+            (
+                (row["repo"], row["path"], _integer(row["line"]), row["logger_object"], row["method"],
+                 row["verbosity"], _integer(row["level"]), row["full_content"])
+                for row in rows
+            ),
+        )
+        self.__db.execute(
+            "INSERT INTO calls_fts (rowid, full_content) SELECT id, full_content FROM calls WHERE id > ?",
+            (last_id,),
+        )
+        self.__db.commit()
+        return cursor.rowcount
+
+    def load_calls(self, csv_file: str, chunk_size: int = 50000) -> int:
+        start = time()
+        rows = 0
+        for chunk in read_call_chunks(csv_file, chunk_size):
+            rows += self.insert_rows(chunk)
+        log.info(f"{rows} logger calls from {csv_file} indexed in {time() - start:.2f}s")
+        return rows
+
+    def load_repos(self, csv_file: str) -> int:
+        """
+        Repository metadata from a bulk CSV (data_processing._csv_fieldnames)
+        """
+        rows = 0
+        for chunk in read_chunks(csv_file):
+            cursor = self.__db.executemany(
+                f"INSERT OR REPLACE INTO repos ({', '.join(_repo_columns)}) VALUES ({', '.join('?' * len(_repo_columns))})",
+                (
+                    (row["repo"], row.get("license") or None, _integer(row.get("stars")), row.get("is_fork"),
+                     row.get("in_org"), _integer(row.get("lloc")))
+                    for row in chunk
+                ),
+            )
+            rows += cursor.rowcount
+        self.__db.commit()
+        log.info(f"Metadata of {rows} repositories loaded from {csv_file}")
+        return rows
+
+    def query(
+            self,
+            text: Optional[str] = None,
+            verbosity: Optional[str] = None,
+            level: Optional[int] = None,
+            repo: Optional[str] = None,
+            logger_object: Optional[str] = None,
+            license: Optional[str] = None,
+            limit: Optional[int] = 100,
+    ) -> List[dict]:
+        """
+        Logger calls matching every given filter; text is an FTS5 query over
+        full_content (words, "phrases", prefix*, AND/OR/NOT). ValueError when text is
+        not a valid FTS5 query.
+        """
+        joins, where, params = [], [], []
+        if text:
+            joins.append("JOIN calls_fts ON calls_fts.rowid = calls.id")
+            where.append("calls_fts MATCH ?")
+            params.append(text)
+        if license:
+            joins.append("JOIN repos ON repos.repo = calls.repo")
+            where.append("repos.license = ?")
+            params.append(license)
+        for column, value in (("verbosity", verbosity), ("level", level), ("repo", repo), ("logger_object", logger_object)):
+            if value is not None:
+                where.append(f"calls.{column} = ?")
+                params.append(value)
+        sql = f"SELECT {', '.join(f'calls.{c}' for c in _call_columns)} FROM calls {' '.join(joins)}"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        sql += " ORDER BY calls.id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        try:
+            return [dict(zip(_call_columns, row)) for row in self.__db.execute(sql, params)]
+        except OperationalError as e:
+            if text and not self.valid_match(text):
+                raise ValueError(f"Invalid full-text query {text!r}: {e}") from e
+            raise
+
+    def valid_match(self, text: str) -> bool:
+        """
+        Whether text parses as an FTS5 query (unbalanced quotes, bare operators, ... do not)
+        """
+        try:
+            self.__db.execute("SELECT rowid FROM calls_fts WHERE calls_fts MATCH ? LIMIT 1", (text,)).fetchall()
+        except OperationalError:
+            return False
+        return True
+
+    def count(self) -> int:
+        return self.__db.execute("SELECT COUNT(*) FROM calls").fetchone()[0]
+
+    def close(self):
+        self.__db.execute("PRAGMA optimize")
+        self.__db.close()
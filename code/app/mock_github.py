@@ -0,0 +1,498 @@
+from base64 import b64decode, b64encode
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from os import makedirs
+from os.path import exists, join
+from random import Random
+from re import compile
+from shutil import rmtree
+from subprocess import DEVNULL, Popen
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Optional
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="mock_github", **logging_setup)
+
+regex_after_cursor = compile(r'after:\s*"(?P<cursor>[^"]*)"')
+regex_stars_filter = compile(r"stars:(?P<stars_filter>\S+)")
+regex_repo_filter = compile(r"repo:\s*(?P<repo>[\w.-]+/[\w.-]+)")
+regex_first = compile(r"first:\s*(?P<first>\d+)")
+regex_repository_alias = compile(
+    r'(?P<alias>\w+):\s*repository\(owner:\s*"(?P<owner>[^"]*)",\s*name:\s*"(?P<name>[^"]*)"\)'
+)
+
+# HEAD trees of the fake repositories (msa_clues.gql), picked by index % 5
+_fake_trees = (
+    ("setup.py", "app/__init__.py", "Dockerfile"),
+    ("setup.py", "app/__init__.py", "deploy/docker-compose.yaml"),
+    ("setup.py", "app/__init__.py", "k8s/base/configmap.yaml"),
+    ("setup.py", "app/__init__.py", "docs/source/conf.py"),
+    ("setup.py", "app/__init__.py", "services/api/docker/prod/Dockerfile"),
+)
+_tree_query_depth = 3  # levels of entries msa_clues.gql asks for
+
+_sample_files = {
+    "main.py": (
+        "import logging\n"
+        "\n"
+        "log = logging.getLogger(__name__)\n"
+        "\n"
+        "\n"
+        "def main():\n"
+        "    log.info(\"Starting service\")\n"
+        "    log.debug(\"Loaded %d items\", 42)\n"
+        "    log.warning(\"Cache miss for key=%s\",\n"
+        "                \"user\")\n"
+        "    log.log(logging.ERROR, \"Connection timeout\")\n"
+    ),
+    "app/worker.py": (
+        "from logzero import logger\n"
+        "\n"
+        "\n"
+        "def work(job):\n"
+        "    logger.error(f\"Job failed: {job}\")\n"
+        "    logger.critical(\"Worker is shutting down\")\n"
+    ),
+    "Dockerfile": "FROM python:3.8-slim\nCOPY . /app\nCMD [\"python\", \"main.py\"]\n",
+    "docker-compose.yml": "version: \"3\"\nservices:\n  app:\n    build: .\n",
+}
+
+
+class MockSettings:
+    """
+    Knobs of the mock server. Latency is in seconds; error rates are probabilities
+    (0..1) applied to every GraphQL request independently.
+    """
+    def __init__(
+            self,
+            repo_count: int = 1000,
+            latency: float = 0.0,
+            latency_jitter: float = 0.0,
+            rate_limit: int = 5000,
+            error_403_rate: float = 0.0,
+            error_5xx_rate: float = 0.0,
+            graphql_error_rate: float = 0.0,
+            seed: int = 42,
+            epoch: int = 0,
+    ):
+        self.repo_count = repo_count
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.error_403_rate = error_403_rate
+        self.error_5xx_rate = error_5xx_rate
+        # 200 responses with "data": null and a RATE_LIMITED error, as GitHub sends them
+        self.graphql_error_rate = graphql_error_rate
+        self.seed = seed
+        # Days every 4th repository moved forward (updatedAt/pushedAt), to exercise delta refreshes
+        self.epoch = epoch
+
+
+def fake_repo_name(index: int) -> str:
+    return f"owner{index % 97:02d}/repo{index:05d}"
+
+
+def fake_stars(index: int, repo_count: int) -> int:
+    # Sorted descending by index, like GitHub's "stars" search ordering
+    return 100 + (repo_count - index) * 3
+
+
+def encode_cursor(offset: int) -> str:
+    return b64encode(f"cursor:{offset}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(b64decode(cursor.encode()).decode().split(":")[1])
+    except (ValueError, IndexError):
+        return 0
+
+
+def fake_tree(paths, depth: int = _tree_query_depth) -> dict:
+    """
+    GraphQL Tree object ({"entries": [{name, type, object}, ...]}) holding the given
+    paths, down to depth levels of entries like the query that asks for it
+    """
+    tree = dict(entries=[])
+    for path in paths:
+        node = tree
+        *dirs, name = path.split("/")
+        for level, directory in enumerate(dirs, 1):
+            entry = next((e for e in node["entries"] if e["name"] == directory), None)
+            if entry is None:
+                entry = dict(name=directory, type="tree")
+                if level < depth:
+                    entry["object"] = dict(entries=[])
+                node["entries"].append(entry)
+            if "object" not in entry:
+                break
+            node = entry["object"]
+        else:
+            node["entries"].append(dict(name=name, type="blob", object=dict()))
+    return tree
+
+
+def fake_tree_listing(paths) -> dict:
+    """
+    REST recursive tree (GET /repos/{owner}/{repo}/git/trees/HEAD?recursive=1) of the given paths
+    """
+    entries = {}
+    for path in paths:
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            entries.setdefault("/".join(parts[:i]), "tree")
+        entries[path] = "blob"
+    return dict(tree=[dict(path=path, type=kind) for path, kind in entries.items()], truncated=False)
+
+
+def parse_stars_filter(stars_filter: Optional[str], repo_count: int) -> range:
+    """
+    Returns the range of fake repo indexes matching a GitHub stars filter
+    (">7", "<42", "42..420" or "42").
+    """
+    indexes = range(repo_count)
+    if not stars_filter:
+        return indexes
+    if ".." in stars_filter:
+        low, high = (int(s) for s in stars_filter.split(".."))
+    elif stars_filter.startswith(">"):
+        low, high = int(stars_filter[1:]) + 1, float("inf")
+    elif stars_filter.startswith("<"):
+        low, high = 0, int(stars_filter[1:]) - 1
+    else:
+        low = high = int(stars_filter)
+    return [i for i in indexes if low <= fake_stars(i, repo_count) <= high]
+
+
+class MockGitHub:
+    """
+    Local stand-in for api.github.com (GraphQL v4) plus a git daemon serving bare
+    repositories, so data_ingestion/data_processing can be exercised offline.
+    """
+    def __init__(self, settings: MockSettings = None, host: str = "127.0.0.1", port: int = 0):
+        self.settings = settings or MockSettings()
+        self.host = host
+        self.requests_served = 0
+        self.errors_injected = 0
+        self.__random = Random(self.settings.seed)
+        self.__lock = Lock()
+        self.__rate_limit_remaining = self.settings.rate_limit
+        self.__server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.__server.daemon_threads = True
+        self.__thread = None
+        self.__git_daemon = None
+        self.__git_port = None
+        self.__git_root = None
+        self.__git_root_is_temp = False
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}/graphql"
+
+    @property
+    def git_root(self):
+        return self.__git_root
+
+    def repo_url(self, repo: str) -> str:
+        # data_ingestion.clone_repo() turns "https" into "git" and appends ".git"
+        if self.__git_port:
+            return f"https://{self.host}:{self.__git_port}/{repo}"
+        return f"https://github.com/{repo}"
+
+    def start(self):
+        self.__thread = Thread(target=self.__server.serve_forever, name="mock_github", daemon=True)
+        self.__thread.start()
+        log.info(f"Mock GraphQL endpoint listening on {self.endpoint}")
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        if self.__git_daemon:
+            self.__git_daemon.terminate()
+            self.__git_daemon.wait()
+            self.__git_daemon = None
+        if self.__git_root_is_temp and self.__git_root:
+            rmtree(self.__git_root, ignore_errors=True)
+        log.info(f"Mock server stopped after {self.requests_served} requests")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def make_bare_repos(self, count: int, root: Optional[str] = None) -> str:
+        """
+        Creates `count` bare repositories (same names as the GraphQL results) under
+        `root` from a single template commit with a few logger calls and container files.
+        """
+        from git import Git
+
+        if root is None:
+            root = mkdtemp(prefix="mock_github_repos_")
+            self.__git_root_is_temp = True
+        self.__git_root = root
+        template = join(root, "_template")
+        for path, content in _sample_files.items():
+            makedirs(join(template, *path.split("/")[:-1]), exist_ok=True)
+            with open(join(template, path), "w", encoding="utf-8") as f:
+                f.write(content)
+        git = Git(template)
+        git.init()
+        git.add(".")
+        git.commit(
+            "-m", "Initial commit",
+            author="Mock <mock@example.com>",
+            env=dict(GIT_COMMITTER_NAME="Mock", GIT_COMMITTER_EMAIL="mock@example.com"),
+        )
+        for i in range(count):
+            bare_path = join(root, f"{fake_repo_name(i)}.git")
+            if not exists(bare_path):
+                Git(root).clone("--bare", "--quiet", template, bare_path)
+        log.info(f"Created {count} bare repositories under {root}")
+        return root
+
+    def start_git_daemon(self, port: int = 9418):
+        if not self.__git_root:
+            raise RuntimeError("make_bare_repos() must be called before start_git_daemon()")
+        self.__git_daemon = Popen(
+            [
+                "git", "daemon", "--reuseaddr", "--export-all",
+                f"--base-path={self.__git_root}", f"--listen={self.host}", f"--port={port}",
+                self.__git_root,
+            ],
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+        self.__git_port = port
+        sleep(0.5)
+        log.info(f"git daemon serving {self.__git_root} on git://{self.host}:{port}")
+
+    def search_node(self, index: int) -> dict:
+        repo = fake_repo_name(index)
+        return dict(
+            nameWithOwner=repo,
+            url=self.repo_url(repo),
+            stargazers=dict(totalCount=fake_stars(index, self.settings.repo_count)),
+        )
+
+    def timestamps(self, index: int) -> dict:
+        day = 1 + (self.settings.epoch if index % 4 == 0 else 0)
+        return dict(updatedAt=f"2021-03-{day:02d}T00:00:00Z", pushedAt=f"2021-02-{day:02d}T12:00:00Z")
+
+    def details_node(self, index: int) -> dict:
+        repo = fake_repo_name(index)
+        rnd = Random(index)
+        return dict(
+            id=b64encode(f"010:Repository{index}".encode()).decode(),
+            nameWithOwner=repo,
+            sshUrl=f"git@github.com:{repo}.git",
+            createdAt=f"20{10 + index % 10}-01-01T00:00:00Z",
+            **self.timestamps(index),
+            isFork=index % 13 == 0,
+            isInOrganization=index % 2 == 0,
+            licenseInfo=dict(name=("MIT License", "Apache License 2.0", "Other")[index % 3]) if index % 5 else None,
+            stargazers=dict(totalCount=fake_stars(index, self.settings.repo_count)),
+            watchers=dict(totalCount=rnd.randint(0, 500)),
+            forks=dict(totalCount=rnd.randint(0, 500)),
+            releases=dict(totalCount=rnd.randint(0, 50)),
+            commitComments=dict(totalCount=rnd.randint(0, 50)),
+            collaborators=None,
+            collaboratorsDirect=None,
+            collaboratorsOutside=None,
+            pullRequests=dict(totalCount=rnd.randint(0, 1000)),
+            pullRequestsOpen=dict(totalCount=rnd.randint(0, 50)),
+            issues=dict(totalCount=rnd.randint(0, 1000)),
+            issuesOpen=dict(totalCount=rnd.randint(0, 100)),
+        )
+
+    def repository_index(self, repo: str) -> int:
+        try:
+            index = int(repo.split("/repo")[1])
+        except (IndexError, ValueError):
+            return -1
+        return index if 0 <= index < self.settings.repo_count and fake_repo_name(index) == repo else -1
+
+    def resolve_query(self, query: str) -> dict:
+        if aliases := list(regex_repository_alias.finditer(query)):
+            data, errors = {}, []
+            for match in aliases:
+                repo = f"{match.group('owner')}/{match.group('name')}"
+                index = self.repository_index(repo)
+                data[match.group("alias")] = dict(
+                    nameWithOwner=repo, root=fake_tree(_fake_trees[index % len(_fake_trees)]), **self.timestamps(index)
+                ) if index >= 0 else None
+                if index < 0:
+                    errors.append(dict(
+                        type="NOT_FOUND", path=[match.group("alias")],
+                        message=f"Could not resolve to a Repository with the name '{repo}'.",
+                    ))
+            data["rateLimit"] = dict(cost=1, remaining=self.__rate_limit_remaining)
+            return dict(data=data, errors=errors) if errors else dict(data=data)
+
+        if repo_match := regex_repo_filter.search(query):
+            name = repo_match.group("repo")
+            try:
+                index = int(name.split("/repo")[1])
+            except (IndexError, ValueError):
+                index = -1
+            nodes = [self.details_node(index)] if 0 <= index < self.settings.repo_count else []
+            return dict(data=dict(search=dict(repositoryCount=len(nodes), nodes=nodes)))
+
+        stars_match = regex_stars_filter.search(query)
+        indexes = parse_stars_filter(stars_match.group("stars_filter") if stars_match else None, self.settings.repo_count)
+        after_match = regex_after_cursor.search(query)
+        offset = decode_cursor(after_match.group("cursor")) if after_match else 0
+        first_match = regex_first.search(query)
+        first = int(first_match.group("first")) if first_match else 100
+        page = indexes[offset:offset + first]
+        end = offset + len(page)
+        return dict(data=dict(search=dict(
+            pageInfo=dict(hasNextPage=end < len(indexes), endCursor=encode_cursor(end)),
+            repositoryCount=len(indexes),
+            nodes=[self.search_node(i) for i in page],
+        )))
+
+    def delay(self):
+        if self.settings.latency or self.settings.latency_jitter:
+            with self.__lock:
+                jitter = self.__random.uniform(0, self.settings.latency_jitter)
+            sleep(self.settings.latency + jitter)
+
+    def next_status(self) -> int:
+        with self.__lock:
+            self.requests_served += 1
+            if self.__rate_limit_remaining <= 0:
+                self.errors_injected += 1
+                return 403
+            self.__rate_limit_remaining -= 1
+            roll = self.__random.random()
+            if roll < self.settings.error_403_rate:
+                self.errors_injected += 1
+                return 403
+            if roll < self.settings.error_403_rate + self.settings.error_5xx_rate:
+                self.errors_injected += 1
+                return self.__random.choice((500, 502, 503))
+            return 200
+
+    def graphql_error(self) -> bool:
+        with self.__lock:
+            if self.__random.random() < self.settings.graphql_error_rate:
+                self.errors_injected += 1
+                return True
+        return False
+
+    def rate_limit_headers(self) -> dict:
+        return {
+            "X-RateLimit-Limit": str(self.settings.rate_limit),
+            "X-RateLimit-Remaining": str(max(self.__rate_limit_remaining, 0)),
+            "X-RateLimit-Reset": str(int(time()) + 3600),
+        }
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                mock.delay()
+                status = mock.next_status()
+                if status == 200 and mock.graphql_error():
+                    payload = dict(data=None, errors=[dict(type="RATE_LIMITED", message="API rate limit exceeded")])
+                elif status == 200:
+                    try:
+                        payload = mock.resolve_query(loads(body)["query"])
+                    except (ValueError, KeyError) as e:
+                        status, payload = 400, dict(message=f"Bad request: {e}")
+                else:
+                    payload = dict(message=f"Injected error ({status})")
+                self.respond(status, payload)
+
+            def do_GET(self):
+                # REST recursive trees: /repos/{owner}/{repo}/git/trees/HEAD?recursive=1
+                mock.delay()
+                status = mock.next_status()
+                path = self.path.split("?")[0].split("/")
+                index = mock.repository_index("/".join(path[2:4])) if path[1:2] == ["repos"] else -1
+                if status != 200:
+                    payload = dict(message=f"Injected error ({status})")
+                elif index < 0 or path[4:6] != ["git", "trees"]:
+                    status, payload = 404, dict(message="Not Found")
+                else:
+                    payload = fake_tree_listing(_fake_trees[index % len(_fake_trees)])
+                self.respond(status, payload)
+
+            def respond(self, status: int, payload: dict):
+                data = dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in mock.rate_limit_headers().items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                log.debug(f"mock_github | {self.address_string()} | {format % args}")
+
+        return Handler
+
+
+def fake_token() -> str:
+    return sha1(b"mock_github").hexdigest()
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Local mock of the GitHub GraphQL API and git server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--git-port", type=int, default=9418)
+    parser.add_argument("--repos", type=int, default=1000)
+    parser.add_argument("--bare-repos", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=5000)
+    parser.add_argument("--error-403-rate", type=float, default=0.0)
+    parser.add_argument("--error-5xx-rate", type=float, default=0.0)
+    parser.add_argument("--graphql-error-rate", type=float, default=0.0,
+                        help="share of 200 responses with data: null and a RATE_LIMITED error")
+    parser.add_argument("--epoch", type=int, default=0, help="days every 4th repository was updated by")
+    args = parser.parse_args()
+
+    server = MockGitHub(
+        MockSettings(
+            repo_count=args.repos,
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            rate_limit=args.rate_limit,
+            error_403_rate=args.error_403_rate,
+            error_5xx_rate=args.error_5xx_rate,
+            graphql_error_rate=args.graphql_error_rate,
+            epoch=args.epoch,
+        ),
+        port=args.port,
+    )
+    if args.bare_repos:
+        server.make_bare_repos(args.bare_repos)
+        server.start_git_daemon(args.git_port)
+    server.start()
+    print(f"GraphQL endpoint: {server.endpoint} | GITHUB_TOKEN={fake_token()}")
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        log.warning("Execution interrupted by user (^C)")
+    finally:
+        server.stop()
@@ -1,12 +1,13 @@
 from dataclasses import dataclass
-from typing import Optional
+from json import dumps
+from logging import DEBUG
+from typing import List, Optional
 
-from logzero import setup_logger
-
-from app import logging_setup, https
+from app import get_https, lazy_logger, logging_setup
+from app.parallel import throttled
 
 # Setting up logger object
-log = setup_logger(name="models", **logging_setup)
+log = lazy_logger(name="models", **logging_setup)
 
 
 class GQL:
@@ -108,39 +109,38 @@ class GQL:
 
     def run_query(self, retry=2, raw_response=False):
         for i in range(-1, retry):
-            response = https.post(
+            response = get_https().post(
                 url=self.endpoint, headers=self.headers, json=dict(query=self.query)
             )
             if raw_response:
                 return response
+            # Lazy %-formatting: nothing is built (or decoded) unless DEBUG is on
             if "X-RateLimit-Remaining" in response.headers:
                 log.debug(
-                    f"{self.__class__}.run_query({self.__hash__()}): "
-                    f"X-RateLimit-Remaining={response.headers['X-RateLimit-Remaining']}"
+                    "%s.run_query(%s): X-RateLimit-Remaining=%s",
+                    self.__class__, self.__hash__(), response.headers["X-RateLimit-Remaining"],
                 )
-            else:
+            elif log.isEnabledFor(DEBUG):
                 log.debug(
-                    f"{self.__class__}.run_query({self.__hash__()}): "
-                    f"response[{response.status_code}].text={response.text}"
+                    "%s.run_query(%s): response[%s].text=%s",
+                    self.__class__, self.__hash__(), response.status_code, response.text,
                 )
             if response.status_code == 200:
                 self.set_query_results(response.json())
                 return self.query_results
             elif response.status_code == 403:
-                log.debug(
-                    f"{self.__class__}.run_query({self.__hash__()}): "
-                    f"self.query={self.query}"
-                )
+                throttled("github")
+                log.debug("%s.run_query(%s): self.query=%s", self.__class__, self.__hash__(), self.query)
                 raise ConnectionRefusedError(
                     f"Triggered API abuse mechanism! (hash={self.__hash__()})"
                 )
+            if response.status_code >= 500:
+                throttled("github")
             log.warning(
                 f"Query attempt #{i + 2} failed (status_code={response.status_code})"
             )
         log.error(f"Giving up on query (hash={self.__hash__()})")
-        log.debug(
-            f"{self.__class__}.run_query({self.__hash__()}): self.query={self.query})"
-        )
+        log.debug("%s.run_query(%s): self.query=%s)", self.__class__, self.__hash__(), self.query)
 
     def next_page(self):
         if not self.paging.has_next_page:
@@ -150,12 +150,25 @@ class GQL:
         return self.run_query()
 
 
+def repository_aliases(repos: List[str], selection: str) -> str:
+    """
+    One aliased repository field (r0, r1, ...) per "owner/name", to look a batch of
+    repositories up in a single GraphQL request
+    """
+    aliases = []
+    for i, repo in enumerate(repos):
+        owner, name = repo.split("/")
+        aliases.append(f"  r{i}: repository(owner: {dumps(owner)}, name: {dumps(name)}) {{ {selection} }}")
+    return "\n".join(aliases)
+
+
 @dataclass
 class Repo:
     id: str = ""
     ssh_url: str = ""
     created_at: str = ""
     updated_at: str = ""
+    pushed_at: str = ""
     license_info_name: str = ""
     is_fork: Optional[bool] = None
     is_in_organization: Optional[bool] = None
@@ -181,6 +194,7 @@ class Repo:
             self.ssh_url = json["sshUrl"]
             self.created_at = json["createdAt"]
             self.updated_at = json["updatedAt"]
+            self.pushed_at = json.get("pushedAt") or ""
             self.is_fork = json["isFork"]
             self.is_in_organization = json["isInOrganization"]
             if json["licenseInfo"]:
@@ -207,6 +221,7 @@ class Repo:
             ssh_url=self.ssh_url,
             created_at=self.created_at,
             updated_at=self.updated_at,
+            pushed_at=self.pushed_at,
             stars=self.stargazers_total_count,
             license=self.license_info_name,
             is_fork=self.is_fork,
@@ -0,0 +1,63 @@
+"""
+Scripted counterparts of the nlp/*.ipynb notebooks, streaming over the logger rows
+written by logger_parser instead of loading them whole. Needs the notebooks' stack:
+scikit-learn and scipy (cleaning), gensim (topics), nltk (nouns), textblob (sentiment).
+"""
+from csv import DictReader, field_size_limit
+from hashlib import sha1
+from sqlite3 import connect
+from sys import maxsize
+from typing import Dict, Iterator, List, Tuple
+
+verbosity_levels = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+def read_chunks(csv_file: str, chunk_size: int = 10000) -> Iterator[List[dict]]:
+    # full_content of a logger call can exceed csv's default 128 KiB field limit
+    field_size_limit(min(maxsize, 2 ** 31 - 1))
+    chunk = []
+    with open(csv_file, encoding="utf-8", newline="") as f:
+        for row in DictReader(f):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def message_hash(text: str) -> str:
+    return sha1(text.encode("utf-8")).hexdigest()
+
+
+class MessageCache:
+    """
+    Persistent message hash -> result mapping shared by the per-message NLP stages;
+    kind tells the stages (and their variants) apart
+    """
+    def __init__(self, db_file: str, kind: str):
+        self.kind = kind
+        self.__db = connect(db_file)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (hash TEXT, kind TEXT, result TEXT, PRIMARY KEY (hash, kind))"
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        for i in range(0, len(keys), 900):  # SQLite's host parameter limit
+            chunk = keys[i:i + 900]
+            found.update(self.__db.execute(
+                f"SELECT hash, result FROM messages WHERE kind = ? AND hash IN ({','.join('?' * len(chunk))})",
+                [self.kind, *chunk],
+            ))
+        return found
+
+    def put_many(self, items: List[Tuple[str, str]]):
+        self.__db.executemany(
+            "INSERT OR REPLACE INTO messages (hash, kind, result) VALUES (?, ?, ?)",
+            [(key, self.kind, result) for key, result in items],
+        )
+        self.__db.commit()
+
+    def close(self):
+        self.__db.close()
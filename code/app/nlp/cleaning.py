@@ -0,0 +1,191 @@
+"""
+Streaming version of nlp/1-data-cleaning.ipynb: logger rows are read in chunks, cleaned
+in a process pool and counted into a sparse per-statement document-term matrix.
+
+Output directory:
+    documents.csv    one row per kept statement (same order as the matrix rows)
+    dtm.npz          scipy CSR matrix, statements x terms
+    vocabulary.json  term -> column, sorted like CountVectorizer.vocabulary_
+"""
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from csv import DictWriter
+from json import dump, load
+from os import makedirs
+from re import compile, escape
+from string import punctuation
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from app import lazy_logger, logging_setup
+from app.nlp import read_chunks, verbosity_levels
+from app.parallel import bounded_map
+
+log = lazy_logger(name="nlp_cleaning", **logging_setup)
+
+_documents_fieldnames = ["repo", "path", "line", "verbosity", "level", "content", "clean_content"]
+
+# Statements which have a string argument (df.full_content.str.contains(...) in the notebook)
+regex_string_argument = compile(r"[\'\"]{1,3}.+[\'\"]{1,3}")
+# clean_text_round1() passes, compiled once
+regex_format_fields = compile(r"\{[\w\(\)\[\]\'\"]*\}")
+regex_percent_s = compile(r"%s")
+regex_punctuation = compile(r"[" + escape(punctuation) + escape("\"'‘’“”…") + r"]")
+regex_digit_words = compile(r"\w*\d\w*")
+# CountVectorizer's default token_pattern
+regex_token = compile(r"(?u)\b\w\w+\b")
+
+_stop_words = frozenset()
+
+
+def clean_text_round1(text: str) -> str:
+    text = text.lower()
+    text = regex_format_fields.sub("", text)
+    text = regex_percent_s.sub("", text)
+    text = regex_punctuation.sub("", text)
+    text = regex_digit_words.sub("", text)
+    return text
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in regex_token.findall(text) if token not in _stop_words]
+
+
+def _init_worker(stop_words: frozenset):
+    global _stop_words
+    _stop_words = stop_words
+
+
+def clean_chunk(rows: List[dict], levels: Tuple[str, ...] = verbosity_levels) -> List[Tuple[dict, Counter]]:
+    """
+    Keeps statements with a string argument at one of the levels; returns
+    (document row, term counts) for each of them
+    """
+    documents = []
+    for row in rows:
+        if row["verbosity"] not in levels or not regex_string_argument.search(row["full_content"]):
+            continue
+        clean_content = clean_text_round1(row["full_content"])
+        document = dict(
+            repo=row["repo"],
+            path=row["path"],
+            line=row["line"],
+            verbosity=row["verbosity"],
+            level=row["level"],
+            content=row["full_content"],
+            clean_content=clean_content,
+        )
+        documents.append((document, Counter(tokenize(clean_content))))
+    return documents
+
+
+class DTMBuilder:
+    """
+    Grows a CSR document-term matrix one document at a time (vocabulary included)
+    """
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.indices = array("q")
+        self.indptr = array("q", [0])
+        self.data = array("q")
+
+    @property
+    def documents(self) -> int:
+        return len(self.indptr) - 1
+
+    def add(self, counts: Counter):
+        vocabulary = self.vocabulary
+        for term, count in counts.items():
+            column = vocabulary.get(term)
+            if column is None:
+                column = vocabulary[term] = len(vocabulary)
+            self.indices.append(column)
+            self.data.append(count)
+        self.indptr.append(len(self.indices))
+
+    def to_csr(self):
+        """
+        Returns (matrix, vocabulary) with columns in alphabetical term order
+        """
+        from numpy import frombuffer, int64
+        from scipy.sparse import csr_matrix
+
+        matrix = csr_matrix(
+            (frombuffer(self.data, dtype=int64), frombuffer(self.indices, dtype=int64), frombuffer(self.indptr, dtype=int64)),
+            shape=(self.documents, len(self.vocabulary)),
+        )
+        terms = sorted(self.vocabulary)
+        matrix = matrix[:, [self.vocabulary[term] for term in terms]]
+        return matrix.tocsr(), {term: column for column, term in enumerate(terms)}
+
+
+def build_dtm(
+        csv_file: str,
+        output_dir: str,
+        stop_words: Optional[frozenset] = None,
+        chunk_size: int = 10000,
+        max_workers: int = 4,
+) -> dict:
+    from scipy.sparse import save_npz
+
+    if stop_words is None:
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+        stop_words = frozenset(ENGLISH_STOP_WORDS)
+    makedirs(output_dir, exist_ok=True)
+    start = time()
+    rows_read = 0
+    builder = DTMBuilder()
+
+    def chunks():
+        nonlocal rows_read
+        for chunk in read_chunks(csv_file, chunk_size):
+            rows_read += len(chunk)
+            yield chunk
+
+    with open(f"{output_dir}/documents.csv", "w", encoding="utf-8", newline="") as f, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(stop_words,)) as ex:
+        csv = DictWriter(f, fieldnames=_documents_fieldnames)
+        csv.writeheader()
+        for documents in bounded_map(ex, clean_chunk, chunks(), max_pending=max_workers * 2):
+            for document, counts in documents:
+                csv.writerow(document)
+                builder.add(counts)
+            log.debug(f"Rows read: {rows_read} | documents: {builder.documents}")
+
+    matrix, vocabulary = builder.to_csr()
+    save_npz(f"{output_dir}/dtm.npz", matrix)
+    with open(f"{output_dir}/vocabulary.json", "w", encoding="utf-8") as f:
+        dump(vocabulary, f)
+    stats = dict(rows=rows_read, documents=matrix.shape[0], terms=matrix.shape[1], nonzero=matrix.nnz)
+    log.info(f"Document-term matrix built in {time() - start:.2f}s: {stats}")
+    return stats
+
+
+def load_dtm(output_dir: str, kind: str = ""):
+    """
+    Returns (matrix, vocabulary) saved by build_dtm(), or by app.nlp.nouns for kind
+    "nouns"/"nouns_adj"
+    """
+    from scipy.sparse import load_npz
+
+    suffix = f"_{kind}" if kind else ""
+    with open(f"{output_dir}/vocabulary{suffix}.json", encoding="utf-8") as f:
+        vocabulary = load(f)
+    return load_npz(f"{output_dir}/dtm{suffix}.npz"), vocabulary
+
+
+def level_dtm(matrix, verbosities: List[str], levels: Tuple[str, ...] = verbosity_levels):
+    """
+    Sums statement rows per verbosity level: the notebook's one-document-per-level matrix
+    """
+    from scipy.sparse import csr_matrix
+
+    rows = {level: i for i, level in enumerate(levels)}
+    keep = [i for i, verbosity in enumerate(verbosities) if verbosity in rows]
+    grouping = csr_matrix(
+        ([1] * len(keep), ([rows[verbosities[i]] for i in keep], keep)),
+        shape=(len(levels), matrix.shape[0]),
+    )
+    return grouping @ matrix
@@ -0,0 +1,137 @@
+"""
+Noun (and noun+adjective) extraction of nlp/4-topic-modeling.ipynb, done once per
+distinct message: statements are deduplicated by a hash of their cleaned content,
+unseen messages are POS-tagged in batches across a process pool and the results are
+kept in a SQLite cache so later runs only tag new messages.
+
+Output directory (next to the clean stage output):
+    dtm_nouns.npz / vocabulary_nouns.json  (or *_nouns_adj with adjectives=True)
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from json import dump
+from time import time
+from typing import Dict, Iterator, List, Tuple
+
+from app import lazy_logger, logging_setup
+from app.nlp import MessageCache, message_hash, read_chunks
+from app.nlp.cleaning import DTMBuilder, regex_token
+from app.parallel import bounded_map
+
+log = lazy_logger(name="nlp_nouns", **logging_setup)
+
+_nltk_resources = (
+    ("tokenizers/punkt", "punkt"),
+    ("tokenizers/punkt_tab", "punkt_tab"),
+    ("taggers/averaged_perceptron_tagger", "averaged_perceptron_tagger"),
+    ("taggers/averaged_perceptron_tagger_eng", "averaged_perceptron_tagger_eng"),
+)
+
+# Additional stop words of the notebook's nouns-only document-term matrix
+add_stop_words = [
+    'like', 'im', 'know', 'just', 'dont', 'thats', 'right', 'people',
+    'youre', 'got', 'gonna', 'time', 'think', 'yeah', 'said',
+    'aa', 'aaaa', 'aaaaa', 'aaccount', 'aaccountusername', 'aad', 'aadclientid',
+    'aadendpoint', 'aadtokenbaseerrormessage', 'aadtenantid', 'aadtype',
+    'aaicon', 'aautoscalinggroupname', 'aaves', 'ab', 'abandonedtaskidentifier',
+    'abbreviateclientinfo', 'abc', 'abck', 'abci', 'abcdeformatoptstr',
+    'abepisodenumbers', 'abi', 'abid', 'abilityid', 'abode', 'abortconnection',
+    'aborterror', 'abortingformat', 'abortmessage', 'abortwithpayloadreasonnamespace',
+    'd', 'data', 'e', 'err', 'ex', 'exc', 'excinfotrue', 'exx', 'f',
+    'ferror', 'format', 'formate', 'id', 'msg', 'n', 'r', 'self',
+    'selfname', 'str', 'stre', 'type', 'x'
+]
+
+
+def ensure_nltk_data():
+    from nltk import data, download
+
+    for path, name in _nltk_resources:
+        try:
+            data.find(path)
+        except LookupError:
+            download(name, quiet=True)
+
+
+def nouns_batch(batch: List[Tuple[str, str]], adjectives: bool = False) -> List[Tuple[str, str]]:
+    """
+    [(hash, text), ...] -> [(hash, nouns), ...]; nouns() of the notebook, tagging the
+    whole batch with one pos_tag_sents() call
+    """
+    from nltk import pos_tag_sents, word_tokenize
+
+    prefixes = ("NN", "JJ") if adjectives else ("NN",)
+    tagged = pos_tag_sents([word_tokenize(text) for _, text in batch])
+    return [
+        (key, " ".join(word for word, pos in sentence if pos[:2] in prefixes))
+        for (key, _), sentence in zip(batch, tagged)
+    ]
+
+
+def unique_messages(documents_csv: str, column: str = "clean_content") -> Tuple[List[str], Dict[str, str]]:
+    """
+    Returns the message hash of every document (in order) and the text of each distinct one
+    """
+    hashes = []
+    texts = {}
+    for chunk in read_chunks(documents_csv):
+        for row in chunk:
+            key = message_hash(row[column])
+            hashes.append(key)
+            texts.setdefault(key, row[column])
+    return hashes, texts
+
+
+def _batches(items: List[Tuple[str, str]], batch_size: int) -> Iterator[List[Tuple[str, str]]]:
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def _nouns_batch_adjectives(batch: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    return nouns_batch(batch, adjectives=True)
+
+
+def extract_nouns(
+        dtm_dir: str,
+        cache_file: str,
+        adjectives: bool = False,
+        batch_size: int = 2000,
+        max_workers: int = 4,
+) -> dict:
+    from scipy.sparse import save_npz
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    kind = "nouns_adj" if adjectives else "nouns"
+    start = time()
+    hashes, texts = unique_messages(f"{dtm_dir}/documents.csv")
+    cache = MessageCache(cache_file, kind=kind)
+    try:
+        nouns = cache.get_many(list(texts))
+        missing = [(key, text) for key, text in texts.items() if key not in nouns]
+        log.info(f"{len(hashes)} documents | {len(texts)} distinct messages | {len(missing)} to tag")
+        if missing:
+            ensure_nltk_data()
+            tag = _nouns_batch_adjectives if adjectives else nouns_batch
+            with ProcessPoolExecutor(max_workers=max_workers) as ex:
+                for tagged in bounded_map(ex, tag, _batches(missing, batch_size), max_pending=max_workers * 2):
+                    cache.put_many(tagged)
+                    nouns.update(tagged)
+    finally:
+        cache.close()
+
+    # Counted once per distinct message, then repeated for each of its documents
+    stop_words = ENGLISH_STOP_WORDS.union(add_stop_words)
+    counts = {
+        key: Counter(token for token in regex_token.findall(text.lower()) if token not in stop_words)
+        for key, text in nouns.items()
+    }
+    builder = DTMBuilder()
+    for key in hashes:
+        builder.add(counts[key])
+    matrix, vocabulary = builder.to_csr()
+    save_npz(f"{dtm_dir}/dtm_{kind}.npz", matrix)
+    with open(f"{dtm_dir}/vocabulary_{kind}.json", "w", encoding="utf-8") as f:
+        dump(vocabulary, f)
+    stats = dict(documents=len(hashes), distinct=len(texts), tagged=len(missing), terms=len(vocabulary))
+    log.info(f"{kind} document-term matrix built in {time() - start:.2f}s: {stats}")
+    return stats
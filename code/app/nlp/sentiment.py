@@ -0,0 +1,75 @@
+"""
+Per-statement version of nlp/3-sentiment-analysis.ipynb: every logger row gets its own
+polarity and subjectivity (one TextBlob parse per distinct message, shared through
+a persistent cache), written back as two extra columns of the logger CSV.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from csv import DictWriter
+from json import dumps, loads
+from time import time
+from typing import Dict, List, Tuple
+
+from app import lazy_logger, logging_setup
+from app.nlp import MessageCache, message_hash, read_chunks
+
+log = lazy_logger(name="nlp_sentiment", **logging_setup)
+
+_sentiment_columns = ["polarity", "subjectivity"]
+
+
+def sentiment_batch(batch: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    [(hash, text), ...] -> [(hash, "[polarity, subjectivity]"), ...]
+    """
+    from textblob import TextBlob
+
+    results = []
+    for key, text in batch:
+        sentiment = TextBlob(text).sentiment
+        results.append((key, dumps([round(sentiment.polarity, 6), round(sentiment.subjectivity, 6)])))
+    return results
+
+
+def score_rows(
+        csv_file: str,
+        output_file: str,
+        cache_file: str,
+        column: str = "full_content",
+        chunk_size: int = 50000,
+        batch_size: int = 1000,
+        max_workers: int = 4,
+) -> dict:
+    start = time()
+    scores: Dict[str, List[float]] = {}
+    stats = dict(rows=0, distinct=0, cached=0, scored=0)
+    cache = MessageCache(cache_file, kind="sentiment")
+    try:
+        with open(output_file, "w", encoding="utf-8", newline="") as f, \
+                ProcessPoolExecutor(max_workers=max_workers) as ex:
+            csv = None
+            for chunk in read_chunks(csv_file, chunk_size):
+                if csv is None:
+                    csv = DictWriter(f, fieldnames=list(chunk[0]) + _sentiment_columns)
+                    csv.writeheader()
+                hashes = [message_hash(row[column]) for row in chunk]
+                new = {key: row[column] for key, row in zip(hashes, chunk) if key not in scores}
+                if new:
+                    found = cache.get_many(list(new))
+                    stats["cached"] += len(found)
+                    scores.update((key, loads(result)) for key, result in found.items())
+                    missing = [(key, text) for key, text in new.items() if key not in found]
+                    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+                    for scored in ex.map(sentiment_batch, batches):
+                        cache.put_many(scored)
+                        scores.update((key, loads(result)) for key, result in scored)
+                        stats["scored"] += len(scored)
+                for key, row in zip(hashes, chunk):
+                    row["polarity"], row["subjectivity"] = scores[key]
+                    csv.writerow(row)
+                stats["rows"] += len(chunk)
+                log.debug(f"Rows scored: {stats['rows']}")
+    finally:
+        cache.close()
+    stats["distinct"] = len(scores)
+    log.info(f"Sentiment of {stats['rows']} rows in {time() - start:.2f}s: {stats}")
+    return stats
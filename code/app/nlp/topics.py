@@ -0,0 +1,168 @@
+"""
+Topic-count sweep for nlp/4-topic-modeling.ipynb: the sparse corpus built by
+app.nlp.cleaning is loaded once, put in shared memory and every candidate
+num_topics is trained in its own process (or one after another with LdaMulticore),
+scored on u_mass coherence and timed.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from json import dump
+from math import log as ln
+from multiprocessing.shared_memory import SharedMemory
+from os import makedirs
+from os.path import dirname
+from time import time
+from typing import Dict, List, Optional
+
+from app import lazy_logger, logging_setup
+from app.nlp.cleaning import load_dtm
+
+log = lazy_logger(name="nlp_topics", **logging_setup)
+
+_top_words = 10
+
+
+class SharedCSR:
+    """
+    A CSR matrix whose data/indices/indptr arrays live in shared memory, so worker
+    processes can map it instead of receiving a pickled copy
+    """
+    def __init__(self, matrix=None, spec: Optional[dict] = None):
+        self.__segments = []
+        self.__owner = spec is None
+        if spec is None:
+            spec = dict(shape=matrix.shape, arrays={})
+            for name in ("data", "indices", "indptr"):
+                source = getattr(matrix, name)
+                segment = SharedMemory(create=True, size=max(source.nbytes, 1))
+                self.__segments.append(segment)
+                spec["arrays"][name] = (segment.name, str(source.dtype), len(source))
+                self._view(segment, str(source.dtype), len(source))[:] = source
+        else:
+            for name, (segment_name, _, _) in spec["arrays"].items():
+                self.__segments.append(SharedMemory(name=segment_name))
+        self.spec = spec
+
+    @staticmethod
+    def _view(segment, dtype: str, length: int):
+        from numpy import ndarray
+
+        return ndarray((length,), dtype=dtype, buffer=segment.buf)
+
+    def matrix(self):
+        from scipy.sparse import csr_matrix
+
+        arrays = [
+            self._view(segment, dtype, length)
+            for segment, (_, dtype, length) in zip(self.__segments, self.spec["arrays"].values())
+        ]
+        return csr_matrix(tuple(arrays), shape=self.spec["shape"], copy=False)
+
+    def close(self):
+        for segment in self.__segments:
+            segment.close()
+            if self.__owner:
+                segment.unlink()
+        self.__segments = []
+
+
+def umass_coherence(binary_csc, topics: List[List[int]]) -> float:
+    """
+    Mean u_mass coherence (Mimno et al., 2011) of the topics' top words, computed
+    straight from the documents x terms matrix
+    """
+    scores = []
+    for top_ids in topics:
+        columns = binary_csc[:, top_ids]
+        document_frequency = columns.sum(axis=0).A1
+        co_document_frequency = (columns.T @ columns).toarray()
+        score = 0.0
+        for m in range(1, len(top_ids)):
+            for l in range(m):
+                if document_frequency[l]:
+                    score += ln((co_document_frequency[m, l] + 1) / document_frequency[l])
+        pairs = len(top_ids) * (len(top_ids) - 1) / 2
+        scores.append(score / pairs if pairs else 0.0)
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+_shared = None
+_id2word = None
+
+
+def _init_worker(spec: dict, id2word: Dict[int, str]):
+    global _shared, _id2word
+    _shared = SharedCSR(spec=spec)
+    _id2word = id2word
+
+
+def train(num_topics: int, passes: int, matrix, id2word: Dict[int, str], workers: int = 0, seed: int = 42) -> dict:
+    from gensim import matutils, models
+
+    start = time()
+    # matrix.T is a CSC (terms x documents) view over the same arrays, no copy
+    corpus = matutils.Sparse2Corpus(matrix.T, documents_columns=True)
+    if workers:
+        lda = models.LdaMulticore(
+            corpus=corpus, id2word=id2word, num_topics=num_topics, passes=passes, workers=workers, random_state=seed
+        )
+    else:
+        lda = models.LdaModel(corpus=corpus, id2word=id2word, num_topics=num_topics, passes=passes, random_state=seed)
+    seconds = time() - start
+    topics = [[term_id for term_id, _ in lda.get_topic_terms(t, topn=_top_words)] for t in range(num_topics)]
+    binary = matrix.copy()
+    binary.data[:] = 1
+    coherence = umass_coherence(binary.tocsc(), topics)
+    result = dict(
+        num_topics=num_topics,
+        passes=passes,
+        coherence=round(coherence, 4),
+        seconds=round(seconds, 2),
+        topics=[[id2word[term_id] for term_id in top_ids] for top_ids in topics],
+    )
+    log.info(f"num_topics={num_topics} passes={passes} | u_mass={coherence:.4f} | {seconds:.2f}s")
+    return result
+
+
+def _train_shared(args: tuple) -> dict:
+    num_topics, passes = args
+    return train(num_topics, passes, _shared.matrix(), _id2word)
+
+
+def sweep(
+        dtm_dir: str,
+        topic_counts: List[int],
+        passes: List[int],
+        max_workers: int = 4,
+        multicore: bool = False,
+        report_file: Optional[str] = None,
+        kind: str = "",
+) -> List[dict]:
+    """
+    passes holds one value for every topic count, or a single value for all of them
+    """
+    if len(passes) == 1:
+        passes = passes * len(topic_counts)
+    if len(passes) != len(topic_counts):
+        raise ValueError("passes must have one value or one per topic count")
+    matrix, vocabulary = load_dtm(dtm_dir, kind=kind)
+    id2word = {column: term for term, column in vocabulary.items()}
+    start = time()
+    if multicore:
+        results = [train(k, p, matrix, id2word, workers=max_workers) for k, p in zip(topic_counts, passes)]
+    else:
+        shared = SharedCSR(matrix)
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=min(max_workers, len(topic_counts)),
+                    initializer=_init_worker,
+                    initargs=(shared.spec, id2word),
+            ) as ex:
+                results = list(ex.map(_train_shared, zip(topic_counts, passes)))
+        finally:
+            shared.close()
+    log.info(f"Topic sweep over {topic_counts} done in {time() - start:.2f}s")
+    if report_file:
+        makedirs(dirname(report_file) or ".", exist_ok=True)
+        with open(report_file, "w", encoding="utf-8") as f:
+            dump(dict(wall_seconds=round(time() - start, 2), models=results), f, indent=2)
+    return results
@@ -0,0 +1,172 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+from os import cpu_count, getloadavg
+from threading import Lock
+from time import monotonic, process_time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="parallel", **logging_setup)
+
+# Set from the command line: --max-concurrency and --fixed-concurrency
+_ceiling: Optional[int] = None
+_adaptive = True
+
+_min_window = 8  # tasks
+_min_window_seconds = 1.0
+_error_tolerance = 0.05
+_min_gain = 0.03  # a step up has to buy this much more throughput to be kept
+_hold_windows = 5  # windows to wait before probing again after a step back
+_load_saturation = 1.0
+_gil_saturation = 0.9
+
+
+def bounded_map(ex: Executor, fn: Callable, iterable: Iterable, max_pending: int) -> Iterator:
+    """
+    Like ex.map(fn, iterable), in order, but with at most max_pending tasks submitted
+    at a time: Executor.map() consumes the whole iterable upfront, which defeats
+    streaming inputs that do not fit in memory.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(ex.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def default_ceiling(initial: int) -> int:
+    return _ceiling or max(initial, 4 * (cpu_count() or 1))
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD pool size: after every window of completed tasks the limit grows by one, is
+    halved when tasks fail or throttling is signalled (403, 5xx, clone failures), and
+    steps back when the last step up did not raise throughput (then waits a few windows
+    before probing again). It does not grow while the machine (load average) or the
+    interpreter (one core of process CPU, for GIL-bound threads) is saturated.
+    """
+    def __init__(self, name: str, initial: int, ceiling: Optional[int] = None, floor: int = 1):
+        self.name = name
+        self.ceiling = max(ceiling or default_ceiling(initial), floor)
+        self.floor = floor
+        self.limit = min(max(initial, floor), self.ceiling)
+        self.__lock = Lock()
+        self.__last_change = 0
+        self.__last_throughput = None
+        self.__hold = 0
+        self.__reset_window()
+
+    def __reset_window(self):
+        self.__done = 0
+        self.__errors = 0
+        self.__started = monotonic()
+        self.__cpu_started = process_time()
+
+    def record(self, ok: bool = True):
+        with self.__lock:
+            self.__done += 1
+            self.__errors += not ok
+            if self.__done >= max(_min_window, self.limit) and monotonic() - self.__started >= _min_window_seconds:
+                self.__adjust()
+
+    def throttled(self):
+        """
+        Signalled from inside a task, e.g. on an HTTP 403 or 5xx it retries itself
+        """
+        with self.__lock:
+            self.__errors += 1
+
+    def saturated(self, elapsed: float) -> bool:
+        cpus = cpu_count() or 1
+        try:
+            if getloadavg()[0] / cpus >= _load_saturation:
+                return True
+        except OSError:
+            pass
+        return (process_time() - self.__cpu_started) / elapsed >= _gil_saturation
+
+    def __adjust(self):
+        elapsed = max(monotonic() - self.__started, 1e-6)
+        throughput = self.__done / elapsed
+        limit = self.limit
+        if self.__errors > max(1, _error_tolerance * self.__done):
+            limit = max(self.floor, limit // 2)
+            reason = f"{self.__errors} errors"
+        elif self.__last_change > 0 and throughput < self.__last_throughput * (1 + _min_gain):
+            limit = max(self.floor, limit - 1)
+            reason = "no gain"
+            self.__hold = _hold_windows
+        elif self.__hold:
+            self.__hold -= 1
+            reason = "holding"
+        elif self.saturated(elapsed):
+            reason = "saturated"
+        else:
+            limit = min(self.ceiling, limit + 1)
+            reason = "growing"
+        if _adaptive and limit != self.limit:
+            log.info(f"{self.name} | concurrency {self.limit} -> {limit} ({reason}, {throughput:.2f} tasks/s)")
+            self.__last_change = limit - self.limit
+            self.limit = limit
+        else:
+            self.__last_change = 0
+        self.__last_throughput = throughput
+        self.__reset_window()
+
+
+_controllers: Dict[str, AdaptiveConcurrency] = {}
+_controllers_lock = Lock()
+
+
+def controller(name: str, initial: int, ceiling: Optional[int] = None) -> AdaptiveConcurrency:
+    """
+    The process-wide controller of a kind of work ("github", "clone", "scan"), so what
+    one pool learns carries over to the next pool of the same kind
+    """
+    with _controllers_lock:
+        if name not in _controllers:
+            _controllers[name] = AdaptiveConcurrency(name, initial, ceiling)
+        return _controllers[name]
+
+
+def throttled(name: str):
+    """
+    Throttling signal for the controller of name, if one is running
+    """
+    if (c := _controllers.get(name)) is not None:
+        c.throttled()
+
+
+def adaptive_map(
+        fn: Callable,
+        iterable: Iterable,
+        concurrency: AdaptiveConcurrency,
+        is_error: Callable = lambda result: False,
+) -> Iterator:
+    """
+    Like ThreadPoolExecutor.map(fn, iterable), in order, with at most concurrency.limit
+    tasks running at a time; is_error(result) tells failed tasks apart (exceptions
+    always count as failures)
+    """
+    def done(future):
+        concurrency.record(future.exception() is None and not is_error(future.result()))
+
+    pending = deque()
+    running = set()
+    # The limit only moves when _adaptive: otherwise this is a fixed pool
+    with ThreadPoolExecutor(max_workers=concurrency.ceiling if _adaptive else concurrency.limit) as ex:
+        for item in iterable:
+            while len(running) >= concurrency.limit:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+            future = ex.submit(fn, item)
+            future.add_done_callback(done)
+            pending.append(future)
+            running.add(future)
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictWriter
+from json import dump, load
+from os import makedirs
+from os.path import exists, getsize
+from subprocess import run
+from typing import List
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="radon_metrics", **logging_setup)
+
+_radon_path = "output/radon_raw_json"
+_csv_fieldnames = ["repo", "lloc", "radon_fails"]
+
+
+def radon_json_file(repo: str, radon_path: str = _radon_path) -> str:
+    return f"{radon_path}/{repo.replace('/', '.')}.json"
+
+
+def radon_raw(repo: str, radon_path: str = _radon_path) -> int:
+    """
+    Python counterpart of radon_raw.zsh: dumps `radon raw -s -j` of a cloned repository
+    (relative to the current directory) into radon_path/<owner>.<repo>.json
+    """
+    json_file = radon_json_file(repo, radon_path)
+    if exists(json_file) and getsize(json_file):
+        log.info(f"Skip: {repo}")
+        return 0
+    try:
+        result = run(["radon", "raw", "-s", "-j", "-O", json_file, repo], capture_output=True, text=True)
+    except FileNotFoundError:
+        log.error("radon executable not found (pip install radon)")
+        return 127
+    if result.returncode:
+        log.error(f"{repo} | radon exited with {result.returncode} | {result.stderr.strip()}")
+    else:
+        log.info(f"Done: {repo}")
+    return result.returncode
+
+
+def read_radon_raw(repo: str, radon_path: str = _radon_path) -> dict:
+    with open(radon_json_file(repo, radon_path), encoding="utf-8") as f:
+        files = load(f)
+    lloc = sum(metrics["lloc"] for metrics in files.values() if "lloc" in metrics)
+    fails = sum(1 for metrics in files.values() if "error" in metrics)
+    return dict(repo=repo, lloc=lloc, radon_fails=fails)
+
+
+def lloc_all(repos: List[str], radon_path: str = _radon_path, max_workers: int = 4) -> List[dict]:
+    makedirs(radon_path, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return_codes = list(ex.map(lambda repo: radon_raw(repo, radon_path), repos))
+    rows = []
+    for repo, return_code in zip(repos, return_codes):
+        if return_code == 0 and exists(radon_json_file(repo, radon_path)):
+            rows.append(read_radon_raw(repo, radon_path))
+    return rows
+
+
+def write_lloc(rows: List[dict], output_file: str, output_format: str = "csv"):
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        if output_format == "json":
+            dump(dict(repos=rows), fp=f)
+        else:
+            csv = DictWriter(f, fieldnames=_csv_fieldnames)
+            csv.writeheader()
+            csv.writerows(rows)
@@ -0,0 +1,277 @@
+"""
+Compact binary encoding of logger_finder() rows, for shard files and for passing rows
+between processes: each batch interns repo, path, logger_object, method and verbosity
+into one string table, keeps line and level in typed arrays and full_content as one
+UTF-8 buffer with offsets. A file is a header followed by length-prefixed batches,
+each optionally compressed (zstd when the zstandard package is installed, else zlib),
+and is read back through mmap, batch by batch.
+
+    $ python -m app scan --repos-list selected_repos --records logger_calls.rec
+    $ python -m app records output/logger_calls.rec --csv output/logger_calls.csv
+"""
+from array import array
+from mmap import ACCESS_READ, mmap
+from struct import Struct
+from sys import byteorder
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+
+from app import lazy_logger, logging_setup
+from app.nlp import read_chunks
+
+log = lazy_logger(name="records", **logging_setup)
+
+_magic = b"LGREC\x00\x01\x00"
+_frame = Struct("<IB")  # payload length, codec
+_batch_header = Struct("<IIc")  # rows, strings, typecode of the string indexes
+_codecs = {None: 0, "zstd": 1, "zlib": 2}
+_codec_names = {v: k for k, v in _codecs.items()}
+
+interned_columns = ("repo", "path", "logger_object", "method", "verbosity")
+integer_columns = ("line", "level")
+record_columns = ("repo", "path", "line", "logger_object", "method", "verbosity", "level", "full_content")
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _little_endian(values: array) -> bytes:
+    if byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(typecode: str, buffer: memoryview, offset: int, count: int) -> Tuple[array, int]:
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(buffer[offset:end])
+    if byteorder == "big":
+        values.byteswap()
+    return values, end
+
+
+def _integer(value) -> int:
+    # -1 stands for a missing line/level (e.g. "" in a CSV)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def encode_batch(rows: List[dict]) -> bytes:
+    """
+    Uncompressed payload of one batch of rows
+    """
+    strings: Dict[str, int] = {}
+    indexes = {c: array("I", (strings.setdefault(row[c] or "", len(strings)) for row in rows)) for c in interned_columns}
+    table = [s.encode("utf-8", errors="surrogateescape") for s in strings]
+    typecode = "H" if len(table) <= 0xFFFF else "I"
+
+    texts = [(row["full_content"] or "").encode("utf-8", errors="surrogateescape") for row in rows]
+    parts = [_batch_header.pack(len(rows), len(table), typecode.encode())]
+    for blobs in (table, texts):
+        offsets = array("I", [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        parts += [_little_endian(offsets), b"".join(blobs)]
+    parts += [_little_endian(array(typecode, indexes[c])) for c in interned_columns]
+    parts += [_little_endian(array("i", (_integer(row[c]) for row in rows))) for c in integer_columns]
+    return b"".join(parts)
+
+
+class RecordBatch:
+    """
+    Columns of one decoded batch; strings are only decoded when asked for
+    """
+    def __init__(self, payload: memoryview):
+        n_rows, n_strings, typecode = _batch_header.unpack_from(payload)
+        offset = _batch_header.size
+        string_offsets, offset = _read_array("I", payload, offset, n_strings + 1)
+        self.__table = bytes(payload[offset:offset + string_offsets[-1]])
+        self.__string_offsets = string_offsets
+        offset += string_offsets[-1]
+        self.__text_offsets, offset = _read_array("I", payload, offset, n_rows + 1)
+        self.__texts = bytes(payload[offset:offset + self.__text_offsets[-1]])
+        offset += self.__text_offsets[-1]
+        self.__indexes = {}
+        for column in interned_columns:
+            self.__indexes[column], offset = _read_array(typecode.decode(), payload, offset, n_rows)
+        self.__integers = {}
+        for column in integer_columns:
+            self.__integers[column], offset = _read_array("i", payload, offset, n_rows)
+        self.__len = n_rows
+
+    def __len__(self) -> int:
+        return self.__len
+
+    def strings(self) -> List[str]:
+        o = self.__string_offsets
+        return [self.__table[o[i]:o[i + 1]].decode("utf-8", errors="surrogateescape") for i in range(len(o) - 1)]
+
+    def column(self, name: str) -> list:
+        if name in self.__integers:
+            return [None if v == -1 else v for v in self.__integers[name]]
+        if name == "full_content":
+            o = self.__text_offsets
+            return [self.__texts[o[i]:o[i + 1]].decode("utf-8", errors="surrogateescape") for i in range(self.__len)]
+        strings = self.strings()
+        return [strings[i] for i in self.__indexes[name]]
+
+    def rows(self) -> List[dict]:
+        columns = [self.column(c) for c in record_columns]
+        return [dict(zip(record_columns, values)) for values in zip(*columns)]
+
+
+def compress_payload(payload: bytes, compression: Optional[str] = "zstd", level: int = 3) -> Tuple[bytes, int]:
+    """
+    (frame payload, codec); zstd falls back to zlib when zstandard is not installed
+    """
+    if compression == "zstd":
+        if (zstandard := _zstandard()) is not None:
+            return zstandard.ZstdCompressor(level=level).compress(payload), _codecs["zstd"]
+        compression = "zlib"
+    if compression == "zlib":
+        return zlib_compress(payload, min(level * 2, 9)), _codecs["zlib"]
+    return payload, _codecs[None]
+
+
+def decompress_payload(payload: memoryview, codec: int) -> memoryview:
+    name = _codec_names.get(codec, "?")
+    if name is None:
+        return payload
+    if name == "zlib":
+        return memoryview(zlib_decompress(payload))
+    if name == "zstd":
+        if (zstandard := _zstandard()) is None:
+            raise RuntimeError("zstd-compressed records need the zstandard package (pip install zstandard)")
+        return memoryview(zstandard.ZstdDecompressor().decompress(payload))
+    raise ValueError(f"Unknown record codec {codec}")
+
+
+def encode_frame(rows: List[dict], compression: Optional[str] = "zstd", level: int = 3) -> bytes:
+    """
+    One length-prefixed batch, as written to files (or sent to another process)
+    """
+    payload, codec = compress_payload(encode_batch(rows), compression, level)
+    return _frame.pack(len(payload), codec) + payload
+
+
+def decode_frame(frame: bytes) -> RecordBatch:
+    length, codec = _frame.unpack_from(frame)
+    return RecordBatch(decompress_payload(memoryview(frame)[_frame.size:_frame.size + length], codec))
+
+
+class RecordWriter:
+    """
+    Appends one batch per write_rows() call (a repository's rows, or a chunk of a CSV)
+    """
+    def __init__(self, file_name: str, compression: Optional[str] = "zstd", level: int = 3, append: bool = False):
+        self.file_name = file_name
+        self.compression = compression
+        self.level = level
+        self.rows = 0
+        self.bytes = 0
+        self.__lock = Lock()
+        self.__file = open(file_name, "ab" if append else "wb")
+        if self.__file.tell() == 0:
+            self.__file.write(_magic)
+        if compression == "zstd" and _zstandard() is None:
+            log.warning("zstandard is not installed: records are compressed with zlib")
+
+    def write_rows(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        frame = encode_frame(rows, self.compression, self.level)
+        with self.__lock:
+            self.__file.write(frame)
+            self.rows += len(rows)
+            self.bytes += len(frame)
+        return len(rows)
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class RecordReader:
+    """
+    Memory-mapped: batches are located from their length prefixes and decoded one at a
+    time, so files larger than memory can be streamed
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.__file = open(file_name, "rb")
+        self.__map = mmap(self.__file.fileno(), 0, access=ACCESS_READ)
+        if self.__map[:len(_magic)] != _magic:
+            self.close()
+            raise ValueError(f"{file_name} is not a records file")
+
+    def batches(self) -> Iterator[RecordBatch]:
+        offset = len(_magic)
+        while offset < len(self.__map):
+            length, codec = _frame.unpack_from(self.__map, offset)
+            offset += _frame.size
+            # RecordBatch copies what it keeps: no view of the map outlives this step,
+            # so the reader can be closed between batches
+            with memoryview(self.__map) as buffer:
+                batch = RecordBatch(decompress_payload(buffer[offset:offset + length], codec))
+            offset += length
+            yield batch
+
+    def __iter__(self) -> Iterator[dict]:
+        for batch in self.batches():
+            yield from batch.rows()
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_record_chunks(file_name: str) -> Iterator[List[dict]]:
+    """
+    Same shape as app.nlp.read_chunks(): the rows of one batch at a time
+    """
+    with RecordReader(file_name) as reader:
+        for batch in reader.batches():
+            yield batch.rows()
+
+
+def is_records_file(file_name: str) -> bool:
+    with open(file_name, "rb") as f:
+        return f.read(len(_magic)) == _magic
+
+
+def read_call_chunks(file_name: str, chunk_size: int = 10000) -> Iterator[List[dict]]:
+    """
+    Chunks of logger-call rows from either a CSV or a records file
+    """
+    if is_records_file(file_name):
+        return read_record_chunks(file_name)
+    return read_chunks(file_name, chunk_size)
+
+
+def write_records(rows: Iterable[List[dict]], file_name: str, compression: Optional[str] = "zstd") -> int:
+    with RecordWriter(file_name, compression) as writer:
+        for chunk in rows:
+            writer.write_rows(chunk)
+        log.info(f"{writer.rows} rows written to {file_name} ({writer.bytes} bytes)")
+        return writer.rows
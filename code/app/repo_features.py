@@ -0,0 +1,124 @@
+"""
+Per-repository features of the bulk CSV (data_processing._csv_fieldnames) collected
+during the logger scan itself: imports of each logging library come from the same
+read of a .py file that finds its logger calls, container manifests from the same
+file walk (or git tree listing). One row per repository, joinable on "repo".
+"""
+from csv import DictReader, DictWriter
+from re import MULTILINE, compile
+from threading import Lock
+from typing import FrozenSet, List
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="repo_features", **logging_setup)
+
+logging_libraries = ["logging", "daiquiri", "eliot", "logbook", "loguru", "logzero", "pysimplelog", "structlog", "twiggy"]
+manifest_columns = ["dockerfile", "docker-compose", ".kube", "configmap"]
+feature_columns = manifest_columns + logging_libraries
+
+regex_import = compile(
+    rb"^[ \t]*(?:from[ \t]+(?P<module>\w+)[\w.]*[ \t]+import\b|import[ \t]+(?P<modules>[\w. \t,]+))",
+    MULTILINE,
+)
+_logging_libraries = frozenset(logging_libraries)
+
+
+def manifest_clues(name: str, kind: str = "blob") -> List[str]:
+    """
+    Container-manifest columns a file (blob) or directory (tree) name is a clue for
+    """
+    name = name.lower()
+    clues = []
+    if kind == "blob":
+        if name == "dockerfile" or name.startswith("dockerfile.") or name.endswith(".dockerfile"):
+            clues.append("dockerfile")
+        if name.startswith(("docker-compose", "compose.")) and name.endswith((".yml", ".yaml")):
+            clues.append("docker-compose")
+        if "configmap" in name:
+            clues.append("configmap")
+    elif kind == "tree" and name == ".kube":
+        clues.append(".kube")
+    return clues
+
+
+def imports_of(data: bytes) -> FrozenSet[str]:
+    """
+    Logging libraries imported by a Python source (any `import x` / `from x import`,
+    including the ones nested in functions)
+    """
+    if b"import" not in data:
+        return frozenset()
+    found = set()
+    for match in regex_import.finditer(data):
+        if match.group("module"):
+            modules = [match.group("module")]
+        else:
+            modules = [m.split()[0].split(b".")[0] for m in match.group("modules").split(b",") if m.strip()]
+        found.update(m.decode("ascii", errors="replace") for m in modules)
+    return frozenset(found & _logging_libraries)
+
+
+class RepoFeatures:
+    """
+    Counters of one repository: files importing each logging library and manifest
+    files (.kube directories) found. Updated from the scan's worker threads.
+    """
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.__counts = dict.fromkeys(feature_columns, 0)
+        self.__lock = Lock()
+
+    def add_path(self, path: str):
+        """
+        path of any file of the repository, as the walk or `git ls-tree` lists it
+        """
+        *directories, name = path.split("/")
+        clues = manifest_clues(name) + [c for d in directories for c in manifest_clues(d, kind="tree")]
+        if clues:
+            with self.__lock:
+                for clue in clues:
+                    self.__counts[clue] += 1
+
+    def add_imports(self, libraries: FrozenSet[str]):
+        if libraries:
+            with self.__lock:
+                for library in libraries:
+                    self.__counts[library] += 1
+
+    def row(self) -> dict:
+        with self.__lock:
+            return dict(repo=self.repo, **self.__counts)
+
+
+def new_features_csv(csv_file: str):
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        DictWriter(f, fieldnames=["repo"] + feature_columns).writeheader()
+
+
+def append_features(csv_file: str, features: RepoFeatures):
+    with open(csv_file, "a", encoding="utf-8", newline="") as f:
+        DictWriter(f, fieldnames=["repo"] + feature_columns).writerow(features.row())
+
+
+def join_features(bulk_csv: str, features_csv: str, output_file: str) -> dict:
+    """
+    Copies bulk_csv to output_file with the feature columns of every scanned repository
+    replaced by the scan's counts; other rows are left as they are
+    """
+    with open(features_csv, encoding="utf-8", newline="") as f:
+        features = {row["repo"]: row for row in DictReader(f)}
+    stats = dict(rows=0, joined=0)
+    with open(bulk_csv, encoding="utf-8", newline="") as f_in, \
+            open(output_file, "w", encoding="utf-8", newline="") as f_out:
+        csv_in = DictReader(f_in)
+        csv_out = DictWriter(f_out, fieldnames=csv_in.fieldnames)
+        csv_out.writeheader()
+        for row in csv_in:
+            stats["rows"] += 1
+            if row["repo"] in features:
+                stats["joined"] += 1
+                row.update((c, features[row["repo"]][c]) for c in feature_columns if c in row)
+            csv_out.writerow(row)
+    log.info(f"Features of {stats['joined']}/{stats['rows']} repositories joined into {output_file}")
+    return stats
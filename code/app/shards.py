@@ -0,0 +1,108 @@
+"""
+Deterministic sharding of the repository list, so the scan can be spread across hosts:
+
+    host-0$ python -m app scan --repos-list selected_repos --shard 0/3
+    host-1$ python -m app scan --repos-list selected_repos --shard 1/3
+    host-2$ python -m app scan --repos-list selected_repos --shard 2/3
+    $ python -m app merge --output logger_calls.csv output/logger_calls.shard-*-of-3.csv
+"""
+from concurrent.futures import ProcessPoolExecutor
+from csv import DictReader, DictWriter
+from glob import glob
+from hashlib import sha1
+from typing import Iterable, List, Tuple
+
+from app import lazy_logger, logging_setup
+
+log = lazy_logger(name="shards", **logging_setup)
+
+_key_columns = ("repo", "path", "line")
+
+
+def shard_of(repo: str, shards: int) -> int:
+    # sha1 instead of hash(): str hashes are salted per process (PYTHONHASHSEED)
+    return int(sha1(repo.strip().lower().encode("utf-8")).hexdigest(), 16) % shards
+
+
+def select_shard(repos: Iterable[str], shard: int, shards: int) -> List[str]:
+    return [repo for repo in repos if shard_of(repo, shards) == shard]
+
+
+def parse_shard(shard_str: str) -> Tuple[int, int]:
+    """
+    "1/4" -> (1, 4); shards are numbered from 0
+    """
+    try:
+        shard, shards = (int(s) for s in shard_str.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like <index>/<count>, got {shard_str!r}")
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard index must be in [0, {shards}), got {shard}")
+    return shard, shards
+
+
+def shard_file_name(file_name: str, shard: int, shards: int) -> str:
+    stem, dot, extension = file_name.rpartition(".")
+    if not dot:
+        stem, extension = file_name, ""
+    return f"{stem}.shard-{shard}-of-{shards}{dot}{extension}"
+
+
+def merge_shards(inputs: List[str], output: str, key_columns: Tuple[str, ...] = _key_columns) -> dict:
+    """
+    Concatenates shard CSVs into output, dropping rows whose key columns were already
+    written (e.g. a repo scanned twice after a shard was re-run on another host).
+    """
+    files = sorted({f for pattern in inputs for f in glob(pattern)})
+    seen = set()
+    stats = dict(files=len(files), rows=0, duplicates=0)
+    fieldnames = None
+    with open(output, "w", encoding="utf-8", newline="") as out:
+        csv_out = None
+        for file_ in files:
+            with open(file_, encoding="utf-8", newline="") as f:
+                csv_in = DictReader(f)
+                if csv_out is None:
+                    fieldnames = csv_in.fieldnames
+                    csv_out = DictWriter(out, fieldnames=fieldnames)
+                    csv_out.writeheader()
+                elif csv_in.fieldnames != fieldnames:
+                    log.error(f"Skipping {file_}: columns differ from {files[0]}")
+                    continue
+                for row in csv_in:
+                    key = tuple(row[c] for c in key_columns)
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    csv_out.writerow(row)
+                    stats["rows"] += 1
+            log.info(f"Merged: {file_}")
+    log.info(f"Merged {stats['files']} shards into {output}: {stats['rows']} rows, {stats['duplicates']} duplicates")
+    return stats
+
+
+def _scan_shard(args: tuple):
+    from app import logger_parser
+
+    repos, shard, shards, csv_name, scan_kwargs, paths = args
+    for name in ("features_csv", "store_db", "metrics_state", "records_file"):
+        if scan_kwargs.get(name):
+            scan_kwargs = dict(scan_kwargs, **{name: shard_file_name(scan_kwargs[name], shard, shards)})
+    logger_parser.setup_paths(**paths)
+    logger_parser.scan(
+        select_shard(repos, shard, shards),
+        csv_name=shard_file_name(csv_name, shard, shards),
+        **scan_kwargs,
+    )
+    return shard
+
+
+def scan_local_shards(repos: List[str], shards: int, csv_name: str, paths: dict, **scan_kwargs) -> List[str]:
+    """
+    Runs every shard in its own process, standing in for separate hosts
+    """
+    jobs = [(repos, shard, shards, csv_name, scan_kwargs, paths) for shard in range(shards)]
+    with ProcessPoolExecutor(max_workers=shards) as ex:
+        list(ex.map(_scan_shard, jobs))
+    return [shard_file_name(csv_name, shard, shards) for shard in range(shards)]
@@ -0,0 +1,126 @@
+from collections import Counter
+from re import ASCII, IGNORECASE, compile
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+# Every method name regex_logger_verbosity_call can capture (lower-cased), mapped
+# to the verbosity normalize_verbosity() used to find with up to six re.match calls
+verbosity_table = {
+    "debug": "DEBUG",
+    "info": "INFO",
+    "warn": "WARNING",
+    "warning": "WARNING",
+    "except": "ERROR",
+    "exception": "ERROR",
+    "error": "ERROR",
+    "fatal": "CRITICAL",
+    "crit": "CRITICAL",
+    "critic": "CRITICAL",
+    "critical": "CRITICAL",
+    "log": "log",
+}
+
+verbosity_levels = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+    "CRITICAL": 50,
+    "OTHER": 99,
+}
+
+# Same alternatives as the old guess_verbosity() pattern, without the leading ".*":
+# no level word ends with a letter another one starts with, so the last
+# non-overlapping match is the one the greedy ".*" used to backtrack to
+regex_level_word = compile(
+    r"fatal|crit(ic(al)?)?|except(ion)?|error|warn(ing)?|info|debug",
+    IGNORECASE | ASCII,
+)
+regex_level_prefix = compile(
+    r"(?P<DEBUG>debug)|(?P<INFO>info)|(?P<WARNING>warn)|(?P<ERROR>except|error)|(?P<CRITICAL>fatal|crit)|(?P<log>log)",
+    IGNORECASE | ASCII,
+)
+
+
+class VerbosityCounter:
+    """
+    Thread-safe aggregate of classified statements per verbosity
+    """
+    def __init__(self):
+        self.__counts = Counter()
+        self.__lock = Lock()
+
+    def add(self, verbosity: str, n: int = 1):
+        with self.__lock:
+            self.__counts[verbosity] += n
+
+    def update(self, verbosities: Iterable[str]):
+        batch = Counter(verbosities)
+        with self.__lock:
+            self.__counts.update(batch)
+
+    def __getitem__(self, verbosity: str) -> int:
+        with self.__lock:
+            return self.__counts[verbosity]
+
+    def as_dict(self) -> Dict[str, int]:
+        with self.__lock:
+            return dict(self.__counts)
+
+
+# "log" calls seen (method == "log"), plus the verbosity they were resolved to
+verbosity_counter = VerbosityCounter()
+
+
+def normalize_verbosity(verbosity: str) -> str:
+    try:
+        return verbosity_table[verbosity.lower()]
+    except KeyError:
+        # Not a name the call regex produces: fall back to the old prefix rules
+        if prefix_match := regex_level_prefix.match(verbosity):
+            return prefix_match.lastgroup
+        return "OTHER"
+
+
+def get_verbosity_level(verbosity: str) -> int:
+    return verbosity_levels[verbosity]
+
+
+def guess_verbosity(content: str) -> str:
+    level_word = None
+    for word_match in regex_level_word.finditer(content):
+        # ".*" never crossed a newline: the old pattern kept to the first matching line
+        if level_word and content.find("\n", level_word.end(), word_match.start()) != -1:
+            break
+        level_word = word_match
+    if level_word:
+        return normalize_verbosity(level_word.group())
+    return "OTHER"
+
+
+def classify(methods: List[str], contents: List[str]) -> Tuple[List[str], List[int]]:
+    """
+    Column-wise verbosity classification: methods go through the lookup table and the
+    contents of log(level, ...) calls are resolved once per distinct content.
+    Returns the verbosity and level columns.
+    """
+    verbosities = [verbosity_table.get(method) or normalize_verbosity(method) for method in methods]
+    log_rows = [i for i, verbosity in enumerate(verbosities) if verbosity == "log"]
+    if log_rows:
+        guessed = {content: guess_verbosity(content) for content in {contents[i] for i in log_rows}}
+        for i in log_rows:
+            verbosities[i] = guessed[contents[i]]
+        verbosity_counter.add("log", len(log_rows))
+    verbosity_counter.update(verbosities)
+    return verbosities, [verbosity_levels[verbosity] for verbosity in verbosities]
+
+
+def classify_rows(rows: List[dict]) -> List[dict]:
+    """
+    Fills the verbosity and level columns of logger_finder() rows in place
+    """
+    verbosities, levels = classify([row["method"] for row in rows], [row["full_content"] for row in rows])
+    for row, verbosity, level in zip(rows, verbosities, levels):
+        row["verbosity"] = verbosity
+        row["level"] = level
+    return rows